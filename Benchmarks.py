@@ -0,0 +1,648 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import Data_Generator
+from Inventory_Management import (Inventory, Customer, Machines, MachineRecord, FailureSimulator, haversine,
+                                  haversine_matrix, plan_route)
+
+
+def time_per_call(func, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        func(i)
+    return (time.perf_counter() - start) / repeat
+
+
+def print_results(title, rows):
+    print(title)
+    print(f"{'operation':<32}{'before (us)':>14}{'after (us)':>14}{'speedup':>10}")
+    for name, before, after in rows:
+        print(f"{name:<32}{before * 1e6:>14.1f}{after * 1e6:>14.1f}{before / after:>9.1f}x")
+
+
+def build_database(directory, **options):
+    db_file = os.path.join(directory, 'bench.db')
+    inventory = Inventory(db_file=db_file, **options)
+    customer = Customer(db_file=db_file)
+    machines = Machines(db_file=db_file)
+    inventory.populate_inventory('inventoryList.txt')
+    customer.populate_customers('customerList.txt')
+    machines.populate_machines('machinesList.txt')
+    return db_file, inventory, customer, machines
+
+
+def benchmark_connections(args):
+    """ Per-operation latency of the original connect-per-call code against
+    the pooled ConnectionManager path, on the shipped fixture data. """
+    repeat = args.repeat
+    with tempfile.TemporaryDirectory() as directory:
+        db_file, inventory, customer, machines = build_database(directory, lookup_cache_size=0)
+        legacy_file = os.path.join(directory, 'legacy.db')
+        inventory.connection().execute(f"VACUUM INTO '{legacy_file}'")
+        legacy = sqlite3.connect(legacy_file)
+        legacy.execute('PRAGMA journal_mode = DELETE')
+        legacy.close()
+
+        def legacy_query(sql, params):
+            conn = sqlite3.connect(legacy_file)
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+            conn.close()
+            return rows
+
+        def legacy_write(sql, params):
+            conn = sqlite3.connect(legacy_file)
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            conn.commit()
+            conn.close()
+
+        item_count = len(inventory.query('SELECT id FROM inventory'))
+        deduct_sql = 'UPDATE inventory SET quantity = quantity - ? WHERE id = ?'
+        operations = [
+            ('get_items_by_type',
+             lambda i: legacy_query('SELECT * FROM inventory WHERE machine_type = ?', ('Kiosk',)),
+             lambda i: inventory.get_items_by_type('Kiosk')),
+            ('check_quantity_available',
+             lambda i: legacy_query('SELECT quantity FROM inventory WHERE id = ?', (i % item_count + 1,)),
+             lambda i: inventory.check_quantity_available(i % item_count + 1, 1)),
+            ('deduct_inventory_quantity',
+             lambda i: legacy_write(deduct_sql, (0, i % item_count + 1)),
+             lambda i: inventory.deduct_inventory_quantity(i % item_count + 1, 0)),
+            ('get_coordinates_by_id',
+             lambda i: legacy_query('SELECT latitude, longitude FROM customers WHERE id = ?', (i % 7 + 1,)),
+             lambda i: customer.get_coordinates_by_id(i % 7 + 1)),
+        ]
+
+        results = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            for name, before, after in operations:
+                results.append((name, time_per_call(before, repeat), time_per_call(after, repeat)))
+        inventory.close()
+
+    print_results(f"Connection pooling ({repeat} calls per operation)", results)
+
+
+def benchmark_cache(args):
+    """ Repeated parts-by-type and coordinate lookups with the read-through
+    caches off and on, alone and mixed with stock deductions that
+    invalidate entries. """
+    repeat = args.repeat
+    with tempfile.TemporaryDirectory() as directory:
+        paths = Data_Generator.generate(directory, customers=10000, inventory=1000, machines=0)
+        db_file = os.path.join(directory, 'cache.db')
+        Inventory(db_file=db_file).populate_inventory(paths['inventory'])
+        Customer(db_file=db_file).populate_customers(paths['customer'])
+        # A "file:" URI names the same database but gets its own manager,
+        # so the uncached entities don't share the cached ones' caches.
+        uncached = (Inventory(db_file=f'file:{db_file}', rebuild=False, lookup_cache_size=0),
+                    Customer(db_file=f'file:{db_file}', rebuild=False))
+        cached = (Inventory(db_file=db_file, rebuild=False), Customer(db_file=db_file, rebuild=False))
+        types = Data_Generator.MACHINE_TYPES
+
+        def operations(inventory, customer):
+            return [
+                ('get_items_by_type', lambda i: inventory.get_items_by_type(types[i % len(types)])),
+                ('get_coordinates_by_id', lambda i: customer.get_coordinates_by_id(i * 7919 % 500 + 1)),
+                ('lookups + 5% deductions', lambda i: inventory.deduct_inventory_quantity(i % 1000 + 1, 0)
+                 if i % 20 == 0 else inventory.get_items_by_type(types[i % len(types)])),
+            ]
+
+        results = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            for (name, off), (_, on) in zip(operations(*uncached), operations(*cached)):
+                results.append((name, time_per_call(off, repeat), time_per_call(on, repeat)))
+        stats = cached[0].db.cache_stats()
+        for entity in uncached + cached[:1]:
+            entity.close()
+
+    print_results(f"Lookup caches ({repeat} calls per operation; before = off, after = on)", results)
+    for name, cache in stats.items():
+        print(f"{name}: {cache['hits']:,} hits, {cache['misses']:,} misses ({cache['hit_ratio']:.1%}), "
+              f"{cache['invalidations']:,} invalidations")
+
+
+def benchmark_reports(args):
+    """ Catalog and fleet rollups computed by scanning the tables against
+    reading the trigger-maintained summaries, and what the triggers add
+    to repairs. """
+    repeat = max(1, args.repeat // 100)
+    with tempfile.TemporaryDirectory() as directory:
+        paths = Data_Generator.generate(directory, max(10, args.rows // 10), max(15, args.rows // 100), args.rows)
+        db_file = os.path.join(directory, 'reports.db')
+        inventory, machines = Inventory(db_file=db_file), Machines(db_file=db_file)
+        inventory.populate_inventory(paths['inventory'])
+        Customer(db_file=db_file).populate_customers(paths['customer'])
+        machines.populate_machines(paths['machines'])
+        machines.generate_machine_issues(args.rows // 100)
+
+        def distinct_machines(i):
+            return sorted(set(machines.query('SELECT DISTINCT manufacturer, name FROM machines')))
+
+        operations = [
+            ('machine catalog', distinct_machines, lambda i: machines.catalog()),
+            ('fleet by type', lambda i: machines.query(
+                'SELECT machine_type, COUNT(*), SUM(status = "Need Repair") FROM machines GROUP BY machine_type'),
+             lambda i: machines.fleet_by_type()),
+            ('customer fleet', lambda i: machines.query_one(
+                'SELECT COUNT(*), SUM(status = "Need Repair") FROM machines WHERE customer_id = ?', (i % 100 + 1,)),
+             lambda i: machines.customer_fleet(i % 100 + 1)),
+            ('inventory value', lambda i: inventory.query(
+                'SELECT machine_type, COUNT(*), SUM(quantity), SUM(price * quantity) FROM inventory '
+                'GROUP BY machine_type'), lambda i: inventory.inventory_value()),
+        ]
+        results = [(name, time_per_call(before, repeat), time_per_call(after, repeat))
+                   for name, before, after in operations]
+
+        inventory.execute('UPDATE inventory SET quantity = 1000000 WHERE id = 1')
+        machine_ids = [machine.id for machine in machines.get_machines_by_status('Need Repair')]
+        jobs = [{'machine_id': machine_id, 'item_id': 1, 'quantity': 1} for machine_id in machine_ids]
+
+        def repair_all():
+            start = time.perf_counter()
+            repaired = sum(result['status'] == 'repaired' for result in machines.apply_repairs(jobs))
+            assert repaired == len(jobs)
+            return time.perf_counter() - start
+
+        with_triggers = repair_all()
+        machines.mark_need_repair(machine_ids)
+        with machines.transaction() as conn:
+            for name in machines.aggregates:
+                conn.execute(f'DROP TRIGGER {name}_update')
+        without_triggers = repair_all()
+        machines.close()
+
+    print_results(f"Reports over {args.rows:,} machines ({repeat} calls per operation; before = scan, "
+                  f"after = summary table)", results)
+    print(f"{len(jobs):,} repairs: {without_triggers:.3f}s without summary triggers, {with_triggers:.3f}s with")
+
+
+def benchmark_startup(args):
+    """ Wall-clock cold start of the program (launched, then told to quit)
+    on generated data: first launch, relaunch, --fast relaunch and --fast
+    restoring a snapshot in place of a missing database. """
+    program = os.path.abspath('Inventory_Management.py')
+    with tempfile.TemporaryDirectory() as directory:
+        Data_Generator.generate(directory, max(10, args.rows // 10), max(15, args.rows // 100), args.rows)
+
+        def launch(*options):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, *options], cwd=directory, input='quit\n', text=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+            return time.perf_counter() - start
+
+        def remove_database():
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(os.path.join(directory, 'inventory.db' + suffix)):
+                    os.remove(os.path.join(directory, 'inventory.db' + suffix))
+
+        results = [('import only', launch('-c', f'import sys; sys.path.insert(0, {os.path.dirname(program)!r}); '
+                                                'import Inventory_Management'))]
+        results.append(('first launch', launch(program, '--snapshot', 'snapshot.db')))
+        results.append(('relaunch', launch(program)))
+        results.append(('relaunch --fast', launch(program, '--fast')))
+        remove_database()
+        results.append(('--fast from snapshot', launch(program, '--fast', '--snapshot', 'snapshot.db')))
+
+    print(f"Cold start with {args.rows:,} machines")
+    for name, seconds in results:
+        print(f"{name:<24}{seconds * 1000:>10.0f} ms")
+
+
+def benchmark_records(args):
+    """ Memory and load time of the machines table held as tuples, dicts,
+    MachineRecord objects and the columnar form. """
+    with tempfile.TemporaryDirectory() as directory:
+        paths = Data_Generator.generate(directory, max(10, args.rows // 10), 15, args.rows)
+        machines = Machines(db_file=os.path.join(directory, 'records.db'))
+        machines.populate_machines(paths['machines'])
+        sql = 'SELECT * FROM machines'
+        fields = MachineRecord.__slots__
+        forms = [
+            ('tuples', lambda: machines.query(sql)),
+            ('dicts', lambda: [dict(zip(fields, row)) for row in machines.connection().execute(sql)]),
+            ('MachineRecord', lambda: machines.query_records(sql)),
+            ('columnar', lambda: machines.column_arrays()),
+        ]
+
+        print(f"Machines table with {args.rows:,} rows in memory")
+        print(f"{'form':<16}{'MiB':>10}{'bytes/row':>12}{'load (s)':>10}")
+        for name, load in forms:
+            start = time.perf_counter()
+            rows = load()
+            seconds = time.perf_counter() - start
+            del rows
+            # Measured separately: tracing allocations slows the load down.
+            tracemalloc.start()
+            rows = load()
+            size = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            del rows
+            print(f"{name:<16}{size / 2 ** 20:>10.1f}{size / args.rows:>12.0f}{seconds:>10.2f}")
+        machines.close()
+
+
+def write_machines_file(file_path, rows):
+    with open('machinesList.txt') as file:
+        template = [line.strip().split(',') for line in file if line.strip()]
+    with open(file_path, 'w') as file:
+        for i in range(rows):
+            values = list(template[i % len(template)])
+            values[3] = f"{values[3]}-{i}"
+            file.write(','.join(values) + '\n')
+
+
+def benchmark_ingest(args):
+    """ Rows/sec of the original row-at-a-time insert loop against the
+    chunked executemany loader, serial, with worker processes and reading
+    a cached parse of the file. """
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, 'machines.txt')
+        write_machines_file(source, args.rows)
+
+        legacy_file = os.path.join(directory, 'legacy.db')
+        Machines(db_file=legacy_file).close()
+        start = time.perf_counter()
+        with open(source, 'r') as file:
+            conn = sqlite3.connect(legacy_file)
+            cursor = conn.cursor()
+            for line in file:
+                values = list(map(str.strip, line.split(',')))
+                cursor.execute(
+                    'INSERT INTO machines (customer_id, manufacturer, name, machine_type, serial_number, status)'
+                    ' VALUES (?, ?, ?, ?, ?, ?)', (values[5], values[0], values[1], values[2], values[3], values[4]))
+            conn.commit()
+            conn.close()
+        legacy_seconds = time.perf_counter() - start
+
+        print(f"Ingest of {args.rows} machine rows")
+        print(f"{'row-at-a-time':<24}{args.rows / legacy_seconds:>14,.0f} rows/sec")
+        for workers in sorted({1, args.workers}):
+            machines = Machines(db_file=os.path.join(directory, f'bulk-{workers}.db'))
+            report = machines.populate_machines(source, workers=workers)
+            print(f"{f'bulk, {workers} worker(s)':<24}{report.rows_per_sec:>14,.0f} rows/sec")
+            machines.close()
+        for run in ('first', 'cached'):
+            machines = Machines(db_file=os.path.join(directory, f'parse-cache-{run}.db'))
+            report = machines.populate_machines(source, cache_dir=os.path.join(directory, 'parse-cache'))
+            print(f"{f'bulk, parse cache {run}':<24}{report.rows_per_sec:>14,.0f} rows/sec")
+            machines.close()
+
+
+def benchmark_distances(args):
+    """ All-pairs distances over random sites: scalar haversine calls
+    against the vectorized haversine_matrix. """
+    rng = random.Random(0)
+    points = [(rng.uniform(38.5, 39.5), rng.uniform(-77.8, -76.6)) for _ in range(args.sites)]
+
+    start = time.perf_counter()
+    scalar = [[haversine(point1, point2) for point2 in points] for point1 in points]
+    scalar_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matrix = haversine_matrix(points)
+    matrix_seconds = time.perf_counter() - start
+
+    error = max(abs(scalar[i][j] - matrix[i][j]) for i in range(0, args.sites, 97) for j in range(args.sites))
+    print(f"All-pairs distances for {args.sites} sites ({args.sites ** 2:,} pairs)")
+    print(f"{'scalar haversine':<24}{scalar_seconds:>10.3f}s")
+    print(f"{'haversine_matrix':<24}{matrix_seconds:>10.3f}s  ({scalar_seconds / matrix_seconds:.0f}x, "
+          f"max error {error:.2e} mi)")
+
+
+def benchmark_route(args):
+    """ Tour length and runtime of the repair route planner against
+    visiting the same random stops in the order they were listed. """
+    rng = random.Random(0)
+    start = (38.9, -77.2)
+    print(f"{'stops':>8}{'naive (mi)':>14}{'planned (mi)':>14}{'saving':>9}{'runtime':>10}")
+    for stops in args.stops:
+        points = [(rng.uniform(38.5, 39.5), rng.uniform(-77.8, -76.6)) for _ in range(stops)]
+        path = [start] + points
+        naive = sum(haversine(a, b) for a, b in zip(path, path[1:]))
+
+        begin = time.perf_counter()
+        _, planned = plan_route(points, start, time_limit=args.time_limit)
+        runtime = time.perf_counter() - begin
+        print(f"{stops:>8}{naive:>14.1f}{planned:>14.1f}{1 - planned / naive:>9.1%}{runtime:>9.3f}s")
+
+
+def benchmark_spatial(args):
+    """ Radius and k-nearest queries through the customers R*Tree against a
+    full table scan with a haversine call per row. """
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as directory:
+        customer = Customer(db_file=os.path.join(directory, 'spatial.db'))
+        with customer.transaction() as conn:
+            conn.executemany(
+                'INSERT INTO customers (name, address, phone_number, operating_hours, latitude, longitude) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                ((f'Site {i}', '', '', '8AM-5PM', rng.uniform(25.0, 49.0), rng.uniform(-124.0, -67.0))
+                 for i in range(args.customers)))
+
+        point = (38.9, -77.0)
+        start = time.perf_counter()
+        scan = [row for row in customer.query('SELECT * FROM customers') if haversine(point, row[-2:]) <= 25]
+        scan_seconds = time.perf_counter() - start
+
+        queries = 100
+        start = time.perf_counter()
+        for _ in range(queries):
+            within = customer.customers_within(point, 25)
+        within_seconds = (time.perf_counter() - start) / queries
+
+        start = time.perf_counter()
+        for _ in range(queries):
+            customer.nearest_customers(point, 10)
+        nearest_seconds = (time.perf_counter() - start) / queries
+        customer.close()
+
+    assert len(scan) == len(within)
+    print(f"Spatial queries over {args.customers:,} customers ({len(within)} within 25 mi)")
+    print(f"{'full scan, 25 mi':<24}{scan_seconds * 1000:>10.2f} ms")
+    print(f"{'R*Tree, 25 mi':<24}{within_seconds * 1000:>10.2f} ms")
+    print(f"{'R*Tree, 10 nearest':<24}{nearest_seconds * 1000:>10.2f} ms")
+
+
+def benchmark_batch(args):
+    """ Jobs/sec of headless batch repairs at several transaction sizes. """
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"Batch repair of {args.rows:,} jobs")
+        for batch_size in (1, 100, 1000, 10000):
+            machines = Machines(db_file=os.path.join(directory, f'batch-{batch_size}.db'))
+            Inventory(db_file=machines.db_file)
+            with machines.transaction() as conn:
+                conn.execute("INSERT INTO inventory (id, item_name, price, quantity, machine_type) "
+                             "VALUES (1, 'Part', 1.0, ?, 'Kiosk')", (args.rows,))
+                conn.executemany("INSERT INTO machines (customer_id, manufacturer, name, machine_type, serial_number, "
+                                 "status) VALUES (1, 'Avanti', 'Kiosk', 'Kiosk', ?, 'Need Repair')",
+                                 ((str(i),) for i in range(args.rows)))
+            jobs = [{'machine_id': i + 1, 'item_id': 1, 'quantity': 1} for i in range(args.rows)]
+
+            start = time.perf_counter()
+            repaired = sum(result['status'] == 'repaired' for result in machines.apply_repairs(jobs, batch_size))
+            seconds = time.perf_counter() - start
+            assert repaired == args.rows
+            print(f"{f'batch size {batch_size}':<24}{args.rows / seconds:>14,.0f} jobs/sec")
+            machines.close()
+
+
+def benchmark_memory(args):
+    """ Jobs/sec of batch repairs on disk against an in-memory database
+    saving background snapshots, and the time one snapshot takes. """
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"Batch repair of {args.rows:,} jobs")
+        print(f"{'database':<24}{'batch size':>12}{'jobs/sec':>14}{'snapshots':>11}{'snapshot ms':>13}")
+        for batch_size in (1, 1000):
+            for mode in ('disk', 'memory'):
+                if mode == 'disk':
+                    machines = Machines(db_file=os.path.join(directory, f'disk-{batch_size}.db'))
+                else:
+                    machines = Machines(db_file=':memory:', snapshot_path=os.path.join(directory, 'memory.db'),
+                                        snapshot_interval=1.0)
+                Inventory(db_file=machines.db_file)
+                with machines.transaction() as conn:
+                    conn.execute("INSERT INTO inventory (id, item_name, price, quantity, machine_type) "
+                                 "VALUES (1, 'Part', 1.0, ?, 'Kiosk')", (args.rows,))
+                    conn.executemany("INSERT INTO machines (customer_id, manufacturer, name, machine_type, "
+                                     "serial_number, status) VALUES (1, 'Avanti', 'Kiosk', 'Kiosk', ?, 'Need Repair')",
+                                     ((str(i),) for i in range(args.rows)))
+                jobs = [{'machine_id': i + 1, 'item_id': 1, 'quantity': 1} for i in range(args.rows)]
+
+                start = time.perf_counter()
+                repaired = sum(result['status'] == 'repaired' for result in machines.apply_repairs(jobs, batch_size))
+                seconds = time.perf_counter() - start
+                assert repaired == args.rows
+                snapshots, snapshot_ms = '-', '-'
+                if mode == 'memory':
+                    snapshots = machines.db.snapshots
+                    snapshot_start = time.perf_counter()
+                    machines.db.snapshot()
+                    snapshot_ms = f'{(time.perf_counter() - snapshot_start) * 1000:.1f}'
+                print(f"{mode:<24}{batch_size:>12}{args.rows / seconds:>14,.0f}{snapshots:>11}{snapshot_ms:>13}")
+                machines.close()
+
+
+def benchmark_dispatch(args):
+    """ Dispatch time and quality for a day of repairs across many
+    technicians, building routes inline and in a process pool. """
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as directory:
+        paths = Data_Generator.generate(directory, customers=5000, inventory=1000, machines=50000)
+        db_file = os.path.join(directory, 'dispatch.db')
+        customer, machines = Customer(db_file=db_file), Machines(db_file=db_file)
+        Inventory(db_file=db_file).populate_inventory(paths['inventory'])
+        customer.populate_customers(paths['customer'])
+        machines.populate_machines(paths['machines'])
+        machines.generate_machine_issues(args.jobs, rng)
+        starts = list(customer.get_coordinates_by_ids(rng.sample(range(1, 5001), args.technicians)).values())
+
+        print(f"Dispatching {args.jobs:,} repairs to {len(starts)} technicians")
+        for workers in sorted({1, args.workers}):
+            start = time.perf_counter()
+            routes, unassigned = machines.dispatch(starts, workers=workers)
+            seconds = time.perf_counter() - start
+            scheduled = sum(len(stop['jobs']) for route in routes for stop in route['stops'])
+            print(f"{f'{workers} worker(s)':<16}{seconds:>8.2f}s  {scheduled:,} scheduled, {len(unassigned):,} "
+                  f"unassigned, {sum(route['distance'] for route in routes):,.0f} miles")
+        machines.close()
+
+
+def benchmark_soak(args):
+    """ Run the seeded failure simulator over generated data, repairing as
+    it goes, and report throughput and database growth. """
+    with tempfile.TemporaryDirectory() as directory:
+        paths = Data_Generator.generate(directory, max(10, args.rows // 10), max(15, args.rows // 100), args.rows)
+        db_file = os.path.join(directory, 'soak.db')
+        inventory, machines = Inventory(db_file=db_file), Machines(db_file=db_file)
+        inventory.populate_inventory(paths['inventory'])
+        machines.populate_machines(paths['machines'])
+        size = os.path.getsize(db_file)
+        simulator = FailureSimulator(machines, inventory, seed=0, repairs_per_step=args.rows // 500,
+                                     restock_to=100)
+
+        print(f"Soak test: {args.steps} simulated days over {args.rows:,} machines")
+        print(f"{'step':>6}{'failed':>10}{'repaired':>10}{'rejected':>10}{'waiting':>10}{'ms':>10}{'DB MiB':>10}")
+        totals = {'failed': 0, 'repaired': 0, 'rejected': 0, 'seconds': 0.0}
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            for step in simulator.run(args.steps):
+                for name in totals:
+                    totals[name] += getattr(step, name)
+                if step.step % max(1, args.steps // 10) == 0:
+                    print(f"{step.step:>6}{step.failed:>10}{step.repaired:>10}{step.rejected:>10}{step.waiting:>10}"
+                          f"{step.seconds * 1000:>10.1f}{os.path.getsize(db_file) / 2 ** 20:>10.1f}",
+                          file=sys.__stdout__)
+        growth = os.path.getsize(db_file) - size
+        machines.close()
+
+    seconds = totals['seconds']
+    print(f"{totals['failed']:,} failures and {totals['repaired'] + totals['rejected']:,} repair jobs in "
+          f"{seconds:.2f}s ({(totals['repaired'] + totals['rejected']) / seconds:,.0f} jobs/sec, "
+          f"{args.steps / seconds:,.1f} steps/sec); database grew {growth / 2 ** 20:.1f} MiB")
+
+
+def scaling_operations(inventory, customer, machines, paths, size):
+    """ (name, function, calls) for every public entity method, in the order
+    they run. Entries named None are untimed setup steps. """
+    broken = min(size, 1000)
+    point = (38.9, -77.0)
+    jobs = []
+    pending_jobs = lambda: machines.query('SELECT machines.id, MIN(inventory.id), 1 FROM machines INNER JOIN inventory '
+                                          'ON inventory.machine_type = machines.machine_type '
+                                          'WHERE machines.status = "Need Repair" GROUP BY machines.id')
+    operations = [
+        ('Inventory.populate_inventory', lambda i: inventory.populate_inventory(paths['inventory']), 1),
+        ('Customer.populate_customers', lambda i: customer.populate_customers(paths['customer']), 1),
+        ('Machines.populate_machines', lambda i: machines.populate_machines(paths['machines']), 1),
+        ('Machines.sync (first)', lambda i: machines.sync(paths['machines']), 1),
+        ('Machines.sync (unchanged)', lambda i: machines.sync(paths['machines']), 1),
+        (None, lambda i: inventory.execute('UPDATE inventory SET quantity = 1000000'), 1),
+        ('Machines.generate_machine_issues', lambda i: machines.generate_machine_issues(), 1),
+        (None, lambda i: machines.execute('UPDATE machines SET status = "Need Repair" WHERE id <= ?', (broken,)), 1),
+        ('Inventory.display_inventory', lambda i: inventory.display_inventory(), 1),
+        ('Inventory.get_items_by_type', lambda i: inventory.get_items_by_type('Kiosk'), 100),
+        ('Inventory.check_quantity_available', lambda i: inventory.check_quantity_available(i % 15 + 1, 1), 100),
+        ('Inventory.deduct_inventory_quantity', lambda i: inventory.deduct_inventory_quantity(i % 15 + 1, 1), 100),
+        ('Inventory.search', lambda i: inventory.search('kiosk'), 100),
+        ('Inventory.inventory_value', lambda i: inventory.inventory_value(), 100),
+        ('Customer.display_customers', lambda i: customer.display_customers(), 1),
+        ('Customer.get_coordinates_by_id', lambda i: customer.get_coordinates_by_id(i % 10 + 1), 100),
+        ('Customer.distance_between', lambda i: customer.distance_between(1, i % 9 + 2), 100),
+        ('Customer.customers_within', lambda i: customer.customers_within(point, 25), 20),
+        ('Customer.nearest_customers', lambda i: customer.nearest_customers(point, 10), 20),
+        ('Customer.search', lambda i: customer.search('summit tech'), 100),
+        ('Machines.display_machines', lambda i: machines.display_machines(), 1),
+        ('Machines.display_distinct_machines', lambda i: machines.display_distinct_machines(), 1),
+        ('Machines.fleet_by_type', lambda i: machines.fleet_by_type(), 100),
+        ('Machines.customer_fleet', lambda i: machines.customer_fleet(i % 10 + 1), 100),
+        ('Machines.display_machines_repair', lambda i: machines.display_machines_repair(), 1),
+        ('Machines.get_machines_by_status', lambda i: machines.get_machines_by_status('Need Repair'), 1),
+        ('Machines.machines_within', lambda i: machines.machines_within(point, 25, status='Need Repair'), 20),
+        ('Machines.nearest_machines', lambda i: machines.nearest_machines(point, 10, machine_type='Kiosk'), 20),
+        ('Machines.search', lambda i: machines.search(f'{i + 1:08d}'), 100),
+        ('Machines.repair_stops', lambda i: machines.repair_stops(), 1),
+        ('Machines.plan_repair_route', lambda i: machines.plan_repair_route(point, time_limit=0.2), 1),
+        (None, lambda i: jobs.extend(pending_jobs()), 1),
+        ('Machines.apply_repair', lambda i: machines.apply_repair(*jobs[i]), min(100, broken // 2)),
+        ('Machines.apply_repairs', lambda i: list(machines.apply_repairs(
+            {'machine_id': job[0], 'item_id': job[1], 'quantity': job[2]} for job in jobs[broken // 2:])), 1),
+        ('Machines.display_service_history', lambda i: machines.display_service_history(), 1),
+        ('Machines.service_history_by_machine', lambda i: machines.service_history_by_machine(i + 1), 100),
+        ('Machines.parts_consumed_per_month', lambda i: machines.parts_consumed_per_month(), 10),
+    ]
+    if len(customer.query('SELECT id FROM customers LIMIT 5001')) <= 5000:
+        operations.append(('Customer.distance_matrix', lambda i: customer.distance_matrix(), 1))
+    return operations
+
+
+def run_scaling_suite(size, measure_memory):
+    """ Run every operation against freshly generated data of the given
+    size and return {name: seconds per call} or {name: peak KiB}. """
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        paths = Data_Generator.generate(directory, max(10, size // 10), max(15, size // 100), size)
+        db_file = os.path.join(directory, 'scaling.db')
+        inventory, customer, machines = Inventory(db_file=db_file), Customer(db_file=db_file), Machines(db_file=db_file)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            for name, func, calls in scaling_operations(inventory, customer, machines, paths, size):
+                if measure_memory and name:
+                    tracemalloc.start()
+                start = time.perf_counter()
+                for i in range(calls):
+                    func(i)
+                elapsed = time.perf_counter() - start
+                if measure_memory and name:
+                    results[name] = tracemalloc.get_traced_memory()[1] / 1024
+                    tracemalloc.stop()
+                elif name:
+                    results[name] = elapsed / calls
+        inventory.close()
+    return results
+
+
+def benchmark_scaling(args):
+    """ Time every public entity method (and its peak Python memory) on
+    generated data at each size, optionally comparing with a saved
+    baseline. """
+    baseline = {}
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    elif args.baseline:
+        print(f"No baseline at {args.baseline}; record one with --save-baseline first\n")
+
+    report = {}
+    for size in args.sizes:
+        timings = run_scaling_suite(size, measure_memory=False)
+        memory = run_scaling_suite(size, measure_memory=True)
+        report[str(size)] = {name: {'seconds': timings[name], 'peak_kib': memory[name]} for name in timings}
+
+        print(f"{size:,} machines")
+        print(f"{'operation':<40}{'ms/call':>12}{'peak KiB':>12}{'vs baseline':>14}")
+        for name, result in report[str(size)].items():
+            previous = baseline.get(str(size), {}).get(name)
+            comparison = ''
+            if previous:
+                ratio = result['seconds'] / previous['seconds']
+                comparison = f"{ratio:.2f}x" + (' SLOWER' if ratio > args.tolerance else '')
+            print(f"{name:<40}{result['seconds'] * 1000:>12.3f}{result['peak_kib']:>12.0f}{comparison:>14}")
+        print()
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+BENCHMARKS = {
+    'batch': benchmark_batch,
+    'cache': benchmark_cache,
+    'connections': benchmark_connections,
+    'dispatch': benchmark_dispatch,
+    'distances': benchmark_distances,
+    'ingest': benchmark_ingest,
+    'memory': benchmark_memory,
+    'records': benchmark_records,
+    'reports': benchmark_reports,
+    'route': benchmark_route,
+    'scaling': benchmark_scaling,
+    'soak': benchmark_soak,
+    'spatial': benchmark_spatial,
+    'startup': benchmark_startup,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for the Service Technician Management System")
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS) + ['all'])
+    parser.add_argument('--repeat', type=int, default=2000)
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--customers', type=int, default=1000000)
+    parser.add_argument('--sites', type=int, default=1000)
+    parser.add_argument('--technicians', type=int, default=300, help="technicians for the dispatch benchmark")
+    parser.add_argument('--jobs', type=int, default=5000, help="machines needing repair for the dispatch benchmark")
+    parser.add_argument('--steps', type=int, default=30, help="simulated days for the soak test")
+    parser.add_argument('--stops', type=int, nargs='+', default=[100, 1000, 3000])
+    parser.add_argument('--time-limit', type=float, default=0.5)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help="machine counts for the scaling suite")
+    parser.add_argument('--baseline', help="scaling results to compare against")
+    parser.add_argument('--save-baseline', help="write scaling results to this file")
+    parser.add_argument('--tolerance', type=float, default=1.5, help="slowdown flagged against the baseline")
+    args = parser.parse_args()
+
+    names = sorted(BENCHMARKS) if args.benchmark == 'all' else [args.benchmark]
+    for name in names:
+        BENCHMARKS[name](args)
+        print()
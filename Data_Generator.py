@@ -0,0 +1,115 @@
+import argparse
+import os
+import random
+
+# (city, state, ZIP prefix, latitude, longitude, weight): customers cluster
+# around metro areas in proportion to weight.
+METROS = [
+    ('Washington', 'DC', '200', 38.9072, -77.0369, 10),
+    ('McLean', 'VA', '221', 38.9339, -77.1773, 4),
+    ('Rockville', 'MD', '208', 39.0840, -77.1528, 4),
+    ('Baltimore', 'MD', '212', 39.2904, -76.6122, 6),
+    ('Richmond', 'VA', '232', 37.5407, -77.4360, 4),
+    ('Philadelphia', 'PA', '191', 39.9526, -75.1652, 8),
+    ('New York', 'NY', '100', 40.7128, -74.0060, 14),
+    ('Boston', 'MA', '021', 42.3601, -71.0589, 6),
+    ('Atlanta', 'GA', '303', 33.7490, -84.3880, 7),
+    ('Chicago', 'IL', '606', 41.8781, -87.6298, 9),
+    ('Dallas', 'TX', '752', 32.7767, -96.7970, 8),
+    ('Denver', 'CO', '802', 39.7392, -104.9903, 5),
+    ('Seattle', 'WA', '981', 47.6062, -122.3321, 6),
+    ('San Francisco', 'CA', '941', 37.7749, -122.4194, 7),
+    ('Los Angeles', 'CA', '900', 34.0522, -118.2437, 11),
+]
+COMPANY_WORDS = ['Summit', 'Harbor', 'Pioneer', 'Capitol', 'Evergreen', 'Liberty', 'Atlas', 'Beacon', 'Keystone',
+                 'Meridian', 'Granite', 'Riverside', 'Northstar', 'Union', 'Sterling', 'Oakwood']
+COMPANY_SUFFIXES = ['Technologies', 'Construction', 'Health', 'Logistics', 'Bank', 'University', 'Labs',
+                    'Hospital', 'Partners', 'Foods', 'Systems', 'Hotel']
+STREETS = ['Main Street', 'Market Street', 'Park Avenue', 'Commerce Drive', 'Technology Parkway', 'Center Road',
+           'Medical Center Drive', 'Industrial Boulevard', 'Lake Street', 'Westpark Drive']
+HOURS = ['6AM-2PM', '7AM-4PM', '7AM-4:30PM', '8AM-3:30PM', '8AM-5PM', '9AM-6PM', '10AM-7PM']
+
+# machine_type: ([(manufacturer, model), ...], [(part, description, price), ...])
+CATALOG = {
+    'Ice Maker': ([('Follet', '15 Series Ice Maker'), ('Follet', '7 Series Ice Maker'), ('Hoshizaki', 'KM-515')],
+                  [('Cleaner', 'Ice Machine Sanitizer', 37.50), ('Padding', 'Ice Machine Pad', 12.99),
+                   ('Panels', 'Ice Machine Panels', 39.99), ('Water Valve', 'Inlet Water Valve', 64.99)]),
+    'Kiosk': ([('Avanti', 'Executive Kiosk'), ('365', 'CountertopKiosk'), ('Avanti', 'Micro Market Kiosk')],
+              [('Touch Screen Board', 'Replacement Touchscreen Board', 12.99),
+               ('Touch Screen', 'Replacement TouchScreen Display', 450.34),
+               ('Fingerprint Reader', 'FingerPrint Reader for Kiosks', 89.99),
+               ('OptiPlex 3080', 'Micro Computer For Kiosks', 899.99)]),
+    'Coffee Machine': ([('Nespresso', 'Momento 200'), ('Bunn', 'Sure Immersion'), ('Fracino', 'Contempo')],
+                       [('Sanitizer', 'Coffee Machine Cleaner', 29.99), ('Motor', 'Coffee Machine Grinder', 99.99),
+                        ('Handle', 'Coffee Handler', 39.99)]),
+    'Cooler': ([('QBD', 'CK Series Cooler'), ('True', 'GDM-26')],
+               [('Shelf', 'Cooler Shelf', 10.99), ('Compressor', 'Cooler Compressor', 499.99),
+                ('Wheels', 'Cooler Wheels', 10.99)]),
+    'Water Dispenser': ([('Alpine', 'Bottleless Cooler'), ('Elkay', 'EZH2O')],
+                        [('Tips', 'Water Dispenser Tips', 4.99), ('Switch', 'Water Dispenser Switch', 10.99)]),
+}
+MACHINE_TYPES = sorted(CATALOG)
+
+
+def write_customers(file_path, count, rng):
+    """ Write count lines in customerList.txt format, spread around METROS. """
+    weights = [metro[5] for metro in METROS]
+    with open(file_path, 'w') as file:
+        for i in range(count):
+            city, state, zip_prefix, lat, lon, _ = rng.choices(METROS, weights)[0]
+            name = f"{rng.choice(COMPANY_WORDS)} {rng.choice(COMPANY_SUFFIXES)} {i + 1}"
+            street = f"{rng.randint(100, 9999)} {rng.choice(STREETS)}"
+            address = f"{street}, {city}, {state} {zip_prefix}{rng.randint(1, 99):02d}"
+            phone = f"({rng.randint(201, 989)}) {rng.randint(200, 999)}-{rng.randint(0, 9999):04d}"
+            latitude = lat + rng.gauss(0, 0.12)
+            longitude = lon + rng.gauss(0, 0.15)
+            file.write(f"{name},{address},{phone},{rng.choice(HOURS)},{latitude:.6f},{longitude:.6f}\n")
+
+
+def write_inventory(file_path, count, rng):
+    """ Write count lines in inventoryList.txt format. """
+    with open(file_path, 'w') as file:
+        for i in range(count):
+            machine_type = MACHINE_TYPES[i % len(MACHINE_TYPES)]
+            part, description, price = rng.choice(CATALOG[machine_type][1])
+            manufacturer = rng.choice(CATALOG[machine_type][0])[0]
+            file.write(f"{manufacturer} {part} {i + 1},{description},{price:.2f},{rng.randint(0, 100)},"
+                       f" {machine_type}\n")
+
+
+def write_machines(file_path, count, customers, rng):
+    """ Write count lines in machinesList.txt format, each installed at a
+    random customer ID between 1 and customers. """
+    with open(file_path, 'w') as file:
+        for i in range(count):
+            machine_type = rng.choice(MACHINE_TYPES)
+            manufacturer, model = rng.choice(CATALOG[machine_type][0])
+            serial_number = f"{manufacturer[:3].upper()}-{i + 1:08d}"
+            file.write(f"{manufacturer},{model},{machine_type},{serial_number},Good,{rng.randint(1, customers)}\n")
+
+
+def generate(directory, customers, inventory, machines, seed=0):
+    """ Write customerList.txt, inventoryList.txt and machinesList.txt of
+    the given sizes into directory and return their paths. """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    paths = {name: os.path.join(directory, f'{name}List.txt') for name in ('customer', 'inventory', 'machines')}
+    write_customers(paths['customer'], customers, rng)
+    write_inventory(paths['inventory'], inventory, rng)
+    write_machines(paths['machines'], machines, customers, rng)
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic customer, inventory and machine files")
+    parser.add_argument('directory')
+    parser.add_argument('--machines', type=int, default=100000)
+    parser.add_argument('--customers', type=int, help="default: one customer per 10 machines")
+    parser.add_argument('--inventory', type=int, help="default: one part per 100 machines, at least 15")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    paths = generate(args.directory, args.customers or max(1, args.machines // 10),
+                     args.inventory or max(15, args.machines // 100), args.machines, args.seed)
+    for path in paths.values():
+        print(path)
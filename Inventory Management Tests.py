@@ -1,7 +1,24 @@
 import pytest
 import sqlite3
+import asyncio
+import csv
+import io
+import itertools
+import json
+import multiprocessing
 import os
-from Inventory_Management import Inventory, Customer, Machines
+import random
+import shutil
+import threading
+from datetime import datetime
+from math import ceil
+from Inventory_Management import (Inventory, Customer, Machines, haversine, haversine_matrix, plan_route,
+                                  query_plan, full_table_scans, run_batch_repairs, Session, save_snapshot,
+                                  snapshot_problems, restore_snapshot, FailureSimulator,
+                                  parse_operating_hours)
+import Data_Generator
+from Inventory_Service import InventoryService
+from Load_Generator import fetch
 
 
 @pytest.fixture
@@ -120,3 +137,1053 @@ def test_display_machines(capsys, temp_machines_db):
     temp_machines_db.display_machines()
     captured = capsys.readouterr()
     assert captured.out.strip() == ''
+
+
+def test_connection_reused_per_thread(temp_inventory_db):
+    conn = temp_inventory_db.connection()
+    assert temp_inventory_db.connection() is conn
+
+    other = []
+    thread = threading.Thread(target=lambda: other.append(temp_inventory_db.connection()))
+    thread.start()
+    thread.join()
+    assert other[0] is not conn
+
+    # A thread's connection is closed when the thread exits.
+    assert temp_inventory_db.db._connections == [conn]
+    with pytest.raises(sqlite3.ProgrammingError):
+        other[0].execute('SELECT 1')
+    threads = [threading.Thread(target=lambda: temp_inventory_db.execute('UPDATE inventory SET quantity = 1'))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+        thread.join()
+    assert temp_inventory_db.db._connections == [conn]
+
+
+def test_connection_pragmas(temp_inventory_db):
+    conn = temp_inventory_db.connection()
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1
+
+
+def test_transaction_rolls_back_on_error(temp_inventory_db):
+    with pytest.raises(sqlite3.IntegrityError):
+        with temp_inventory_db.transaction() as conn:
+            conn.execute("INSERT INTO inventory (item_name, price, quantity, machine_type) "
+                         "VALUES ('Part', 1.0, 1, 'Kiosk')")
+            conn.execute("INSERT INTO inventory (item_name) VALUES ('Broken')")
+    assert temp_inventory_db.query_one('SELECT COUNT(*) FROM inventory')[0] == 0
+
+
+def test_bulk_load_report(temp_machines_db):
+    report = temp_machines_db.populate_machines('machinesList.txt', chunk_size=7)
+    assert report.rows == 50
+    assert report.rows_per_sec > 0
+
+
+def test_parallel_bulk_load_matches_serial(tmp_path, temp_machines_db):
+    file_path = tmp_path / 'machines.txt'
+    Data_Generator.write_machines(str(file_path), 2000, 10, random.Random(0))
+    lines = file_path.read_text().splitlines()
+    file_path.write_text('\n'.join(lines + ['not a machine'] * 3 + lines[500:501]) + '\n')
+    quarantine_path = tmp_path / 'machines.rejected.jsonl'
+
+    temp_machines_db.populate_machines(str(file_path), chunk_size=16)
+    serial = temp_machines_db.query('SELECT customer_id, serial_number, status FROM machines ORDER BY id')
+    serial_rejected = quarantine_path.read_text()
+    temp_machines_db.execute('DELETE FROM machines')
+    report = temp_machines_db.populate_machines(str(file_path), chunk_size=16, workers=2)
+    parallel = temp_machines_db.query('SELECT customer_id, serial_number, status FROM machines ORDER BY id')
+
+    assert (report.rows, report.rejected) == (len(lines), 4)
+    assert parallel == serial
+    assert quarantine_path.read_text() == serial_rejected
+    quarantined = [json.loads(line) for line in serial_rejected.splitlines()]
+    assert [entry['line'] for entry in quarantined] == [2001, 2002, 2003, 2004]
+    assert quarantined[-1]['reason'] == "serial_number: duplicate of line 501"
+
+
+def test_sync_applies_only_changes(tmp_path, temp_inventory_db):
+    source = tmp_path / 'inventory.txt'
+    source.write_text("Cleaner, Sanitizer, 37.50, 40, Ice Maker\n"
+                      "Padding, Ice Machine Pad, 12.99, 20, Ice Maker\n"
+                      "Shelf, Cooler Shelf, 10.99, 85, Cooler\n")
+    report = temp_inventory_db.sync(str(source))
+    assert report.inserted == 3
+
+    temp_inventory_db.execute("UPDATE inventory SET quantity = 35 WHERE item_name = 'Cleaner'")
+    assert temp_inventory_db.sync(str(source)).skipped
+
+    source.write_text("Cleaner, Sanitizer, 37.50, 40, Ice Maker\n"
+                      "Padding, Ice Machine Pad, 14.99, 20, Ice Maker\n"
+                      "Wheels, Cooler Wheels, 10.99, 8, Cooler\n")
+    report = temp_inventory_db.sync(str(source))
+    assert (report.inserted, report.updated, report.deleted, report.unchanged) == (1, 1, 1, 1)
+
+    rows = dict(temp_inventory_db.query('SELECT item_name, quantity FROM inventory'))
+    assert rows == {'Cleaner': 35, 'Padding': 20, 'Wheels': 8}
+
+
+def test_sync_keeps_rows_of_rejected_lines(tmp_path, temp_inventory_db):
+    source = tmp_path / 'inventory.txt'
+    source.write_text("Cleaner, Sanitizer, 37.50, 40, Ice Maker\n"
+                      "Shelf, Cooler Shelf, 10.99, 85, Cooler\n")
+    temp_inventory_db.sync(str(source))
+    temp_inventory_db.deduct_inventory_quantity(1, 5)
+    temp_inventory_db.set_reorder_point(1, 30, 50)
+
+    source.write_text("Cleaner, Sanitizer, -37.50, 40, Ice Maker\n"
+                      "Wheels, Cooler Wheels, 10.99, 8, Cooler\n")
+    report = temp_inventory_db.sync(str(source))
+    assert (report.inserted, report.deleted, report.rejected) == (1, 0, 1)
+    assert temp_inventory_db.query('SELECT item_name, quantity FROM inventory ORDER BY id') == [
+        ('Cleaner', 35), ('Shelf', 85), ('Wheels', 8)]
+    assert temp_inventory_db.query('SELECT item_id, reorder_point FROM stock_thresholds') == [(1, 30)]
+
+    # Once the file is clean again, keys missing from it are deleted.
+    source.write_text("Cleaner, Sanitizer, 37.50, 40, Ice Maker\n"
+                      "Wheels, Cooler Wheels, 10.99, 8, Cooler\n")
+    report = temp_inventory_db.sync(str(source))
+    assert (report.deleted, report.unchanged, report.rejected) == (1, 2, 0)
+
+    source.write_text("Cleaner, Sanitizer, 37.50, 40, Ice Maker\n"
+                      "Wheels, Cooler Wheels, 10.99, 8, Cooler\n"
+                      "Cleaner, Sanitizer, 39.50, 40, Ice Maker\n")
+    report = temp_inventory_db.sync(str(source))
+    assert (report.updated, report.unchanged, report.rejected) == (0, 2, 1)
+    quarantined = json.loads((tmp_path / 'inventory.rejected.jsonl').read_text())
+    assert (quarantined['line'], quarantined['reason']) == (3, "item_name, machine_type: duplicate of line 1")
+
+
+def test_sync_keeps_data_between_sessions(temp_inventory_db):
+    temp_inventory_db.sync('inventoryList.txt')
+    temp_inventory_db.deduct_inventory_quantity(1, 5)
+
+    reopened = Inventory(db_file=temp_inventory_db.db_file, rebuild=False)
+    assert reopened.sync('inventoryList.txt').skipped
+    assert reopened.query_one('SELECT quantity FROM inventory WHERE id = 1')[0] == 35
+
+
+def test_haversine_matrix_matches_scalar():
+    points = [(38.924759, -77.217178), (38.903240, -77.059700), (39.095610, -77.197190), (0.0, 0.0)]
+    matrix = haversine_matrix(points[:2], points, units="km")
+    for i, point1 in enumerate(points[:2]):
+        for j, point2 in enumerate(points):
+            assert matrix[i][j] == pytest.approx(haversine(point1, point2, units="km"), abs=1e-6)
+
+
+def test_distance_matrix_cache(tmp_path, temp_customer_db):
+    np = pytest.importorskip('numpy')
+    temp_customer_db.populate_customers('customerList.txt')
+    cache_dir = str(tmp_path / 'cache')
+
+    ids, matrix = temp_customer_db.distance_matrix(cache_dir=cache_dir)
+    assert isinstance(matrix, np.memmap)
+    assert matrix[0, 1] == pytest.approx(temp_customer_db.distance_between(ids[0], ids[1]))
+    assert temp_customer_db.distance_matrix(cache_dir=cache_dir)[1].filename == matrix.filename
+
+    temp_customer_db.execute('UPDATE customers SET latitude = latitude + 0.5 WHERE id = ?', (ids[0],))
+    _, updated = temp_customer_db.distance_matrix(cache_dir=cache_dir)
+    assert updated.filename != matrix.filename
+    assert os.listdir(cache_dir) == [os.path.basename(updated.filename)]
+
+
+def test_plan_route_matches_brute_force():
+    points = [(38.92, -77.21), (38.90, -77.05), (39.09, -77.19), (38.93, -76.72), (38.86, -77.36), (38.89, -77.02)]
+    start = (38.95, -77.10)
+    order, length = plan_route(points, start)
+
+    def path_length(visit):
+        path = [start] + [points[i] for i in visit]
+        return sum(haversine(a, b) for a, b in zip(path, path[1:]))
+
+    assert sorted(order) == list(range(len(points)))
+    assert length == pytest.approx(path_length(order))
+    assert length == pytest.approx(min(path_length(p) for p in itertools.permutations(range(len(points)))))
+
+
+def test_plan_repair_route(temp_machines_db):
+    customers = Customer(db_file=temp_machines_db.db_file)
+    customers.populate_customers('customerList.txt')
+    temp_machines_db.populate_machines('machinesList.txt')
+    temp_machines_db.execute('UPDATE machines SET status = "Need Repair" WHERE id IN (1, 2, 3, 9)')
+
+    route, distance = temp_machines_db.plan_repair_route(customers.get_coordinates_by_id(1))
+    assert sorted(machine_id for stop in route for machine_id in stop['machine_ids']) == [1, 2, 3, 9]
+    assert len({stop['customer_id'] for stop in route}) == len(route)
+    assert distance > 0
+
+
+def test_spatial_queries_match_brute_force(temp_customer_db):
+    rng = random.Random(0)
+    rows = [(f'Site {i}', 'Address', '', '8AM-5PM', rng.uniform(38.0, 40.0), rng.uniform(-78.0, -76.0))
+            for i in range(500)]
+    temp_customer_db.connection().executemany(
+        'INSERT INTO customers (name, address, phone_number, operating_hours, latitude, longitude) '
+        'VALUES (?, ?, ?, ?, ?, ?)', rows)
+    point = (39.0, -77.0)
+    distances = sorted((haversine(point, row[-2:]), row[0]) for row in rows)
+
+    within = temp_customer_db.customers_within(point, 20)
+    assert [row[1] for _, row in within] == [name for distance, name in distances if distance <= 20]
+
+    nearest = temp_customer_db.nearest_customers(point, 5)
+    assert [row[1] for _, row in nearest] == [name for _, name in distances[:5]]
+
+    temp_customer_db.execute("UPDATE customers SET latitude = 39.0, longitude = -77.0 WHERE name = 'Site 499'")
+    assert temp_customer_db.nearest_customers(point, 1)[0][1][1] == 'Site 499'
+
+
+def test_machines_within_filters(temp_machines_db):
+    customers = Customer(db_file=temp_machines_db.db_file)
+    customers.populate_customers('customerList.txt')
+    temp_machines_db.populate_machines('machinesList.txt')
+    temp_machines_db.execute('UPDATE machines SET status = "Need Repair" WHERE id IN (3, 4, 5)')
+    point = customers.get_coordinates_by_id(3)
+
+    broken = temp_machines_db.machines_within(point, 100, status='Need Repair')
+    assert sorted(row[0] for _, row in broken) == [3, 4, 5]
+    kiosks = temp_machines_db.machines_within(point, 100, status='Need Repair', machine_type='Kiosk')
+    assert sorted(row[0] for _, row in kiosks) == [3, 4]
+    assert temp_machines_db.nearest_machines(point, 1, machine_type='Kiosk')[0][1][1] == 3
+
+
+# Statements that read a whole table on purpose, keyed by whitespace-normalized SQL.
+ALLOWED_FULL_SCANS = {
+    'SELECT * FROM inventory ORDER BY inventory.id LIMIT 1000': {'inventory'},
+    'SELECT * FROM customers ORDER BY customers.id LIMIT 1000': {'customers'},
+    'SELECT id, latitude, longitude FROM customers ORDER BY id': {'customers'},
+    'SELECT machine_id, item_id, quantity_used, repair_date FROM service_history ORDER BY id': {'service_history'},
+    'SELECT machines.id, customers.name, machines.manufacturer, machines.name, machines.machine_type, '
+    'machines.serial_number, machines.status FROM machines INNER JOIN customers ON machines.customer_id = '
+    'customers.id ORDER BY machines.id LIMIT 1000': {'machines'},
+    # low_stock only holds the items below their reorder point.
+    'SELECT item_id FROM low_stock': {'low_stock'},
+    'SELECT low_stock.item_id, inventory.item_name, low_stock.machine_type, low_stock.quantity, '
+    'low_stock.reorder_point, low_stock.since FROM low_stock INNER JOIN inventory ON inventory.id = '
+    'low_stock.item_id WHERE NULL IS NULL OR low_stock.machine_type = NULL ORDER BY low_stock.since DESC, '
+    'low_stock.item_id': {'low_stock'},
+    'SELECT low_stock.item_id, inventory.item_name, low_stock.machine_type, low_stock.quantity, '
+    'low_stock.reorder_point, low_stock.since FROM low_stock INNER JOIN inventory ON inventory.id = '
+    "low_stock.item_id WHERE 'Kiosk' IS NULL OR low_stock.machine_type = 'Kiosk' ORDER BY low_stock.since DESC, "
+    'low_stock.item_id': {'low_stock'},
+    # Summary tables hold one row per machine model or type.
+    'SELECT manufacturer, name, machines FROM machine_catalog ORDER BY manufacturer, name': {'machine_catalog'},
+    'SELECT machine_type, machines, need_repair FROM fleet_by_type ORDER BY machine_type': {'fleet_by_type'},
+    'SELECT machine_type, items, quantity, value FROM inventory_value ORDER BY machine_type': {'inventory_value'},
+}
+
+
+def run_entity_workload(monkeypatch, inventory, customer, machines):
+    inventory.sync('inventoryList.txt')
+    customer.sync('customerList.txt')
+    machines.sync('machinesList.txt')
+    machines.execute('UPDATE machines SET status = "Need Repair" WHERE id IN (1, 3, 5)')
+    machines.generate_machine_issues()
+
+    inventory.display_inventory()
+    inventory.display_inventory(inventory.get_items_by_type('Kiosk'))
+    _, token = inventory.rows_page(limit=2, where='machine_type = ?', params=('Kiosk',))
+    inventory.rows_page(token, limit=2, where='machine_type = ?', params=('Kiosk',))
+    inventory.check_quantity_available(1, 1)
+    inventory.deduct_inventory_quantity(1, 1)
+    customer.display_customers()
+    point = customer.get_coordinates_by_id(1)
+    customer.distance_between(1, 2)
+    customer.distances_from([1, 2])
+    customer.distance_matrix()
+    customer.customers_within(point, 50)
+    customer.nearest_customers(point, 2)
+    machines.display_machines()
+    machines.display_distinct_machines()
+    machines.display_machines_repair()
+    machines.export(os.devnull, 'status = ?', ('Need Repair',))
+    machines.get_machines_by_status('Need Repair')
+    machines.machines_within(point, 50, status='Need Repair', machine_type='Kiosk')
+    machines.nearest_machines(point, 2, status='Need Repair')
+    machines.plan_repair_route(point)
+    machines.dispatch([point, customer.get_coordinates_by_id(2)])
+    inventory.search('touch scr')
+    customer.search('washington')
+    machines.search('avanti kiosk')
+    inventory.set_reorder_points(40, machine_type='Kiosk')
+    inventory.set_reorder_point(1, 45)
+    inventory.low_stock_items('Kiosk')
+    inventory.display_low_stock()
+    inventory.display_inventory_value()
+    machines.display_fleet_summary()
+    machines.customer_fleet(1)
+
+    answers = iter(['4', '1'])
+    monkeypatch.setattr('builtins.input', lambda prompt='': next(answers))
+    machines.repair_machine(3, inventory)
+    machines.display_service_history()
+    _, token = machines.service_history_by_machine(3, limit=1)
+    machines.service_history_by_machine(3, after=token, limit=1)
+    machines.service_history_by_item(4, after=token, limit=1)
+    _, token = machines.service_history_between('2000-01-01', '2100-01-01', limit=1)
+    machines.service_history_between('2000-01-01', '2100-01-01', after=token, limit=1)
+    machines.parts_consumed_per_month('2000-01', '2100-01')
+    list(FailureSimulator(machines, inventory, rates={'Kiosk': 0.5}, repairs_per_step=2, restock_to=50).run(2))
+    inventory.reorder_suggestions()
+
+
+def test_queries_use_indexes(tmp_path, monkeypatch, capsys):
+    db_path = str(tmp_path / 'plans.db')
+    inventory, customer, machines = Inventory(db_file=db_path), Customer(db_file=db_path), Machines(db_file=db_path)
+    statements = []
+    conn = inventory.connection()
+    conn.set_trace_callback(statements.append)
+    run_entity_workload(monkeypatch, inventory, customer, machines)
+    conn.set_trace_callback(None)
+
+    failures = []
+    for sql in dict.fromkeys(' '.join(statement.split()) for statement in statements):
+        if not sql.upper().startswith(('SELECT', 'UPDATE', 'DELETE', 'WITH')):
+            continue
+        scanned = set(full_table_scans(conn, sql)) - {'sqlite_master', 'sqlite_schema'}
+        if scanned - ALLOWED_FULL_SCANS.get(sql, set()):
+            failures.append(f"{sql}\n    {query_plan(conn, sql)}")
+
+    assert len(statements) > 20
+    assert not failures, "Full table scans:\n" + "\n".join(failures)
+
+
+def test_apply_repair_is_atomic(temp_machines_db):
+    inventory = Inventory(db_file=temp_machines_db.db_file)
+    inventory.populate_inventory('inventoryList.txt')
+    temp_machines_db.populate_machines('machinesList.txt')
+    temp_machines_db.execute('UPDATE machines SET status = "Need Repair" WHERE id = 3')
+
+    with pytest.raises(ValueError):
+        temp_machines_db.apply_repair(3, 7, 100)
+    assert temp_machines_db.query_one('SELECT status FROM machines WHERE id = 3')[0] == 'Need Repair'
+    assert inventory.query_one('SELECT quantity FROM inventory WHERE id = 7')[0] == 8
+
+    temp_machines_db.apply_repair(3, 7, 8)
+    assert temp_machines_db.query_one('SELECT status FROM machines WHERE id = 3')[0] == 'Good'
+    assert inventory.query_one('SELECT quantity FROM inventory WHERE id = 7')[0] == 0
+    with pytest.raises(ValueError):
+        temp_machines_db.apply_repair(3, 7, 1)
+
+
+def repair_all(db_file, machine_ids, item_id):
+    machines = Machines(db_file=db_file, rebuild=False)
+    repaired = 0
+    for machine_id in machine_ids:
+        try:
+            machines.apply_repair(machine_id, item_id, 1)
+            repaired += 1
+        except ValueError:
+            pass
+    return repaired
+
+
+def test_concurrent_repairs_keep_inventory_consistent(temp_machines_db):
+    inventory = Inventory(db_file=temp_machines_db.db_file)
+    with inventory.transaction() as conn:
+        conn.execute("INSERT INTO inventory (item_name, price, quantity, machine_type) "
+                     "VALUES ('Part', 1.0, 60, 'Kiosk')")
+        conn.executemany("INSERT INTO machines (customer_id, manufacturer, name, machine_type, serial_number, status) "
+                         "VALUES (1, 'Avanti', 'Kiosk', 'Kiosk', ?, 'Need Repair')", [(str(i),) for i in range(150)])
+    machine_ids = [row[0] for row in temp_machines_db.query('SELECT id FROM machines')]
+
+    context = multiprocessing.get_context('fork')
+    with context.Pool(6) as pool:
+        repaired = pool.starmap(repair_all, [(temp_machines_db.db_file, random.Random(seed).sample(machine_ids, 150), 1)
+                                             for seed in range(6)])
+
+    assert sum(repaired) == 60
+    assert inventory.query_one('SELECT quantity FROM inventory WHERE id = 1')[0] == 0
+    assert temp_machines_db.query_one('SELECT COUNT(*) FROM machines WHERE status = "Good"')[0] == 60
+
+
+def test_service_history_pagination_and_rollup(temp_machines_db):
+    temp_machines_db.populate_machines('machinesList.txt')
+    records = [(machine_id, machine_id % 3 + 1, 2, f'2024-{month:02d}-15 10:00:00', machine_type)
+               for month in range(1, 13)
+               for machine_id, machine_type in temp_machines_db.query('SELECT id, machine_type FROM machines')]
+    temp_machines_db.connection().executemany(
+        'INSERT INTO service_history (machine_id, item_id, quantity_used, repair_date, machine_type) '
+        'VALUES (?, ?, ?, ?, ?)', records)
+
+    pages, token = [], None
+    while True:
+        rows, token = temp_machines_db.service_history_between('2024-03-01', '2024-06-01', after=token, limit=7)
+        pages.extend(rows)
+        if token is None:
+            break
+    assert len(pages) == 150
+    assert [(row[4], row[0]) for row in pages] == sorted(((row[4], row[0]) for row in pages), reverse=True)
+
+    rows, _ = temp_machines_db.service_history_by_machine(5, limit=100)
+    assert len(rows) == 12 and all(row[1] == 5 for row in rows)
+
+    usage = temp_machines_db.parts_consumed_per_month('2024-02', '2024-02')
+    assert sum(row[3] for row in usage) == 100
+    assert {row[1] for row in usage} == {row[0] for row in temp_machines_db.query('SELECT machine_type FROM machines')}
+
+    # Edited history moves its usage to the new month.
+    temp_machines_db.execute("UPDATE service_history SET repair_date = '2024-03-01 09:00:00', quantity_used = 5 "
+                             "WHERE repair_date LIKE '2024-02-%' AND machine_id <= 10")
+    assert sum(row[3] for row in temp_machines_db.parts_consumed_per_month('2024-02', '2024-02')) == 80
+    assert sum(row[3] for row in temp_machines_db.parts_consumed_per_month('2024-03', '2024-03')) == 150
+
+
+def test_service_history_persists(temp_machines_db):
+    inventory = Inventory(db_file=temp_machines_db.db_file)
+    inventory.populate_inventory('inventoryList.txt')
+    temp_machines_db.populate_machines('machinesList.txt')
+    temp_machines_db.execute('UPDATE machines SET status = "Need Repair" WHERE id = 3')
+    temp_machines_db.apply_repair(3, 4, 2)
+
+    reopened = Machines(db_file=temp_machines_db.db_file, rebuild=False)
+    rows, _ = reopened.service_history_by_item(4)
+    assert [(row[1], row[3], row[5]) for row in rows] == [(3, 2, 'Kiosk')]
+
+    # Rebuilding the machines table keeps the history unless asked to clear it.
+    rebuilt = Machines(db_file=temp_machines_db.db_file)
+    assert len(rebuilt.service_history_by_item(4)[0]) == 1
+    assert rebuilt.parts_consumed_per_month('2000-01', '2100-01') != []
+    cleared = Machines(db_file=temp_machines_db.db_file, clear_history=True)
+    assert cleared.service_history_by_item(4)[0] == []
+
+
+def test_batch_repairs(temp_machines_db):
+    inventory = Inventory(db_file=temp_machines_db.db_file)
+    inventory.populate_inventory('inventoryList.txt')
+    temp_machines_db.populate_machines('machinesList.txt')
+    temp_machines_db.execute('UPDATE machines SET status = "Need Repair" WHERE id IN (3, 4)')
+    lines = ['', 'machine_id,item_id,quantity', '3,4,5', '{"machine_id": 4, "item_id": 7, "quantity": 9}',
+             '{"machine_id": 1e400, "item_id": 7, "quantity": 1}', '{"machine_id": 4, "item_id": 7, "quantity": 2.7}',
+             '{"machine_id": 4, "item_id": 7, "quantity": 8}', '3,4,1', 'not a job']
+
+    output, report = io.StringIO(), io.StringIO()
+    counts = run_batch_repairs(temp_machines_db, lines, batch_size=2, output=output, report=report)
+    results = [json.loads(line) for line in output.getvalue().splitlines()]
+
+    assert counts == {'repaired': 2, 'rejected': 5}
+    assert [result['status'] for result in results] == ['repaired', 'rejected', 'rejected', 'rejected', 'repaired',
+                                                        'rejected', 'rejected']
+    assert [result['line'] for result in results] == [3, 4, 5, 6, 7, 8, 9]
+    assert results[2]['error'] == "line 5: machine_id: inf is not an integer"
+    assert results[3]['error'] == "line 6: quantity: 2.7 is not an integer"
+    assert inventory.query_one('SELECT quantity FROM inventory WHERE id = 7')[0] == 0
+    assert temp_machines_db.query_one('SELECT COUNT(*) FROM service_history')[0] == 2
+    assert 'jobs/sec' in report.getvalue()
+
+    # A job SQLite can't apply is rejected on its own and the rest still run.
+    temp_machines_db.execute('UPDATE machines SET status = "Need Repair" WHERE id IN (1, 2, 5)')
+    temp_machines_db.execute("CREATE TEMP TRIGGER refuse_machine_2 BEFORE INSERT ON service_history "
+                             "WHEN NEW.machine_id = 2 BEGIN SELECT RAISE(ABORT, 'machine 2 is locked'); END")
+    jobs = [{'line': 1, 'machine_id': 1, 'item_id': 4, 'quantity': 1},
+            {'line': 2, 'machine_id': 2 ** 70, 'item_id': 4, 'quantity': 1},
+            {'line': 3, 'machine_id': 2, 'item_id': 4, 'quantity': 1},
+            {'line': 4, 'machine_id': 5, 'item_id': 4, 'quantity': 1}]
+    results = list(temp_machines_db.apply_repairs(jobs))
+    assert [result['status'] for result in results] == ['repaired', 'rejected', 'rejected', 'repaired']
+    assert results[2]['error'] == 'machine 2 is locked'
+    assert temp_machines_db.query('SELECT id FROM machines WHERE status = "Need Repair"') == [(2,)]
+
+
+def test_inventory_service(temp_machines_db):
+    Inventory(db_file=temp_machines_db.db_file).populate_inventory('inventoryList.txt')
+    Customer(db_file=temp_machines_db.db_file).populate_customers('customerList.txt')
+    temp_machines_db.populate_machines('machinesList.txt')
+    temp_machines_db.execute('UPDATE machines SET status = "Need Repair" WHERE id = 3')
+
+    async def scenario():
+        service = InventoryService(temp_machines_db.db_file, workers=2, max_concurrency=4)
+        server = await service.start(port=0)
+        reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+        responses = [
+            await fetch(reader, writer, 'GET', '/repairs'),
+            await fetch(reader, writer, 'GET', '/inventory?machine_type=Kiosk'),
+            await fetch(reader, writer, 'GET', '/distance?from=1&to=2'),
+            await fetch(reader, writer, 'POST', '/repairs', {'machine_id': 3, 'item_id': 4, 'quantity': 1}),
+            await fetch(reader, writer, 'POST', '/repairs', {'machine_id': 3, 'item_id': 4, 'quantity': 1}),
+            await fetch(reader, writer, 'GET', '/distance?from=1'),
+            await fetch(reader, writer, 'GET', '/unknown'),
+            await fetch(reader, writer, 'GET', '/reports/fleet?customer_id=1'),
+            await fetch(reader, writer, 'GET', '/reports/catalog'),
+            await fetch(reader, writer, 'POST', '/repairs', [1]),
+            await fetch(reader, writer, 'POST', '/repairs', {'machine_id': 3, 'item_id': None, 'quantity': 1}),
+            await fetch(reader, writer, 'GET', '/distance?from=1&to=999'),
+            await fetch(reader, writer, 'GET', '/distance?from=1&to=x'),
+        ]
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        service.close()
+        return responses
+
+    responses = asyncio.run(scenario())
+    assert [status for status, _ in responses] == [200, 200, 200, 200, 409, 400, 404, 200, 200, 400, 400, 404, 400]
+    assert [machine['id'] for machine in responses[0][1]] == [3]
+    assert {item['machine_type'] for item in responses[1][1]} == {'Kiosk'}
+    assert responses[2][1]['miles'] == pytest.approx(
+        Customer(db_file=temp_machines_db.db_file, rebuild=False).distance_between(1, 2))
+    assert responses[3][1]['machine_id'] == 3
+    assert responses[7][1] == dict(temp_machines_db.customer_fleet(1), customer_id=1)
+    assert sum(model['machines'] for model in responses[8][1]) == len(temp_machines_db.query('SELECT id FROM machines'))
+    assert responses[11][1] == {'error': "No customer found with ID 999"}
+
+
+def test_inventory_service_rejects_bad_requests(temp_machines_db):
+    Inventory(db_file=temp_machines_db.db_file).populate_inventory('inventoryList.txt')
+    temp_machines_db.populate_machines('machinesList.txt')
+
+    async def send(address, data):
+        reader, writer = await asyncio.open_connection(*address)
+        writer.write(data)
+        response = await reader.read()
+        writer.close()
+        return response.split(b'\r\n', 1)[0]
+
+    def post(body, length=None):
+        body = body.encode()
+        return (f"POST /repairs HTTP/1.1\r\nConnection: close\r\n"
+                f"Content-Length: {len(body) if length is None else length}\r\n\r\n").encode() + body
+
+    async def scenario():
+        service = InventoryService(temp_machines_db.db_file, workers=2, keep_alive=0.2, max_body=100)
+        service.routes[('GET', '/reports/catalog')] = lambda query, body: 1 / 0
+        server = await service.start(port=0)
+        address = server.sockets[0].getsockname()[:2]
+        responses = [
+            await send(address, post('{"machine_id": 1e400, "item_id": 4, "quantity": 1}')),
+            await send(address, post(f'{{"machine_id": {2 ** 70}, "item_id": 4, "quantity": 1}}')),
+            await send(address, post('', length=-1)),
+            await send(address, post('', length=101)),
+            await send(address, b"GET /reports/catalog HTTP/1.1\r\nConnection: close\r\n\r\n"),
+            # Headers that never finish, and a body shorter than promised.
+            await send(address, b"GET /repairs HTTP/1.1\r\n"),
+            await send(address, post('{}', length=50)),
+        ]
+        server.close()
+        await server.wait_closed()
+        service.close()
+        return responses
+
+    assert asyncio.run(scenario()) == ([b'HTTP/1.1 400 Bad Request'] * 4
+                                       + [b'HTTP/1.1 500 Internal Server Error', b'', b''])
+
+
+def test_generated_data_loads(tmp_path):
+    paths = Data_Generator.generate(str(tmp_path), customers=40, inventory=20, machines=300, seed=1)
+    db_path = str(tmp_path / 'generated.db')
+    customers, machines = Customer(db_file=db_path), Machines(db_file=db_path)
+
+    assert Inventory(db_file=db_path).populate_inventory(paths['inventory']).rows == 20
+    assert customers.populate_customers(paths['customer']).rows == 40
+    assert machines.populate_machines(paths['machines']).rows == 300
+    assert machines.query_one('SELECT COUNT(DISTINCT serial_number) FROM machines')[0] == 300
+    assert machines.query_one(
+        'SELECT COUNT(*) FROM machines WHERE customer_id NOT IN (SELECT id FROM customers)')[0] == 0
+    assert all(-90 <= lat <= 90 and -180 <= lon <= 180 for _, lat, lon in customers.query(
+        'SELECT id, latitude, longitude FROM customers'))
+
+
+def test_ingest_validation_and_parse_cache(tmp_path, monkeypatch):
+    db_path = str(tmp_path / 'ingest.db')
+    customers, machines = Customer(db_file=db_path), Machines(db_file=db_path)
+    customer_file = tmp_path / 'customers.txt'
+    customer_file.write_text(
+        "Palantir,1025 Thomas Jefferson Street,Suite 600, Washington, DC 20007,(202) 765-8197,7AM-4PM,38.9,-77.0597\n"
+        "Clark Construction,7900 Westpark Dr, McLean, VA 22102,(301) 272-8100,8AM-5PM,38.924759,-77.217178\n"
+        "\n"
+        "Night Shift,1 Main Street, Washington, DC 20001,(202) 555-0100,24/7,38.9,-77.0\n"
+        "North Pole,1 Main Street, Washington, DC 20001,(202) 555-0100,8AM-5PM,95.0,-77.0\n")
+    report = customers.populate_customers(str(customer_file))
+    assert (report.rows, report.rejected) == (2, 2)
+    assert customers.query('SELECT name, address, phone_number, longitude FROM customers ORDER BY id') == [
+        ('Palantir', '1025 Thomas Jefferson Street, Suite 600, Washington, DC 20007', '(202) 765-8197', -77.0597),
+        ('Clark Construction', '7900 Westpark Dr, McLean, VA 22102', '(301) 272-8100', -77.217178)]
+    with open(tmp_path / 'customers.rejected.jsonl') as file:
+        quarantined = [json.loads(line) for line in file]
+    assert [(entry['line'], entry['reason']) for entry in quarantined] == [
+        (4, "operating_hours: unreadable operating hours '24/7'"), (5, "latitude: 95.0 is outside -90 to 90")]
+    assert quarantined[0]['text'].startswith('Night Shift,')
+
+    machine_file = tmp_path / 'machines.txt'
+    machine_file.write_text("Follet,15 Series Ice Maker,Ice Maker,AB-C123,Good,1\n"
+                            "Avanti,Executive Kiosk,Kiosk,123-ABC,Good,3\n"
+                            "Avanti,Executive Kiosk,Kiosk,123-ABD,Broken,2\n"
+                            "Avanti,Executive Kiosk,Kiosk,123-ABE,Need Repair\n"
+                            "Avanti,Executive Kiosk,Kiosk,123-ABF,Need Repair,2\n")
+    cache_dir = str(tmp_path / 'cache')
+    report = machines.populate_machines(str(machine_file), cache_dir=cache_dir)
+    assert (report.rows, report.rejected) == (2, 3)
+    assert machines.query('SELECT customer_id, serial_number FROM machines') == [(1, 'AB-C123'), (2, '123-ABF')]
+    with open(tmp_path / 'machines.rejected.jsonl') as file:
+        quarantined = [json.loads(line) for line in file]
+    assert [(entry['line'], entry['reason']) for entry in quarantined] == [
+        (2, "customer_id: no row 3 in customers"), (3, "status: 'Broken' is not one of Good, Need Repair"),
+        (4, "expected 6 fields, found 5")]
+    assert quarantined[0]['text'] == "Avanti,Executive Kiosk,Kiosk,123-ABC,Good,3"
+
+    # Reloads of the same file read the cached parse; references are still checked.
+    customers.execute("INSERT INTO customers (name, address, phone_number, operating_hours, latitude, longitude) "
+                      "VALUES ('Blue Cross', '750 9th Street Northwest', '(312) 386-3315', '8AM-5PM', 38.9, -77.0)")
+    monkeypatch.setattr(Machines, 'parse_chunks', lambda *args: pytest.fail("parsed a cached file"))
+    report = Machines(db_file=db_path).populate_machines(str(machine_file), cache_dir=cache_dir)
+    assert (report.rows, report.rejected) == (3, 2)
+    assert len(os.listdir(cache_dir)) == 1
+    monkeypatch.undo()
+
+    machine_file.write_text("Follet,15 Series Ice Maker,Ice Maker,AB-C123,Good,1\n")
+    assert Machines(db_file=db_path).sync(str(machine_file), cache_dir=cache_dir).rejected == 0
+    assert not os.path.exists(tmp_path / 'machines.rejected.jsonl')
+    assert len(os.listdir(cache_dir)) == 1
+
+
+@pytest.mark.parametrize('load', ['bulk_load', 'sync'])
+def test_rejected_customer_keeps_later_ids(tmp_path, load):
+    db_path = str(tmp_path / 'ids.db')
+    customers, machines = Customer(db_file=db_path), Machines(db_file=db_path)
+    customer_file = tmp_path / 'customers.txt'
+    customer_file.write_text(
+        "Palantir,1025 Thomas Jefferson Street, Washington, DC 20007,(202) 765-8197,7AM-4PM,38.9,-77.0597\n"
+        "Night Shift,1 Main Street, Washington, DC 20001,(202) 555-0100,24/7,38.9,-77.0\n"
+        "Clark Construction,7900 Westpark Dr, McLean, VA 22102,(301) 272-8100,8AM-5PM,38.924759,-77.217178\n")
+    getattr(customers, load)(str(customer_file))
+    assert customers.query('SELECT id, name FROM customers ORDER BY id') == [
+        (1, 'Palantir'), (3, 'Clark Construction')]
+
+    machine_file = tmp_path / 'machines.txt'
+    machine_file.write_text("Follet,15 Series Ice Maker,Ice Maker,AB-C123,Good,3\n"
+                            "Avanti,Executive Kiosk,Kiosk,123-ABC,Good,2\n"
+                            "Avanti,Executive Kiosk,Kiosk,123-ABD,Good,1\n")
+    report = getattr(machines, load)(str(machine_file))
+    assert report.rejected == 1
+    assert machines.query('SELECT customers.name, serial_number FROM machines '
+                          'INNER JOIN customers ON customers.id = machines.customer_id ORDER BY machines.id') == [
+        ('Clark Construction', 'AB-C123'), ('Palantir', '123-ABD')]
+
+
+def test_instrumentation(tmp_path, caplog):
+    db_path = str(tmp_path / 'instrumented.db')
+    inventory = Inventory(db_file=db_path, instrument=True, slow_query_ms=0)
+    inventory.populate_inventory('inventoryList.txt')
+    stats = inventory.db.instrumentation
+
+    kiosks = inventory.get_items_by_type('Kiosk')
+    report = stats.report()
+    select = report['statements']['SELECT * FROM inventory WHERE machine_type = ?']
+    assert select['calls'] == 1 and select['rows'] == len(kiosks) > 0
+    assert select['p50'] <= select['p99'] <= select['seconds']
+    assert report['methods']['Inventory.get_items_by_type']['calls'] == 1
+    assert report['methods']['Inventory.populate_inventory']['calls'] == 1
+    assert report['connections']['calls'] == 1
+    assert any('idx_inventory_machine_type' in record.getMessage() for record in caplog.records)
+
+    prometheus = stats.to_prometheus()
+    assert ('inventory_statement_rows_total{statement="SELECT * FROM inventory WHERE machine_type = ?"} '
+            f'{len(kiosks)}') in prometheus
+    assert 'inventory_method_seconds_count{method="Inventory.get_items_by_type"} 1' in prometheus
+    assert json.loads(stats.to_json()) == json.loads(json.dumps(stats.report()))
+
+    stats.reset()
+    assert stats.report()['methods'] == {} and stats.report()['statements'] == {}
+    inventory.get_items_by_type('Kiosk')
+    assert stats.report()['methods']['Inventory.get_items_by_type']['calls'] == 1
+
+    # Entities on a database without instrumentation call their methods unwrapped.
+    plain = Inventory(db_file=str(tmp_path / 'plain.db'))
+    assert 'get_items_by_type' not in vars(plain) and plain.db.instrumentation is None
+
+
+def test_keyset_pages_and_export(tmp_path, temp_machines_db):
+    machines = temp_machines_db
+    machines.populate_machines('machinesList.txt')
+    all_rows = machines.query('SELECT * FROM machines ORDER BY id')
+
+    pages, token = [], None
+    while True:
+        rows, token = machines.rows_page(token, limit=7)
+        pages.append(rows)
+        if token is None:
+            break
+    assert [row for page in pages for row in page] == all_rows
+    assert all(len(page) == 7 for page in pages[:-1])
+    assert list(machines.iter_rows(page_size=3)) == all_rows
+
+    resumed = machines.iter_rows(after=json.dumps(all_rows[9][0]), page_size=4)
+    assert next(resumed) == all_rows[10]
+
+    csv_path, jsonl_path = str(tmp_path / 'machines.csv'), str(tmp_path / 'machines.jsonl')
+    assert machines.export(csv_path, page_size=5) == len(all_rows)
+    with open(csv_path, newline='') as file:
+        header, *lines = list(csv.reader(file))
+    assert header == ['id', 'customer_id', 'manufacturer', 'name', 'machine_type', 'serial_number', 'status']
+    assert lines[0] == [str(value) for value in all_rows[0]]
+
+    machines.export(jsonl_path, 'machine_type = ?', ('Kiosk',))
+    with open(jsonl_path) as file:
+        exported = [json.loads(line) for line in file]
+    assert [row['id'] for row in exported] == [row[0] for row in all_rows if row[4] == 'Kiosk']
+
+
+def test_low_stock_and_reorder_suggestions(tmp_path):
+    db_path = str(tmp_path / 'stock.db')
+    inventory, machines = Inventory(db_file=db_path), Machines(db_file=db_path)
+    inventory.populate_inventory('inventoryList.txt')
+    machines.populate_machines('machinesList.txt')
+
+    inventory.set_reorder_point(7, 10, reorder_quantity=20)
+    inventory.set_reorder_point(1, 30)
+    assert inventory.low_stock_item(7) == (8, 10)
+    assert inventory.low_stock_item(1) is None
+    with pytest.raises(ValueError):
+        inventory.set_reorder_point(999, 5)
+
+    inventory.deduct_inventory_quantity(1, 15)
+    assert inventory.low_stock_item(1) == (25, 30)
+    assert [row[0] for row in inventory.low_stock_items('Ice Maker')] == [1]
+    inventory.sync('inventoryList.txt')  # puts the 15 units back
+    assert inventory.low_stock_item(1) is None
+    inventory.set_reorder_point(7, None)
+    assert inventory.low_stock_items() == []
+
+    assert inventory.set_reorder_points(28, machine_type='Kiosk') == 5
+    machines.execute('UPDATE machines SET status = "Need Repair" WHERE id = 3')
+    machines.apply_repair(3, 4, 5)
+    assert inventory.low_stock_item(4) == (25, 28)
+    suggestions = inventory.reorder_suggestions(months=1, lead_days=5, cover_days=10)
+    assert list(suggestions) == ['Kiosk']
+    assert [item['item_id'] for item in suggestions['Kiosk']] == [4, 6, 7, 8]
+    used, unused = suggestions['Kiosk'][0], suggestions['Kiosk'][2]
+    days = datetime.now().day
+    assert used['daily_usage'] == 5 / days and used['order_quantity'] == 28 + ceil(5 / days * 15) - 25
+    assert unused['days_left'] is None and unused['order_quantity'] == 20
+    with pytest.raises(ValueError):
+        inventory.reorder_suggestions(months=0)
+    # One month is the current month only; two reach back across the year end.
+    today = datetime.now().date()
+    assert inventory.reorder_suggestions(months=1, today=today.replace(day=1))['Kiosk'][0]['daily_usage'] == 5
+    new_year = today.replace(year=today.year + 1, month=1, day=1)
+    assert inventory.reorder_suggestions(months=1, today=new_year)['Kiosk'][0]['daily_usage'] == 0
+    machines.execute('UPDATE service_history SET repair_date = ?', (f'{today.year}-12-31',))
+    assert inventory.reorder_suggestions(months=1, today=new_year)['Kiosk'][0]['daily_usage'] == 0
+    assert inventory.reorder_suggestions(months=2, today=new_year)['Kiosk'][0]['daily_usage'] == 5 / 32
+
+    Inventory(db_file=db_path, rebuild=True)
+    counts = inventory.query('SELECT COUNT(*) FROM stock_thresholds UNION ALL SELECT COUNT(*) FROM low_stock')
+    assert counts == [(0,), (0,)]
+
+
+def test_failure_simulator(tmp_path):
+    def simulate(db_path, seed):
+        inventory, machines = Inventory(db_file=db_path), Machines(db_file=db_path)
+        inventory.populate_inventory('inventoryList.txt')
+        machines.populate_machines('machinesList.txt')
+        simulator = FailureSimulator(machines, inventory, rates={'Kiosk': 0.3, 'Cooler': 0.3}, seed=seed,
+                                     repairs_per_step=3, restock_to=100, start=datetime(2024, 1, 1))
+        steps = list(simulator.run(10))
+        return steps, machines.query('SELECT id, status FROM machines ORDER BY id'), \
+            machines.query('SELECT machine_id, item_id, repair_date FROM service_history ORDER BY id')
+
+    steps, statuses, history = simulate(str(tmp_path / 'first.db'), seed=7)
+    assert (statuses, history) == simulate(str(tmp_path / 'second.db'), seed=7)[1:]
+    assert sum(step.failed for step in steps) > 0
+    assert sum(step.repaired for step in steps) == len(history) > 0
+    assert history[0][2].startswith('2024-01-') and steps[-1].clock == datetime(2024, 1, 11)
+    assert steps[-1].waiting == sum(status == 'Need Repair' for _, status in statuses)
+
+    machines = Machines(db_file=str(tmp_path / 'first.db'), rebuild=False)
+    marked = machines.generate_machine_issues(count=2, rng=random.Random(1))
+    assert len(set(marked)) == len(marked) <= 2
+    for machine_id in marked:
+        assert machines.query_one('SELECT status FROM machines WHERE id = ?', (machine_id,)) == ('Need Repair',)
+    assert machines.sample_machines(5, status='Missing') == []
+
+
+def test_search(tmp_path):
+    db_path = str(tmp_path / 'search.db')
+    inventory, customers, machines = Inventory(db_file=db_path), Customer(db_file=db_path), Machines(db_file=db_path)
+    inventory.populate_inventory('inventoryList.txt')
+    customers.populate_customers('customerList.txt')
+    machines.populate_machines('machinesList.txt')
+
+    assert [item.id for item in inventory.search('touch')] == [5, 4]
+    assert [item.id for item in inventory.search('touchscreen board', prefix=False)] == [4]
+    assert {item.machine_type for item in inventory.search('kio')} == {'Kiosk'}
+    assert [customer.id for customer in customers.search('Palantir')] == [2]
+    assert [machine.serial_number for machine in machines.search('123-abc')] == ['123-ABC']
+    assert inventory.search('"bad* OR (') == [] and inventory.search(' ') == []
+
+    inventory.execute("UPDATE inventory SET item_name = 'Zebra Touch Pad' WHERE id = 5")
+    inventory.deduct_inventory_quantity(4, 1)
+    assert [(item.id, item.quantity) for item in inventory.search('touch')] == [(5, 40), (4, 29)]
+    assert inventory.search('zeb')[0].id == 5 and inventory.search('avanti touch screen')[0].id == 4
+    customers.execute('DELETE FROM customers WHERE id = 2')
+    assert customers.search('Palantir') == []
+
+    more = tmp_path / 'inventory.txt'
+    more.write_text('Bunn Sprayhead,Coffee Brewer Sprayhead,5.99,12, Coffee Machine\n')
+    inventory.populate_inventory(str(more))
+    assert [item.item_name for item in inventory.search('sprayhead')] == ['Bunn Sprayhead']
+    inventory.execute("INSERT INTO inventory (item_name, price, quantity, machine_type) "
+                      "VALUES ('Elkay Spout', 2.5, 1, 'Water Dispenser')")
+    assert len(inventory.search('spout')) == 1
+
+    # The best match is ranked first however many weaker matches come before it.
+    with inventory.transaction() as conn:
+        conn.executemany("INSERT INTO inventory (item_name, item_description, price, quantity, machine_type) "
+                         "VALUES (?, 'Fits the widget tray', 1.0, 1, 'Kiosk')", [(f'Tray {i}',) for i in range(1200)])
+        conn.execute("INSERT INTO inventory (item_name, price, quantity, machine_type) "
+                     "VALUES ('Widget', 1.0, 1, 'Kiosk')")
+    assert inventory.search('widget', limit=1)[0].item_name == 'Widget'
+    assert inventory.search('widget', limit=1, candidates=1000)[0].item_name != 'Widget'
+
+    inventory = Inventory(db_file=db_path)
+    assert inventory.search('touch') == []
+    inventory.populate_inventory('inventoryList.txt')
+    assert len(inventory.search('touch')) == 2
+
+
+def test_aggregates_match_tables(tmp_path):
+    db_path = str(tmp_path / 'aggregates.db')
+    inventory, machines = Inventory(db_file=db_path), Machines(db_file=db_path)
+    inventory.sync('inventoryList.txt')
+    Customer(db_file=db_path).sync('customerList.txt')
+    machines.populate_machines('machinesList.txt')
+
+    def check():
+        assert machines.catalog() == machines.query('SELECT manufacturer, name, COUNT(*) FROM machines '
+                                                    'GROUP BY manufacturer, name ORDER BY manufacturer, name')
+        fleet = machines.query('SELECT machine_type, COUNT(*), SUM(status = "Need Repair") FROM machines '
+                               'GROUP BY machine_type ORDER BY machine_type')
+        assert [(machine_type, counts['machines'], counts['need_repair'])
+                for machine_type, counts in machines.fleet_by_type().items()] == fleet
+        for customer_id, count, broken in machines.query('SELECT customer_id, COUNT(*), SUM(status = "Need Repair") '
+                                                         'FROM machines GROUP BY customer_id'):
+            assert machines.customer_fleet(customer_id) == {'machines': count, 'need_repair': broken}
+        stock = inventory.query('SELECT machine_type, COUNT(*), SUM(quantity), ROUND(SUM(price * quantity), 2) '
+                                'FROM inventory GROUP BY machine_type ORDER BY machine_type')
+        assert [(machine_type, total['items'], total['quantity'], pytest.approx(total['value']))
+                for machine_type, total in inventory.inventory_value().items()] == stock
+
+    check()
+    machines.populate_machines('machinesList.txt')
+    machines.mark_need_repair([1, 2, 3])
+    machines.execute('UPDATE machines SET machine_type = "Kiosk", manufacturer = "Avanti" WHERE id IN (3, 4)')
+    machines.execute('DELETE FROM machines WHERE manufacturer = "Newco"')
+    inventory.deduct_inventory_quantity(1, 2)
+    inventory.execute('DELETE FROM inventory WHERE id = 2')
+    check()
+    assert ('Newco', 'Fresh Cup') not in [model[:2] for model in machines.catalog()]
+    assert machines.customer_fleet(10 ** 6) == {'machines': 0, 'need_repair': 0}
+
+    Machines(db_file=db_path)
+    assert machines.catalog() == [] and machines.fleet_by_type() == {}
+
+
+def test_parse_operating_hours():
+    assert parse_operating_hours('7AM-4:30PM') == (420, 990)
+    assert parse_operating_hours(' 8AM-5PM') == (480, 1020)
+    assert parse_operating_hours('12PM - 12:15 am') == (720, 1455)
+    for hours in ('', '8AM', '13AM-5PM', '8-5', '8AM-5:75PM'):
+        with pytest.raises(ValueError):
+            parse_operating_hours(hours)
+
+
+def test_dispatch(tmp_path):
+    db_path = str(tmp_path / 'dispatch.db')
+    inventory, customers, machines = Inventory(db_file=db_path), Customer(db_file=db_path), Machines(db_file=db_path)
+    inventory.populate_inventory('inventoryList.txt')
+    customers.populate_customers('customerList.txt')
+    machines.populate_machines('machinesList.txt')
+    machines.execute('UPDATE machines SET status = "Need Repair" WHERE id <= 20')
+    machines.execute("UPDATE customers SET operating_hours = '24/7' WHERE id = 2")
+    inventory.execute("UPDATE inventory SET quantity = 1 WHERE machine_type = 'Kiosk'")
+    starts = [customers.get_coordinates_by_id(1), customers.get_coordinates_by_id(5)]
+
+    routes, unassigned = machines.dispatch(starts, service_minutes=20)
+    assert (routes, unassigned) == machines.dispatch(starts, service_minutes=20, workers=2)
+    jobs = [job for route in routes for stop in route['stops'] for job in stop['jobs']]
+    assert sorted([job['machine_id'] for job in jobs] + [machine['machine_id'] for machine in unassigned]) == \
+        list(range(1, 21))
+    assert {machine['reason'] for machine in unassigned if machine['machine_id'] == 2} == {
+        "unreadable operating hours '24/7'"}
+    kiosk_parts = [job['item_id'] for job in jobs if job['item_id'] in (4, 5, 6, 7, 8)]
+    assert len(kiosk_parts) == len(set(kiosk_parts))
+
+    for route in routes:
+        finish = 480
+        for stop in route['stops']:
+            open_at, close_at = parse_operating_hours(customers.query_one(
+                'SELECT operating_hours FROM customers WHERE id = ?', (stop['customer_id'],))[0])
+            assert stop['arrival'] >= finish and max(stop['arrival'], open_at, 480) + 20 * len(stop['jobs']) == \
+                stop['finish'] <= min(close_at, 1020)
+            finish = stop['finish']
+    assert [result['status'] for result in machines.apply_repairs(jobs)] == ['repaired'] * len(jobs)
+
+
+def test_dispatch_frees_parts_of_unplaced_stops(tmp_path, monkeypatch):
+    db_path = str(tmp_path / 'dispatch.db')
+    inventory, customers, machines = Inventory(db_file=db_path), Customer(db_file=db_path), Machines(db_file=db_path)
+    inventory.populate_inventory('inventoryList.txt')
+    customers.populate_customers('customerList.txt')
+    machines.populate_machines('machinesList.txt')
+    inventory.execute("UPDATE inventory SET quantity = CASE id WHEN 4 THEN 1 ELSE 0 END WHERE machine_type = 'Kiosk'")
+    # The older machine is at a customer too far away to reach while it is open.
+    customers.execute("UPDATE customers SET latitude = 0, longitude = 0, operating_hours = '8AM-9AM' WHERE id = 1")
+    older, newer = [row[0] for row in machines.query("SELECT id FROM machines WHERE machine_type = 'Kiosk' "
+                                                     "ORDER BY id LIMIT 2")]
+    machines.execute('UPDATE machines SET status = "Good"')
+    machines.execute('UPDATE machines SET status = "Need Repair", customer_id = 1 WHERE id = ?', (older,))
+    machines.execute('UPDATE machines SET status = "Need Repair", customer_id = 3 WHERE id = ?', (newer,))
+
+    # One worker plans in-process.
+    import concurrent.futures
+    monkeypatch.setattr(concurrent.futures, 'ProcessPoolExecutor', None)
+    routes, unassigned = machines.dispatch([customers.get_coordinates_by_id(3)])
+    assert unassigned == [{'machine_id': older, 'reason': "no technician can fit it in"}]
+    assert [job for stop in routes[0]['stops'] for job in stop['jobs']] == [
+        {'machine_id': newer, 'item_id': 4, 'quantity': 1}]
+
+
+def test_lookup_caches(tmp_path, monkeypatch):
+    db_path = str(tmp_path / 'cached.db')
+    inventory = Inventory(db_file=db_path, lookup_cache_size=2)
+    customers, machines = Customer(db_file=db_path), Machines(db_file=db_path)
+    inventory.populate_inventory('inventoryList.txt')
+    customers.populate_customers('customerList.txt')
+    machines.populate_machines('machinesList.txt')
+    by_type = inventory.db.cache('inventory_by_type')
+
+    kiosks = inventory.get_items_by_type('Kiosk')
+    assert inventory.get_items_by_type('Kiosk') == kiosks
+    assert (by_type.hits, by_type.misses) == (1, 1)
+    # Changing a returned record doesn't change what the cache holds.
+    quantity = kiosks[0].quantity
+    inventory.get_items_by_type('Kiosk')[0].quantity = -1
+    assert inventory.get_items_by_type('Kiosk')[0].quantity == quantity
+
+    inventory.get_items_by_type('Cooler')
+    inventory.deduct_inventory_quantity(kiosks[0][0], 1)
+    assert inventory.get_items_by_type('Kiosk')[0][4] == kiosks[0][4] - 1
+    assert by_type.stats()['size'] == 2 and by_type.misses == 3
+
+    machines.execute('UPDATE machines SET status = "Need Repair" WHERE id = 3')
+    machines.apply_repair(3, kiosks[0][0], 2)
+    assert inventory.get_items_by_type('Kiosk')[0][4] == kiosks[0][4] - 3
+    inventory.get_items_by_type('Ice Maker')
+    assert by_type.evictions == 1 and by_type.stats()['size'] == 2
+
+    assert customers.get_coordinates_by_id(1) == customers.get_coordinates_by_id(1)
+    with open('customerList.txt') as file:
+        lines = file.readlines()
+    values = lines[0].rstrip('\n').split(',')
+    values[-2:] = ['10.5', '20.5']
+    changed = tmp_path / 'customers.txt'
+    changed.write_text(','.join(values) + '\n' + ''.join(lines[1:]))
+    customers.sync(str(changed))
+    assert customers.get_coordinates_by_id(1) == (10.5, 20.5)
+
+    clock = [0.0]
+    monkeypatch.setattr('Inventory_Management.time.monotonic', lambda: clock[0])
+    coordinates = customers.db.cache('customer_coordinates')
+    customers.get_coordinates_by_id(2)
+    clock[0] += coordinates.ttl + 1
+    customers.get_coordinates_by_id(2)
+    assert coordinates.expirations == 1
+
+
+def test_lazy_session_and_snapshots(tmp_path, monkeypatch):
+    for name in ('inventoryList.txt', 'customerList.txt', 'machinesList.txt'):
+        shutil.copy(name, tmp_path / name)
+    monkeypatch.chdir(tmp_path)
+
+    session = Session('working.db', simulate_issues=True)
+    assert session.inventory.query_one('SELECT COUNT(*) FROM inventory')[0] > 0
+    assert set(session.entities) == {'inventory'}
+    assert session.machines.get_machines_by_status('Need Repair')
+    assert set(session.entities) == {'inventory', 'customers', 'machines'}
+
+    save_snapshot(session.db.connection(), 'snapshot.db')
+    assert snapshot_problems('snapshot.db') == []
+    restore_snapshot('snapshot.db', 'restored.db')
+    restored = Session('restored.db')
+    assert restored.machines.query('SELECT * FROM machines') == session.machines.query('SELECT * FROM machines')
+
+    with open('inventoryList.txt', 'a') as file:
+        file.write('New Part,Replacement Part,1.00,5, Kiosk\n')
+    assert snapshot_problems('snapshot.db') == ["inventoryList.txt has changed since snapshot.db was saved"]
+    (tmp_path / 'corrupt.db').write_bytes(b'not a database' * 100)
+    assert snapshot_problems('corrupt.db') and snapshot_problems('missing.db')
+
+
+def write_then_crash(snapshot_path):
+    session = Session(':memory:', snapshot_path=snapshot_path, snapshot_interval=0.05)
+    session.inventory.execute('UPDATE inventory SET quantity = 77 WHERE id = 1')
+    db = session.db
+    while db.changes() != db._snapshot_state[0]:
+        threading.Event().wait(0.01)
+    db.snapshot_interval = 3600
+    session.inventory.execute('UPDATE inventory SET quantity = 99 WHERE id = 2')
+    os._exit(0)
+
+
+def test_in_memory_snapshots(tmp_path, monkeypatch):
+    for name in ('inventoryList.txt', 'customerList.txt', 'machinesList.txt'):
+        shutil.copy(name, tmp_path / name)
+    monkeypatch.chdir(tmp_path)
+    original = Inventory('disk.db', rebuild=True)
+    original.sync('inventoryList.txt')
+    quantity = original.query_one('SELECT quantity FROM inventory WHERE id = 2')[0]
+
+    # A crash loses only the changes made since the last snapshot.
+    child = multiprocessing.get_context('fork').Process(target=write_then_crash, args=('memory.db',))
+    child.start()
+    child.join()
+    session = Session(':memory:', snapshot_path='memory.db')
+    inventory = session.inventory
+    assert not os.path.exists('inventory.db')
+    assert inventory.query_one('SELECT quantity FROM inventory WHERE id = 1')[0] == 77
+    assert inventory.query_one('SELECT quantity FROM inventory WHERE id = 2')[0] == quantity
+
+    def add_stock():
+        for _ in range(50):
+            with inventory.transaction(immediate=True) as conn:
+                conn.execute('UPDATE inventory SET quantity = quantity + 1 WHERE id = 1')
+
+    threads = [threading.Thread(target=add_stock) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    session.db.close()
+
+    recovered = Inventory(':memory:', rebuild=False, snapshot_path='memory.db')
+    assert recovered.query_one('SELECT quantity FROM inventory WHERE id = 1')[0] == 277
+    recovered.db.close()
+
+
+def test_records_and_columns(capsys, temp_machines_db):
+    machines = temp_machines_db
+    machines.populate_machines('machinesList.txt')
+    machines.execute('UPDATE machines SET status = "Need Repair" WHERE id IN (2, 3)')
+
+    broken = machines.get_machines_by_status('Need Repair')
+    assert [machine.id for machine in broken] == [2, 3]
+    machine = broken[0]
+    assert machine == machines.query('SELECT * FROM machines WHERE id = 2')[0]
+    assert machine[4] == machine.machine_type and machine[-1] == machine.status == 'Need Repair'
+    machine_id, customer_id, *_ = machine
+    assert (machine_id, customer_id) == (machine.id, machine.customer_id)
+    assert not hasattr(machine, '__dict__')
+    assert machine.as_dict()['serial_number'] == machine.serial_number
+
+    machines.display_machines_repair()
+    assert f"Manufacturer: {machine.manufacturer}, Machine Name: {machine.name}," in capsys.readouterr().out
+
+    columns = machines.column_arrays(page_size=4)
+    rows = machines.query('SELECT * FROM machines ORDER BY id')
+    assert list(columns['id']) == [row[0] for row in rows] and columns['id'].typecode == 'q'
+    assert columns['machine_type'] == [row[4] for row in rows]
+    first_kiosk = columns['machine_type'].index('Kiosk')
+    assert all(value is columns['machine_type'][first_kiosk] for value in columns['machine_type'] if value == 'Kiosk')
+    assert list(machines.column_arrays('status = ?', ('Need Repair',))['id']) == [2, 3]
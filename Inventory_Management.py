@@ -1,9 +1,49 @@
+import argparse
+import atexit
+import csv
 import sqlite3
 import time
+import hashlib
+import heapq
+import importlib.util
+import json
+import logging
+import marshal
+import os
 import sys
 import random
-from datetime import datetime
-from math import radians, cos, sin, asin, sqrt
+import re
+import threading
+import weakref
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from operator import itemgetter
+from itertools import islice
+from array import array
+from types import FunctionType
+from datetime import datetime, timedelta
+from math import radians, degrees, cos, sin, asin, sqrt, pi, nan, ceil, exp, log, isfinite
+
+STARTED = time.perf_counter()
+logger = logging.getLogger(__name__)
+
+
+def lazy_import(name):
+    """ The named module, imported on first attribute access, or None when
+    it isn't installed. Keeps heavy optional imports out of start-up. """
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        return None
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = sys.modules[name] = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+np = lazy_import('numpy')
+# inspect.CO_GENERATOR, without importing inspect at start-up.
+CO_GENERATOR = 0x20
 
 
 def printf(text):
@@ -54,324 +94,2992 @@ def haversine(point1, point2, units="mi"):
     return R * c
 
 
-class BaseEntity:
-    def __init__(self, db_file):
-        self.db_file = db_file
+def haversine_matrix(points1, points2=None, units="mi", dtype="float64"):
+    """ Calculate distances between every pair of points from two sets.
 
-    def drop_table(self, table_name):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        cursor.execute(f'DROP TABLE IF EXISTS {table_name}')
-        conn.commit()
-        conn.close()
+    Args:
+        points1 (sequence of (float, float)): n points (lat, lon) in
+            decimal degrees.
+        points2 (sequence of (float, float)): m points (lat, lon). When
+            omitted, distances are computed between all pairs of points1.
+        units (str): "km" or "mi". (Default: "mi")
+        dtype (str): NumPy dtype of the result. (Default: "float64")
 
+    Returns:
+        numpy.ndarray: n x m matrix where [i, j] is the distance from
+        points1[i] to points2[j]. Without NumPy installed, a list of lists
+        is returned instead.
+    """
+    if units not in ["km", "mi"]:
+        raise ValueError("units should be 'km' or 'mi'")
+    R = 6372.8 if units == "km" else 3959.87433
+    if points2 is None:
+        points2 = points1
+
+    if np is None:
+        return [[haversine(point1, point2, units) for point2 in points2] for point1 in points1]
+
+    coords1 = np.asarray(points1, dtype=float).reshape(-1, 2)
+    coords2 = np.asarray(points2, dtype=float).reshape(-1, 2)
+    if np.isnan(coords1).any() or np.isnan(coords2).any():
+        raise ValueError("coordinates must be floats")
+    lat1, lon1 = np.radians(coords1).T
+    lat2, lon2 = np.radians(coords2).T
+
+    # sin((x2 - x1) / 2) expanded as sin(x2/2)cos(x1/2) - cos(x2/2)sin(x1/2),
+    # so trig functions run per point instead of per pair.
+    a = np.multiply.outer(np.cos(lat1 / 2), np.sin(lat2 / 2))
+    a -= np.multiply.outer(np.sin(lat1 / 2), np.cos(lat2 / 2))
+    np.square(a, out=a)
+    sin_dLon = np.multiply.outer(np.cos(lon1 / 2), np.sin(lon2 / 2))
+    sin_dLon -= np.multiply.outer(np.sin(lon1 / 2), np.cos(lon2 / 2))
+    np.square(sin_dLon, out=sin_dLon)
+    sin_dLon *= np.cos(lat1)[:, np.newaxis]
+    sin_dLon *= np.cos(lat2)[np.newaxis, :]
+    a += sin_dLon
+    del sin_dLon
+
+    np.clip(a, 0.0, 1.0, out=a)
+    np.sqrt(a, out=a)
+    np.arcsin(a, out=a)
+    a *= 2 * R
+
+    return a.astype(dtype, copy=False)
+
+
+def bounding_boxes(point, radius, units="mi"):
+    """ Latitude/longitude boxes that together contain every point within
+    radius of point. Two boxes are returned when the area crosses the
+    180th meridian.
 
-class Inventory(BaseEntity):
-    def __init__(self, db_file='inventory.db'):
-        super().__init__(db_file)
-        self.drop_table('inventory')
-        self.create_table()
+    Returns:
+        list of (min_lat, max_lat, min_lon, max_lon) tuples.
+    """
+    if units not in ["km", "mi"]:
+        raise ValueError("units should be 'km' or 'mi'")
+    R = 6372.8 if units == "km" else 3959.87433
+    lat, lon = point
+
+    angle = radius / R
+    min_lat = max(lat - degrees(angle), -90.0)
+    max_lat = min(lat + degrees(angle), 90.0)
+    if angle >= pi / 2 or sin(angle) >= cos(radians(lat)):
+        return [(min_lat, max_lat, -180.0, 180.0)]
+
+    dLon = degrees(asin(sin(angle) / cos(radians(lat))))
+    min_lon, max_lon = lon - dLon, lon + dLon
+    if min_lon < -180.0:
+        return [(min_lat, max_lat, min_lon + 360.0, 180.0), (min_lat, max_lat, -180.0, max_lon)]
+    if max_lon > 180.0:
+        return [(min_lat, max_lat, min_lon, 180.0), (min_lat, max_lat, -180.0, max_lon - 360.0)]
+    return [(min_lat, max_lat, min_lon, max_lon)]
+
+
+def route_length(dist, tour):
+    return sum(dist(a, b) for a, b in zip(tour, tour[1:]))
+
+
+def distance_lookup(matrix):
+    if hasattr(matrix, 'item'):
+        return matrix.item
+    return lambda i, j: matrix[i][j]
+
+
+def nearest_neighbour_tour(matrix):
+    n = len(matrix)
+    tour = [0]
+    if n == 1:
+        return tour
+    if np is not None and isinstance(matrix, np.ndarray):
+        visited = np.zeros(n, dtype=bool)
+        visited[0] = True
+        current = 0
+        for _ in range(n - 1):
+            current = int(np.where(visited, np.inf, matrix[current]).argmin())
+            visited[current] = True
+            tour.append(current)
+    else:
+        unvisited = set(range(1, n))
+        current = 0
+        while unvisited:
+            current = min(unvisited, key=matrix[current].__getitem__)
+            unvisited.remove(current)
+            tour.append(current)
+    return tour
+
+
+def neighbour_lists(matrix, k):
+    """ The k nearest other nodes of every node, closest first. """
+    n = len(matrix)
+    k = min(k, n - 1)
+    if k <= 0:
+        return [[] for _ in range(n)]
+    if np is not None and isinstance(matrix, np.ndarray):
+        candidates = np.argpartition(matrix, k, axis=1)[:, :k + 1]
+        order = np.argsort(np.take_along_axis(matrix, candidates, axis=1), axis=1, kind='stable')
+        candidates = np.take_along_axis(candidates, order, axis=1).tolist()
+    else:
+        candidates = [sorted(range(n), key=matrix[i].__getitem__)[:k + 1] for i in range(n)]
+    return [[j for j in row if j != i][:k] for i, row in enumerate(candidates)]
+
+
+def two_opt(tour, dist, near, deadline):
+    """ Neighbour-list 2-opt on an open path whose first node is fixed.
+    Nodes whose edges changed are re-queued until no move improves. """
+    n = len(tour)
+    pos = [0] * n
+    for index, node in enumerate(tour):
+        pos[node] = index
+    queue = deque(tour)
+    queued = [True] * n
+    improved = False
+
+    while queue and time.perf_counter() < deadline:
+        a = queue.popleft()
+        queued[a] = False
+        i = pos[a]
+        if i == n - 1:
+            continue
+        b = tour[i + 1]
+        d_ab = dist(a, b)
+        for c in near[a]:
+            d_ac = dist(a, c)
+            if d_ac >= d_ab:
+                break
+            j = pos[c]
+            if j > i + 1:
+                # a b ... c e  ->  a c ... b e
+                e = tour[j + 1] if j + 1 < n else None
+                delta = d_ac - d_ab + (dist(b, e) - dist(c, e) if e is not None else 0.0)
+                low, high = i + 1, j
+            elif j < i - 1:
+                # c e ... a b  ->  c a ... e b
+                e = tour[j + 1]
+                delta = d_ac - d_ab + dist(e, b) - dist(c, e)
+                low, high = j + 1, i
+            else:
+                continue
+            if delta < -1e-9:
+                tour[low:high + 1] = tour[low:high + 1][::-1]
+                for index in range(low, high + 1):
+                    pos[tour[index]] = index
+                for node in (a, b, c, e):
+                    if node is not None and not queued[node]:
+                        queue.append(node)
+                        queued[node] = True
+                improved = True
+                break
+    return improved
+
+
+def or_opt(tour, dist, near, deadline):
+    """ Move runs of one to three stops next to one of their nearest
+    neighbours, in either orientation, when that shortens the path. """
+    pos = {node: index for index, node in enumerate(tour)}
+    improved = False
+
+    for seg_len in (1, 2, 3):
+        i = 1
+        while i + seg_len <= len(tour) and time.perf_counter() < deadline:
+            n = len(tour)
+            segment = tour[i:i + seg_len]
+            first, last = segment[0], segment[-1]
+            prev_node = tour[i - 1]
+            next_node = tour[i + seg_len] if i + seg_len < n else None
+            if next_node is None:
+                removal_gain = dist(prev_node, first)
+            else:
+                removal_gain = dist(prev_node, first) + dist(last, next_node) - dist(prev_node, next_node)
+
+            best = None
+            for endpoint in (first, last):
+                for c in near[endpoint]:
+                    if dist(c, endpoint) >= removal_gain:
+                        break
+                    if c in segment:
+                        continue
+                    index = pos[c]
+                    # Insert between c and its successor, or its predecessor and c.
+                    for left, right in ((c, tour[index + 1] if index + 1 < n else None),
+                                        (tour[index - 1] if index > 0 else None, c)):
+                        if left is None or left in segment or right in segment:
+                            continue
+                        base = dist(left, right) if right is not None else 0.0
+                        for orientation in (segment, segment[::-1]):
+                            added = dist(left, orientation[0]) - base
+                            if right is not None:
+                                added += dist(orientation[-1], right)
+                            gain = removal_gain - added
+                            if gain > 1e-9 and (best is None or gain > best[0]):
+                                best = (gain, left, orientation)
+
+            if best is None:
+                i += 1
+                continue
+            _, left, orientation = best
+            rest = tour[:i] + tour[i + seg_len:]
+            insert_at = rest.index(left) + 1
+            rest[insert_at:insert_at] = orientation
+            tour[:] = rest
+            pos = {node: index for index, node in enumerate(tour)}
+            improved = True
+    return improved
+
+
+def plan_route(points, start, units="mi", time_limit=0.5, neighbours=8):
+    """ Find a short order in which to visit points, starting from start.
+
+    A nearest-neighbour path is built first and then improved with 2-opt
+    and Or-opt moves restricted to each stop's nearest neighbours until no
+    move helps or time_limit seconds have passed.
 
-    def create_table(self):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
+    Args:
+        points (sequence of (float, float)): stops (lat, lon) in decimal
+            degrees.
+        start (tuple of float, float): starting location (lat, lon).
+        units (str): "km" or "mi". (Default: "mi")
+        time_limit (float): seconds to spend improving the initial path.
+            (Default: 0.5)
+        neighbours (int): candidate neighbours considered per stop.
+            (Default: 8)
 
-        cursor.execute('''
-                CREATE TABLE IF NOT EXISTS inventory (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    item_name TEXT NOT NULL,
-                    item_description TEXT,
-                    price REAL NOT NULL,
-                    quantity INTEGER NOT NULL,
-                    machine_type TEXT NOT NULL
-                )
-            ''')
+    Returns:
+        tuple: (list of indexes into points in visiting order, path length)
+    """
+    matrix = haversine_matrix([start] + list(points), units=units)
+    dist = distance_lookup(matrix)
+    tour = nearest_neighbour_tour(matrix)
 
-        conn.commit()
-        conn.close()
+    deadline = time.perf_counter() + time_limit
+    near = neighbour_lists(matrix, neighbours)
+    while time.perf_counter() < deadline:
+        improved = two_opt(tour, dist, near, deadline)
+        improved = or_opt(tour, dist, near, deadline) or improved
+        if not improved:
+            break
 
-    def populate_inventory(self, file_path):
-        with open(file_path, 'r') as file:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
+    return [node - 1 for node in tour[1:]], route_length(dist, tour)
 
-            for line in file:
-                values = list(map(str.strip, line.split(',')))
-                item_name, item_description, price, quantity, machine_type = values[0:5]
-                cursor.execute(
-                    'INSERT INTO inventory (item_name, item_description, price, quantity, machine_type) '
-                    'VALUES (?, ?, ?, ?, ?)',
-                    (item_name, item_description, float(price), int(quantity), machine_type))
 
-            conn.commit()
-            conn.close()
+CLOCK_TIME = re.compile(r'(\d{1,2})(?::(\d{2}))?\s*([AP]M)', re.IGNORECASE)
 
-    def display_inventory(self, items_to_display=None):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
 
-        print("Here are all the items in the inventory: ")
-        if items_to_display:
-            for item in items_to_display:
-                print(
-                    f"ID: {item[0]}, Name: {item[1]}, Description: {item[2]}, Price: {item[3]}, Quantity: {item[4]},"
-                    f" Type: {item[5]}")
+def parse_clock_time(text):
+    """ Minutes after midnight for a time like "7AM" or "4:30 pm". """
+    match = CLOCK_TIME.fullmatch(text.strip())
+    if not match or not 1 <= int(match[1]) <= 12 or int(match[2] or 0) > 59:
+        raise ValueError(f"unreadable time {text!r}")
+    return int(match[1]) % 12 * 60 + int(match[2] or 0) + (720 if match[3].upper() == 'PM' else 0)
+
+
+def format_clock_time(minutes):
+    minutes = int(minutes) % 1440
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def parse_operating_hours(text):
+    """ Parse operating hours like "7AM-4:30PM" into a time window.
+
+    Returns:
+        tuple: (open, close) in minutes after midnight. A close at or
+        before the open runs past midnight, so it is a day later.
+
+    Raises:
+        ValueError: text isn't two times separated by "-".
+    """
+    times = text.split('-')
+    if len(times) != 2:
+        raise ValueError(f"unreadable operating hours {text!r}")
+    open_at, close_at = parse_clock_time(times[0]), parse_clock_time(times[1])
+    return open_at, close_at if close_at > open_at else close_at + 1440
+
+
+def route_schedule(order, start_at, travel, stops):
+    """ Arrival and finish times along order, or None when a stop can't be
+    served inside its window. travel(a, b) is in minutes, node 0 is the
+    technician's start and stop i is node i + 1. """
+    times = []
+    clock, previous = start_at, 0
+    for index in order:
+        _, open_at, close_at, service = stops[index]
+        arrival = clock + travel(previous, index + 1)
+        clock = max(arrival, open_at) + service
+        if clock > close_at:
+            return None
+        times.append((arrival, clock))
+        previous = index + 1
+    return times
+
+
+def schedule_route(start, shift, stops, fixed=0, speed=30.0):
+    """ Build one technician's route by cheapest feasible insertion.
+
+    Args:
+        start (tuple of float, float): the technician's start (lat, lon).
+        shift (tuple of int, int): working hours in minutes after midnight.
+        stops (list of tuple): ((lat, lon), open, close, service minutes)
+            per stop, with the window already narrowed to the shift.
+        fixed (int): the first fixed stops are an existing feasible route,
+            kept in that order; the rest are inserted, earliest closing
+            first. (Default: 0)
+        speed (float): travel speed in miles per hour. (Default: 30.0)
+
+    Returns:
+        tuple: (stop indexes in visiting order, [(arrival, finish)] per
+        visit, indexes that couldn't be fitted in, route length in miles)
+    """
+    matrix = haversine_matrix([start] + [stop[0] for stop in stops])
+    dist = distance_lookup(matrix)
+    travel = lambda a, b: dist(a, b) / speed * 60
+    order = list(range(fixed))
+    skipped = []
+
+    for index in sorted(range(fixed, len(stops)), key=lambda i: (stops[i][2], i)):
+        best = None
+        for position in range(len(order) + 1):
+            before = order[position - 1] + 1 if position else 0
+            after = order[position] + 1 if position < len(order) else None
+            added = dist(before, index + 1)
+            if after is not None:
+                added += dist(index + 1, after) - dist(before, after)
+            if best is not None and added >= best[0]:
+                continue
+            if route_schedule(order[:position] + [index] + order[position:], shift[0], travel, stops) is not None:
+                best = (added, position)
+        if best is None:
+            skipped.append(index)
         else:
-            cursor.execute('SELECT * FROM inventory')
-            items = cursor.fetchall()
+            order.insert(best[1], index)
 
-            if not items:
-                print("Inventory is empty.")
+    path = [0] + [index + 1 for index in order]
+    return order, route_schedule(order, shift[0], travel, stops), skipped, route_length(dist, path)
+
+
+REPAIR_JOB_FIELDS = ('machine_id', 'item_id', 'quantity')
+
+
+def sqlite_integer(value):
+    """ value as an int SQLite can store: an int, a float with no
+    fractional part or a string of digits, within 64 bits.
+
+    Raises:
+        ValueError: value is anything else.
+    """
+    if isinstance(value, str):
+        try:
+            number = int(value)
+        except ValueError:
+            raise ValueError(f"{value!r} is not an integer") from None
+    elif isinstance(value, int) and not isinstance(value, bool):
+        number = value
+    elif isinstance(value, float) and value.is_integer():
+        number = int(value)
+    else:
+        raise ValueError(f"{value!r} is not an integer")
+    if not -2 ** 63 <= number < 2 ** 63:
+        raise ValueError(f"{value!r} is out of range")
+    return number
+
+
+def repair_job(values):
+    """ The machine_id, item_id and quantity in the mapping values, as
+    ints.
+
+    Raises:
+        ValueError: a field is missing or isn't an integer SQLite can
+            store.
+    """
+    job = {}
+    for field in REPAIR_JOB_FIELDS:
+        if field not in values:
+            raise ValueError(f"missing {field}")
+        try:
+            job[field] = sqlite_integer(values[field])
+        except ValueError as e:
+            raise ValueError(f"{field}: {e}") from None
+    return job
+
+
+def read_repair_jobs(lines):
+    """ Parse repair jobs from JSON lines or CSV rows.
+
+    Each job names a machine_id, item_id and quantity, either as a JSON
+    object per line or as a CSV row in that column order (a header row is
+    allowed before the first job). Blank lines are skipped.
+
+    Yields:
+        dict: the job's machine_id, item_id and quantity as ints, or an
+        "error" describing why the line couldn't be read.
+    """
+    first = True
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            if line.startswith('{'):
+                values = json.loads(line)
+                if not isinstance(values, dict):
+                    raise ValueError("expected a JSON object")
             else:
-                for item in items:
-                    print(
-                        f"ID: {item[0]}, Name: {item[1]}, Description: {item[2]}, Price: {item[3]}, Quantity: {item[4]}"
-                        f", Type: {item[5]}")
+                values = next(csv.reader([line]))
+                if first and not values[0].strip().lstrip('-').isdigit():
+                    first = False
+                    continue
+                if len(values) < 3:
+                    raise ValueError("expected machine_id, item_id, quantity")
+                values = dict(zip(REPAIR_JOB_FIELDS, (value.strip() for value in values)))
+            job = repair_job(values)
+        except ValueError as e:
+            job = {'error': f"line {number}: {e}"}
+        first = False
+        yield {'line': number, **job}
+
+
+class Record:
+    """ Base for the compact row classes. Fields live in __slots__, so a
+    record has no per-instance __dict__, and a record still indexes,
+    unpacks, compares and hashes like the tuple row it stands for.
+    Records are snapshots: changing one doesn't change the database. """
+    __slots__ = ()
+    # Column type codes for the columnar form (see BaseEntity.column_arrays):
+    # an array module type code, or None to keep values in a list.
+    typecodes = ()
+    # Text columns with few distinct values, interned in the columnar form.
+    categorical = ()
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return tuple(self)[index]
+        return getattr(self, self.__slots__[index])
+
+    def __iter__(self):
+        for field in self.__slots__:
+            yield getattr(self, field)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __eq__(self, other):
+        if isinstance(other, (Record, tuple)):
+            return tuple(self) == tuple(other)
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{field}={value!r}' for field, value in zip(self.__slots__, self))})"
+
+    def as_dict(self):
+        return dict(zip(self.__slots__, self))
+
+    @classmethod
+    def from_rows(cls, rows):
+        """ Records for rows, storing each distinct categorical value once
+        so that, e.g., a million machines share a handful of status strings. """
+        positions = [cls.__slots__.index(field) for field in cls.categorical]
+        shared = {}
+        records = []
+        for row in rows:
+            row = list(row)
+            for position in positions:
+                row[position] = shared.setdefault(row[position], row[position])
+            records.append(cls(*row))
+        return records
+
+
+class InventoryItem(Record):
+    __slots__ = ('id', 'item_name', 'item_description', 'price', 'quantity', 'machine_type')
+    typecodes = ('q', None, None, 'd', 'q', None)
+    categorical = ('machine_type',)
+
+    def __init__(self, id, item_name, item_description, price, quantity, machine_type):
+        self.id = id
+        self.item_name = item_name
+        self.item_description = item_description
+        self.price = price
+        self.quantity = quantity
+        self.machine_type = machine_type
+
+
+class CustomerRecord(Record):
+    __slots__ = ('id', 'name', 'address', 'phone_number', 'operating_hours', 'latitude', 'longitude')
+    typecodes = ('q', None, None, None, None, 'd', 'd')
+    categorical = ('operating_hours',)
+
+    def __init__(self, id, name, address, phone_number, operating_hours, latitude, longitude):
+        self.id = id
+        self.name = name
+        self.address = address
+        self.phone_number = phone_number
+        self.operating_hours = operating_hours
+        self.latitude = latitude
+        self.longitude = longitude
+
+
+class MachineRecord(Record):
+    __slots__ = ('id', 'customer_id', 'manufacturer', 'name', 'machine_type', 'serial_number', 'status')
+    typecodes = ('q', 'q', None, None, None, None, None)
+    categorical = ('manufacturer', 'name', 'machine_type', 'status')
+
+    def __init__(self, id, customer_id, manufacturer, name, machine_type, serial_number, status):
+        self.id = id
+        self.customer_id = customer_id
+        self.manufacturer = manufacturer
+        self.name = name
+        self.machine_type = machine_type
+        self.serial_number = serial_number
+        self.status = status
+
+
+class ServiceRecord(Record):
+    __slots__ = ('id', 'machine_id', 'item_id', 'quantity_used', 'repair_date', 'machine_type')
+    typecodes = ('q', 'q', 'q', 'q', None, None)
+    categorical = ('machine_type',)
+
+    def __init__(self, id, machine_id, item_id, quantity_used, repair_date, machine_type):
+        self.id = id
+        self.machine_id = machine_id
+        self.item_id = item_id
+        self.quantity_used = quantity_used
+        self.repair_date = repair_date
+        self.machine_type = machine_type
+
+
+class IngestReport:
+    def __init__(self, table_name, rows, seconds, rejected=0, quarantine_path=None):
+        self.table_name = table_name
+        self.rows = rows
+        self.seconds = seconds
+        self.rejected = rejected
+        self.quarantine_path = quarantine_path
+
+    @property
+    def rows_per_sec(self):
+        return self.rows / self.seconds if self.seconds else float('inf')
+
+    def __str__(self):
+        rejected = f", {self.rejected} rejected (see {self.quarantine_path})" if self.rejected else ""
+        return (f"Loaded {self.rows} rows into {self.table_name} in {self.seconds:.2f}s "
+                f"({self.rows_per_sec:,.0f} rows/sec){rejected}")
+
+
+class SyncReport:
+    def __init__(self, table_name, seconds, inserted=0, updated=0, deleted=0, unchanged=0, skipped=False, rejected=0):
+        self.table_name = table_name
+        self.seconds = seconds
+        self.inserted = inserted
+        self.updated = updated
+        self.deleted = deleted
+        self.unchanged = unchanged
+        self.skipped = skipped
+        self.rejected = rejected
+
+    def __str__(self):
+        if self.skipped:
+            return f"{self.table_name} is up to date ({self.seconds * 1000:.1f} ms)"
+        return (f"Synced {self.table_name} in {self.seconds:.2f}s: {self.inserted} inserted, {self.updated} updated, "
+                f"{self.deleted} deleted, {self.unchanged} unchanged, {self.rejected} rejected")
 
-        conn.close()
 
-    def get_items_by_type(self, machine_type):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
+def file_digest(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
 
-        cursor.execute('SELECT * FROM inventory WHERE machine_type = ?', (machine_type,))
-        items = cursor.fetchall()
 
-        conn.close()
+def row_digest(row):
+    return hashlib.blake2b(repr(row).encode(), digest_size=16).hexdigest()
 
-        return items
 
-    def check_quantity_available(self, item_id, quantity_needed):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
+MACHINE_STATUSES = ('Good', 'Need Repair')
 
-        cursor.execute('SELECT quantity FROM inventory WHERE id = ?', (item_id,))
-        available_quantity = cursor.fetchone()[0]
 
-        conn.close()
+def required_text(text):
+    if not text:
+        raise ValueError("missing")
+    return text
 
-        return available_quantity >= quantity_needed
 
-    def deduct_inventory_quantity(self, item_id, quantity_needed):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
+def address_text(text):
+    """ An address with its comma-separated parts evenly spaced. """
+    return required_text(', '.join(part.strip() for part in text.split(',') if part.strip()))
+
+
+def finite_float(text):
+    try:
+        value = float(text)
+    except ValueError:
+        value = nan
+    if not isfinite(value):
+        raise ValueError(f"{text!r} is not a number")
+    return value
+
+
+def non_negative_float(text):
+    value = finite_float(text)
+    if value < 0:
+        raise ValueError(f"{value} is negative")
+    return value
+
+
+def non_negative_int(text):
+    try:
+        value = int(text)
+    except ValueError:
+        raise ValueError(f"{text!r} is not a whole number") from None
+    if value < 0:
+        raise ValueError(f"{value} is negative")
+    return value
+
+
+def positive_id(text):
+    value = non_negative_int(text)
+    if value == 0:
+        raise ValueError("IDs start at 1")
+    return value
+
 
+def latitude_degrees(text):
+    value = finite_float(text)
+    if not -90 <= value <= 90:
+        raise ValueError(f"{value} is outside -90 to 90")
+    return value
+
+
+def longitude_degrees(text):
+    value = finite_float(text)
+    if not -180 <= value <= 180:
+        raise ValueError(f"{value} is outside -180 to 180")
+    return value
+
+
+def operating_hours_text(text):
+    parse_operating_hours(text)
+    return text
+
+
+def machine_status(text):
+    if text not in MACHINE_STATUSES:
+        raise ValueError(f"{text!r} is not one of {', '.join(MACHINE_STATUSES)}")
+    return text
+
+
+class TextFormat:
+    """ Schema for one comma-separated source file format.
+
+    Args:
+        fields (tuple): (name, convert) pairs in file order. convert turns
+            the field's text into its stored value, raising ValueError with
+            the reason when the text is invalid; None keeps the text.
+        columns (tuple): field names in the order rows are returned.
+            (Default: file order)
+        rest (str): the one field that may contain commas, such as an
+            address. It takes whatever the fields around it leave.
+            (Default: None)
+    """
+
+    def __init__(self, fields, columns=None, rest=None):
+        self.fields = tuple(fields)
+        self.columns = tuple(columns or (name for name, _ in fields))
+        self.rest = rest
+        names = [name for name, _ in self.fields]
+        self.converters = tuple((index, name, convert) for index, (name, convert) in enumerate(self.fields)
+                                if convert is not None)
+        self.order = tuple(names.index(column) for column in self.columns)
+        # The rest field's position, and how many fields follow it.
+        self.rest_span = None if rest is None else (names.index(rest), len(names) - names.index(rest) - 1)
+        # Names parsed results saved by an older schema or Python as stale.
+        self.version = row_digest((self.fields_signature(), self.columns, rest, marshal.version))
+
+    def fields_signature(self):
+        return tuple((name, convert and convert.__name__) for name, convert in self.fields)
+
+    def parse(self, line):
+        """ The row for line, in columns order.
+
+        Raises:
+            ValueError: the line has the wrong number of fields or an
+                invalid one; the message gives the reason.
+        """
+        values = line.split(',')
+        count = len(self.fields)
+        if self.rest_span is None:
+            if len(values) != count:
+                raise ValueError(f"expected {count} fields, found {len(values)}")
+        else:
+            if len(values) < count:
+                raise ValueError(f"expected at least {count} fields, found {len(values)}")
+            first, after = self.rest_span
+            last = len(values) - after
+            values[first:last] = [','.join(values[first:last])]
+        values = [value.strip() for value in values]
         try:
-            cursor.execute('UPDATE inventory SET quantity = quantity - ? WHERE id = ?', (quantity_needed, item_id))
-            conn.commit()
-            print(f"{quantity_needed} units deducted from inventory for item ID {item_id}")
-        except sqlite3.Error as e:
-            print(f"Error deducting inventory quantity: {e}")
-        finally:
-            conn.close()
+            for index, name, convert in self.converters:
+                values[index] = convert(values[index])
+        except ValueError as e:
+            raise ValueError(f"{name}: {e}") from None
+        return tuple([values[index] for index in self.order])
 
 
-class Customer(BaseEntity):
-    def __init__(self, db_file='inventory.db'):
-        super().__init__(db_file)
-        self.drop_table('customers')
-        self.create_table()
+INVENTORY_FORMAT = TextFormat((('item_name', required_text), ('item_description', None),
+                               ('price', non_negative_float), ('quantity', non_negative_int),
+                               ('machine_type', required_text)))
+CUSTOMER_FORMAT = TextFormat((('name', required_text), ('address', address_text), ('phone_number', None),
+                              ('operating_hours', operating_hours_text), ('latitude', latitude_degrees),
+                              ('longitude', longitude_degrees)), rest='address')
+MACHINE_FORMAT = TextFormat((('manufacturer', required_text), ('name', required_text), ('machine_type', required_text),
+                             ('serial_number', required_text), ('status', machine_status),
+                             ('customer_id', positive_id)),
+                            columns=('customer_id', 'manufacturer', 'name', 'machine_type', 'serial_number', 'status'))
 
-    def create_table(self):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS customers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                address TEXT NOT NULL,
-                phone_number TEXT, 
-                operating_hours TEXT,
-                latitude REAL, 
-                longitude REAL
-            )
-        ''')
 
-        conn.commit()
-        conn.close()
+def parse_lines(parse_line, lines, first_line=1):
+    """ Parse lines numbered from first_line, skipping blank ones.
 
-    def populate_customers(self, file_path):
+    Returns:
+        tuple: (rows, their line numbers, and (line number, reason, line)
+        for each line parse_line rejected with a ValueError)
+    """
+    rows, numbers, rejected = [], [], []
+    for number, line in enumerate(lines, first_line):
+        if not line.strip():
+            continue
+        try:
+            rows.append(parse_line(line))
+        except ValueError as e:
+            rejected.append((number, str(e), line.rstrip('\r\n')))
+        else:
+            numbers.append(number)
+    return rows, numbers, rejected
+
+
+def write_quarantine(quarantine_path, file_path, rejected):
+    """ Write the rejected lines of file_path, given as (line number,
+    reason, line or None), to quarantine_path as JSON lines in file order,
+    reading back any lines not given. With nothing rejected, an old
+    quarantine file is removed instead. """
+    if not rejected:
+        if os.path.exists(quarantine_path):
+            os.remove(quarantine_path)
+        return
+    rejected = sorted(rejected, key=lambda entry: entry[0])
+    missing = {number for number, _, line in rejected if line is None}
+    lines = {}
+    if missing:
         with open(file_path, 'r') as file:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
+            lines = {number: line.rstrip('\r\n') for number, line in enumerate(file, 1) if number in missing}
+    with open(quarantine_path, 'w') as file:
+        for number, reason, line in rejected:
+            file.write(json.dumps({'line': number, 'reason': reason, 'text': lines.get(number, line)}) + '\n')
+
+
+def split_file(file_path, chunk_bytes):
+    """ Split a file into (start, end) byte ranges of roughly chunk_bytes,
+    each ending on a line boundary. """
+    size = os.path.getsize(file_path)
+    ranges = []
+    with open(file_path, 'rb') as file:
+        start = 0
+        while start < size:
+            file.seek(min(start + chunk_bytes, size))
+            file.readline()
+            end = min(file.tell(), size)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def parse_file_range(parse_line, file_path, start, end):
+    """ parse_lines over the lines between two byte offsets, numbered from
+    1, followed by how many lines there were. """
+    with open(file_path, 'rb') as file:
+        file.seek(start)
+        lines = file.read(end - start).decode().split('\n')
+    if lines[-1] == '':
+        lines.pop()
+    return parse_lines(parse_line, lines) + (len(lines),)
+
+
+def write_rows(file, columns, rows, fmt='csv'):
+    """ Write rows to an open text file as CSV with a header row, or as
+    JSON objects keyed by column, one per line, for fmt="jsonl". Rows are
+    written as they arrive. Returns the number of rows written. """
+    count = 0
+    if fmt == 'jsonl':
+        for row in rows:
+            file.write(json.dumps(dict(zip(columns, row))) + '\n')
+            count += 1
+    else:
+        writer = csv.writer(file)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def search_query(text, prefix=True):
+    """ An FTS5 query matching every word in text, with FTS5 syntax in
+    the text taken literally. """
+    words = re.findall(r'\w+', text)
+    return ' '.join(f'"{word}"*' if prefix else f'"{word}"' for word in words)
+
+
+SQL_STRING_OR_WORD = re.compile(r"'(?:[^']|'')*'|\w+")
+
+
+def qualify_columns(expression, columns, row):
+    """ expression with each of columns prefixed by row ("NEW" or "OLD"),
+    leaving string literals alone. """
+    return SQL_STRING_OR_WORD.sub(lambda match: f'{row}.{match[0]}' if match[0] in columns else match[0], expression)
+
+
+RTREE_BOX = ('customers_rtree.min_lat <= :max_lat AND customers_rtree.max_lat >= :min_lat '
+             'AND customers_rtree.min_lon <= :max_lon AND customers_rtree.max_lon >= :min_lon')
+
+
+def query_plan(conn, sql, params=()):
+    """ The detail lines of EXPLAIN QUERY PLAN for sql. """
+    return [row[3] for row in sqlite3.Cursor(conn).execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+
+
+def full_table_scans(conn, sql, params=()):
+    """ Tables that sql reads with a full scan instead of an index.
+    Scans of subquery results are left out. """
+    tables = []
+    subqueries = set()
+    for detail in query_plan(conn, sql, params):
+        words = detail.split()
+        if words[0] in ('MATERIALIZE', 'CO-ROUTINE'):
+            subqueries.add(words[1])
+        elif (words[0] == 'SCAN' and 'USING' not in words and 'VIRTUAL' not in words and words[1].isidentifier()
+                and words[1:3] != ['CONSTANT', 'ROW'] and words[1] not in subqueries):
+            tables.append(words[1])
+    return tables
+
+
+class LatencyStats:
+    """ Call count, total time, rows and a reservoir sample of latencies
+    for one statement or method. """
+    __slots__ = ('calls', 'seconds', 'rows', 'samples')
+    sample_size = 1024
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.samples = []
+
+    def add(self, seconds, rows=0):
+        self.calls += 1
+        self.seconds += seconds
+        self.rows += rows
+        if len(self.samples) < self.sample_size:
+            self.samples.append(seconds)
+        else:
+            slot = random.randrange(self.calls)
+            if slot < self.sample_size:
+                self.samples[slot] = seconds
 
-            for line in file:
-                values = list(map(str.strip, line.split(',')))
+    def summary(self):
+        ordered = sorted(self.samples)
 
-                name = values[0]
-                address = ', '.join(values[1:4])
-                phone_number = values[-4]
-                operating_hours = values[-3]
-                latitude = float(values[-2])
-                longitude = float(values[-1])
+        def percentile(p):
+            return ordered[min(len(ordered) - 1, int(p * len(ordered)))] if ordered else 0.0
 
-                cursor.execute(
-                    'INSERT INTO customers (name, address, phone_number, operating_hours, latitude, longitude) '
-                    'VALUES (?, ?, ?, ?, ?, ?)',
-                    (name, address, phone_number, operating_hours, latitude, longitude))
+        return {'calls': self.calls, 'seconds': self.seconds, 'rows': self.rows,
+                'p50': percentile(0.50), 'p95': percentile(0.95), 'p99': percentile(0.99)}
 
-            conn.commit()
-            conn.close()
 
-    def display_customers(self):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
+class Instrumentation:
+    """ Per-database statistics for SQL statements, entity methods and
+    connection opens.
 
-        cursor.execute('SELECT * FROM customers')
-        customers = cursor.fetchall()
+    Statements are keyed by their SQL with whitespace collapsed. A
+    statement's latency runs from execute() until its cursor is exhausted,
+    closed, re-executed or dropped, so it includes fetching the rows.
 
-        for customer in customers:
-            print(
-                f"ID: {customer[0]}, Name: {customer[1]}, Address: {customer[2]}, Phone Number: {customer[3]}, "
-                f"Operating Hours: {customer[4]}, Latitude: {customer[5]}, Longitude: {customer[6]}")
+    Args:
+        slow_query_ms (float): log statements slower than this many
+            milliseconds, with their query plan, as warnings. None disables
+            the log. (Default: None)
+    """
 
-        # Close the connection
-        conn.close()
+    def __init__(self, slow_query_ms=None):
+        self.slow_query_seconds = None if slow_query_ms is None else slow_query_ms / 1000
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._keys = {}
+            self.statements = defaultdict(LatencyStats)
+            self.methods = defaultdict(LatencyStats)
+            self.connections = LatencyStats()
+
+    def record_statement(self, conn, sql, params, seconds, rows):
+        key = self._keys.get(sql)
+        if key is None:
+            key = self._keys[sql] = ' '.join(sql.split())
+        with self._lock:
+            self.statements[key].add(seconds, rows)
+        if self.slow_query_seconds is not None and seconds >= self.slow_query_seconds:
+            try:
+                plan = '; '.join(query_plan(conn, sql, params)) if params is not None else ''
+            except sqlite3.Error:
+                plan = ''
+            logger.warning("Slow query (%.1f ms, %d rows): %s [plan: %s]",
+                           seconds * 1000, rows, key, plan or 'n/a')
+
+    def record_method(self, name, seconds):
+        with self._lock:
+            self.methods[name].add(seconds)
+
+    def record_connect(self, seconds):
+        with self._lock:
+            self.connections.add(seconds)
+
+    def report(self):
+        """ Summaries of everything recorded so far, slowest total first. """
+        with self._lock:
+            statements = {sql: stats.summary() for sql, stats in self.statements.items()}
+            methods = {name: stats.summary() for name, stats in self.methods.items()}
+            connections = self.connections.summary()
+
+        def by_time(summaries):
+            return dict(sorted(summaries.items(), key=lambda item: -item[1]['seconds']))
+
+        return {'statements': by_time(statements), 'methods': by_time(methods), 'connections': connections}
+
+    def to_json(self):
+        return json.dumps(self.report(), indent=2)
+
+    def to_prometheus(self):
+        """ The report in the Prometheus text exposition format. """
+        report = self.report()
+
+        def label(value):
+            return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        lines = []
+        for kind, name in (('statements', 'statement'), ('methods', 'method')):
+            metric = f'inventory_{name}'
+            lines.append(f'# TYPE {metric}_seconds summary')
+            if kind == 'statements':
+                lines.append(f'# TYPE {metric}_rows_total counter')
+            for key, stats in report[kind].items():
+                labels = f'{name}="{label(key)}"'
+                for quantile, key in (('0.5', 'p50'), ('0.95', 'p95'), ('0.99', 'p99')):
+                    lines.append(f'{metric}_seconds{{{labels},quantile="{quantile}"}} {stats[key]:.9f}')
+                lines.append(f'{metric}_seconds_sum{{{labels}}} {stats["seconds"]:.9f}')
+                lines.append(f'{metric}_seconds_count{{{labels}}} {stats["calls"]}')
+                if kind == 'statements':
+                    lines.append(f'{metric}_rows_total{{{labels}}} {stats["rows"]}')
+        connections = report['connections']
+        lines += ['# TYPE inventory_connection_open_seconds summary',
+                  f'inventory_connection_open_seconds_sum {connections["seconds"]:.9f}',
+                  f'inventory_connection_open_seconds_count {connections["calls"]}']
+        return '\n'.join(lines) + '\n'
+
+    def write(self, file_path):
+        """ Write the report to file_path: Prometheus text for a ".prom"
+        file, JSON otherwise. """
+        with open(file_path, 'w') as file:
+            file.write(self.to_prometheus() if file_path.endswith('.prom') else self.to_json())
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    _sample = None
+
+    def execute(self, sql, parameters=()):
+        self.finish()
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._sample = [sql, parameters, time.perf_counter() - start, 0]
 
-    def get_coordinates_by_id(self, customer_id):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
+    def executemany(self, sql, seq_of_parameters):
+        self.finish()
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._sample = [sql, None, time.perf_counter() - start, 0]
+
+    def executescript(self, sql_script):
+        self.finish()
+        start = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            self._sample = [sql_script, None, time.perf_counter() - start, 0]
+
+    def fetched(self, seconds, rows):
+        if self._sample is not None:
+            self._sample[2] += seconds
+            self._sample[3] += rows
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self.fetched(time.perf_counter() - start, row is not None)
+        if row is None:
+            self.finish()
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self.fetched(time.perf_counter() - start, len(rows))
+        if not rows:
+            self.finish()
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self.fetched(time.perf_counter() - start, len(rows))
+        self.finish()
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self.fetched(time.perf_counter() - start, 0)
+            self.finish()
+            raise
+        self.fetched(time.perf_counter() - start, 1)
+        return row
+
+    def close(self):
+        self.finish()
+        super().close()
+
+    def finish(self):
+        sample, self._sample = self._sample, None
+        if sample is not None:
+            self.connection.instrumentation.record_statement(self.connection, *sample)
+
+    def __del__(self):
+        self.finish()
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """ A connection whose statements are timed into its instrumentation. """
+    instrumentation = None
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+def instrumented(func, name, instrumentation):
+    """ Wrap an entity method so its calls are timed into instrumentation
+    under name. Generator methods are timed until exhausted, including
+    time the caller spends between items. """
+    if func.__code__.co_flags & CO_GENERATOR:
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return (yield from func(self, *args, **kwargs))
+            finally:
+                instrumentation.record_method(name, time.perf_counter() - start)
+    else:
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                instrumentation.record_method(name, time.perf_counter() - start)
+    return wrapper
+
+
+def profile_call(func, *args, output=None, limit=25, **kwargs):
+    """ Run func(*args, **kwargs) under cProfile, print the slowest
+    functions by cumulative time to stderr and, if output is given, save the
+    raw stats there for pstats or snakeviz. """
+    import cProfile
+    import pstats
+
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        if output:
+            profiler.dump_stats(output)
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(limit)
+
+
+class LookupCache:
+    """ Thread-safe LRU cache whose entries also expire after ttl seconds.
+
+    Args:
+        maxsize (int): entries kept before the least recently used is
+            evicted; 0 disables the cache. (Default: 1024)
+        ttl (float): seconds an entry stays valid, which bounds how stale a
+            value can be after another process writes the database. None
+            keeps entries until evicted or invalidated. (Default: 30.0)
+    """
+    _missing = object()
+
+    def __init__(self, maxsize=1024, ttl=30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+    def get_or_load(self, key, load):
+        """ The cached value for key, or load() stored under key. """
+        if not self.maxsize:
+            return load()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key, self._missing)
+            if entry is not self._missing:
+                value, expires = entry
+                if expires is None or now < expires:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            generation = self.invalidations
+        value = load()
+        with self._lock:
+            # A write that invalidated entries while load() ran may have
+            # made value stale, so only keep it if nothing was invalidated.
+            if generation == self.invalidations:
+                self._entries[key] = (value, None if self.ttl is None else now + self.ttl)
+                self._entries.move_to_end(key)
+                if len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self._entries), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses,
+                    'hit_ratio': self.hits / lookups if lookups else 0.0, 'evictions': self.evictions,
+                    'expirations': self.expirations, 'invalidations': self.invalidations}
+
+
+class ThreadMarker:
+    """ Kept in a thread's thread-local storage, which is released when
+    the thread exits, so a finalizer on it runs then. """
+    __slots__ = ('__weakref__',)
+
+
+class ConnectionManager:
+    """ Per-thread pool of long-lived SQLite connections for one database.
+
+    Each thread gets its own connection the first time it asks for one and
+    keeps it until the thread exits or close() is called, so statements compiled by the sqlite3
+    module's statement cache are reused across calls instead of being
+    re-prepared on every connect. Connections are opened in autocommit mode;
+    use transaction() to group writes.
 
-        cursor.execute('SELECT latitude, longitude FROM customers WHERE id = ?', (customer_id,))
-        coordinates = cursor.fetchone()
+    Args:
+        db_file (str): path to the database file, or a "file:" URI.
+        journal_mode (str): journal mode pragma. (Default: "WAL")
+        synchronous (str): synchronous pragma. NORMAL only syncs the WAL on
+            checkpoints, not on every commit. (Default: "NORMAL")
+        cache_size (int): page cache size pragma; negative values are KiB.
+            (Default: -16000)
+        mmap_size (int): bytes of the database to memory-map. (Default: 256 MiB)
+        busy_timeout (int): milliseconds to wait on a locked database.
+            (Default: 5000)
+        cached_statements (int): prepared statements kept per connection.
+            (Default: 256)
+        instrument (bool): time every statement, entity method call and
+            connection open into self.instrumentation. (Default: False)
+        slow_query_ms (float): with instrument, log statements slower than
+            this. (Default: None)
+        lookup_cache_size (int): entries in each read-through lookup cache;
+            0 turns the caches off. (Default: 1024)
+        lookup_cache_ttl (float): seconds a cached lookup stays valid.
+            (Default: 30.0)
+        snapshot_path (str): for an in-memory database, a file to recover
+            it from on start-up and to save it to in the background.
+            (Default: None)
+        snapshot_interval (float): seconds between background snapshots,
+            taken only when something changed. (Default: 30.0)
+        snapshot_changes (int): rows changed that trigger a snapshot
+            before the interval is up; None to only go by time.
+            (Default: 10000)
+
+    A db_file of ":memory:" keeps the database in memory, shared by every
+    thread's connection, for as long as the manager is open. A connection
+    held by the manager keeps it alive between uses.
+    """
+    _registry = {}
+    _registry_lock = threading.Lock()
 
+    def __init__(self, db_file, journal_mode="WAL", synchronous="NORMAL", cache_size=-16000,
+                 mmap_size=268435456, busy_timeout=5000, cached_statements=256, instrument=False,
+                 slow_query_ms=None, lookup_cache_size=1024, lookup_cache_ttl=30.0, snapshot_path=None,
+                 snapshot_interval=30.0, snapshot_changes=10000):
+        self.db_file = db_file
+        self.in_memory = db_file == ':memory:'
+        # The memdb VFS shares one in-memory database between connections
+        # with ordinary file locking, so busy_timeout applies; a shared-cache
+        # ":memory:" database fails concurrent writers with "table is locked".
+        self.uri = f'file:/inventory-{os.getpid()}-{id(self)}?vfs=memdb' if self.in_memory else db_file
+        self.pragmas = {
+            'journal_mode': journal_mode,
+            'synchronous': synchronous,
+            'cache_size': cache_size,
+            'mmap_size': mmap_size,
+            'busy_timeout': busy_timeout,
+        }
+        self.cached_statements = cached_statements
+        self.instrumentation = Instrumentation(slow_query_ms) if instrument else None
+        self.lookup_cache_options = {'maxsize': lookup_cache_size, 'ttl': lookup_cache_ttl}
+        self.caches = {}
+        self._local = threading.local()
+        self._connections = []
+        self._retired_changes = 0
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+        # Absolute, so the final snapshot at exit lands in the same place.
+        self.snapshot_path = os.path.abspath(snapshot_path) if self.in_memory and snapshot_path else None
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_changes = snapshot_changes
+        self.snapshots = 0
+        self._anchor = self.connect() if self.in_memory else None
+        if self.snapshot_path:
+            if os.path.exists(self.snapshot_path):
+                source = sqlite3.connect(f'file:{self.snapshot_path}?mode=ro', uri=True)
+                try:
+                    source.backup(self._anchor)
+                finally:
+                    source.close()
+            self._snapshot_lock = threading.Lock()
+            self._snapshot_state = (0, time.monotonic())
+            self._stop_snapshots = threading.Event()
+            self._snapshot_thread = threading.Thread(target=self._snapshot_loop, name='snapshots', daemon=True)
+            self._snapshot_thread.start()
+            atexit.register(self.close)
+
+    @classmethod
+    def for_database(cls, db_file, **options):
+        """ Return the shared manager for db_file, creating it on first use.
+
+        Options only take effect when the manager is created.
+        """
+        with cls._registry_lock:
+            manager = cls._registry.get(db_file)
+            if manager is None:
+                manager = cls._registry[db_file] = cls(db_file, **options)
+            return manager
+
+    def connect(self):
+        start = time.perf_counter()
+        conn = sqlite3.connect(self.uri, isolation_level=None, check_same_thread=False,
+                               cached_statements=self.cached_statements, uri=self.uri.startswith('file:'),
+                               factory=sqlite3.Connection if self.instrumentation is None else InstrumentedConnection)
+        for pragma, value in self.pragmas.items():
+            if value is not None:
+                sqlite3.Cursor(conn).execute(f'PRAGMA {pragma} = {value}')
+        if self.instrumentation is not None:
+            conn.instrumentation = self.instrumentation
+            self.instrumentation.record_connect(time.perf_counter() - start)
+        return conn
+
+    def connection(self):
+        if self._pid != os.getpid():
+            # SQLite connections must not be used across fork(); a child
+            # process abandons the parent's connections and opens its own.
+            self._local = threading.local()
+            self._connections = []
+            self._retired_changes = 0
+            self._lock = threading.Lock()
+            self._pid = os.getpid()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self.connect()
+            with self._lock:
+                self._connections.append(conn)
+            # Threads come and go in executors and servers, so each one's
+            # connection is closed as it exits rather than kept until close().
+            marker = self._local.marker = ThreadMarker()
+            weakref.finalize(marker, self._retire, conn).atexit = False
+        return conn
+
+    def _retire(self, conn):
+        with self._lock:
+            # Connections from before close() or a fork are no longer ours.
+            if conn not in self._connections:
+                return
+            self._connections.remove(conn)
+            self._retired_changes += conn.total_changes
         conn.close()
 
-        return coordinates
+    @contextmanager
+    def transaction(self, immediate=False):
+        """ Run the enclosed statements in one transaction on this thread's
+        connection, committing on success and rolling back on error.
+
+        Nested calls join the outer transaction. immediate=True takes the
+        write lock up front, which avoids lock-upgrade deadlocks between
+        concurrent writers.
+        """
+        conn = self.connection()
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+        pending = self._local.pending_invalidations = []
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+        finally:
+            self._local.pending_invalidations = None
+        for name, key in pending:
+            self.invalidate(name, key)
+
+    def cache(self, name):
+        """ The read-through LookupCache called name, shared by every entity
+        on this database. """
+        cache = self.caches.get(name)
+        if cache is None:
+            with self._lock:
+                cache = self.caches.setdefault(name, LookupCache(**self.lookup_cache_options))
+        return cache
+
+    def invalidate(self, name, key=None):
+        """ Drop key, or every entry when key is None, from the named cache.
+
+        Inside a transaction() the entry is dropped once the transaction
+        commits, so a concurrent reader can't cache the value it replaces.
+        """
+        pending = getattr(self._local, 'pending_invalidations', None)
+        if pending is not None:
+            pending.append((name, key))
+        elif key is None:
+            self.cache(name).clear()
+        else:
+            self.cache(name).invalidate(key)
+
+    def cache_stats(self):
+        return {name: cache.stats() for name, cache in self.caches.items()}
+
+    def changes(self):
+        """ Rows changed through this manager's connections, including
+        those of threads that have exited. """
+        with self._lock:
+            return self._retired_changes + sum(conn.total_changes for conn in self._connections)
+
+    def snapshot(self):
+        """ Save the in-memory database to snapshot_path.
+
+        It is first copied to a private in-memory database, which only
+        holds off writers for a memory-to-memory copy, and that copy is
+        then written out with save_snapshot.
+        """
+        with self._snapshot_lock:
+            changes = self.changes()
+            copy = sqlite3.connect(':memory:')
+            try:
+                self._anchor.backup(copy)
+                save_snapshot(copy, self.snapshot_path)
+            finally:
+                copy.close()
+            self._snapshot_state = (changes, time.monotonic())
+            self.snapshots += 1
+
+    def _snapshot_loop(self):
+        while not self._stop_snapshots.wait(min(0.25, self.snapshot_interval)):
+            saved_changes, saved_at = self._snapshot_state
+            pending = self.changes() - saved_changes
+            if pending and (time.monotonic() - saved_at >= self.snapshot_interval
+                            or self.snapshot_changes and pending >= self.snapshot_changes):
+                try:
+                    self.snapshot()
+                except sqlite3.Error as e:
+                    logger.warning("Snapshot to %s failed: %s", self.snapshot_path, e)
+
+    def close(self):
+        """ Close every connection. An in-memory database with a
+        snapshot_path is saved one last time first. """
+        if self.snapshot_path and not self._stop_snapshots.is_set():
+            self._stop_snapshots.set()
+            self._snapshot_thread.join()
+            atexit.unregister(self.close)
+            if self.changes() != self._snapshot_state[0]:
+                self.snapshot()
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+            if self._anchor is not None:
+                self._anchor.close()
+                self._anchor = None
+        # Outside the lock, as dropping the old thread-local storage runs
+        # the finalizers of its connections.
+        self._local = threading.local()
+        with self._registry_lock:
+            if self._registry.get(self.db_file) is self:
+                del self._registry[self.db_file]
 
 
-class Machines(BaseEntity):
-    def __init__(self, db_file='inventory.db'):
-        super().__init__(db_file)
-        self.drop_table('machines')
+class BaseEntity:
+    indexes = ()
+    lookup_caches = ()
+    search_columns = {}
+    aggregates = {}
+    references = {}
+    line_ids = False
+
+    def __init__(self, db_file, **options):
+        self.db_file = db_file
+        self.db = ConnectionManager.for_database(db_file, **options)
+        if self.db.instrumentation is not None:
+            self.instrument_methods()
+        self.create_sync_tables()
+
+    def instrument_methods(self):
+        # Time every public method of this entity, including the ones it
+        # inherits, under "Class.method"; the low-level helpers below are
+        # already covered by the per-statement timings. The timed methods
+        # shadow the class's on this instance only, so entities on a
+        # database without instrumentation pay nothing per call.
+        cls = type(self)
+        for name in dir(cls):
+            if name.startswith('_') or name in ('connection', 'transaction', 'query', 'query_one', 'execute'):
+                continue
+            method = next(klass.__dict__[name] for klass in cls.__mro__ if name in klass.__dict__)
+            if isinstance(method, FunctionType):
+                timed = instrumented(method, f'{cls.__name__}.{name}', self.db.instrumentation)
+                setattr(self, name, timed.__get__(self))
+
+    def connection(self):
+        return self.db.connection()
+
+    def transaction(self, immediate=False):
+        return self.db.transaction(immediate)
+
+    def query(self, sql, params=()):
+        return self.connection().execute(sql, params).fetchall()
+
+    def query_one(self, sql, params=()):
+        return self.connection().execute(sql, params).fetchone()
+
+    def execute(self, sql, params=()):
+        with self.transaction() as conn:
+            return conn.execute(sql, params)
+
+    def close(self):
+        self.db.close()
+
+    def drop_table(self, table_name):
+        with self.transaction() as conn:
+            conn.execute(f'DROP TABLE IF EXISTS {table_name}')
+            conn.execute('DELETE FROM source_files WHERE table_name = ?', (table_name,))
+            conn.execute('DELETE FROM source_rows WHERE table_name = ?', (table_name,))
+            if table_name == self.table_name:
+                if self.search_columns:
+                    conn.execute(f'DROP TABLE IF EXISTS {table_name}_fts')
+                for name in self.aggregates:
+                    conn.execute(f'DROP TABLE IF EXISTS {name}')
+                self.clear_lookup_caches()
+
+    def clear_lookup_caches(self):
+        for name in self.lookup_caches:
+            self.db.invalidate(name)
+
+    def create_indexes(self, conn):
+        """ Secondary indexes for the table's hot queries. bulk_load drops
+        and rebuilds them around large loads. """
+        for index_sql in self.indexes:
+            conn.execute(index_sql)
+
+    def create_search_index(self, conn):
+        """ FTS5 index over the table's search_columns, storing only the
+        index and reading the text back from the table itself.
+
+        Triggers keep it current as rows are inserted, deleted or have a
+        searched column changed; other updates, like stock deductions,
+        don't touch it. """
+        if not self.search_columns:
+            return
+        table, columns = self.table_name, list(self.search_columns)
+        exists = conn.execute('SELECT 1 FROM sqlite_master WHERE name = ?', (f'{table}_fts',)).fetchone()
+        conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5({', '.join(columns)}, "
+                     f"content='{table}', content_rowid='id', prefix='2 3', tokenize='unicode61')")
+        old_values = ', '.join(f'OLD.{column}' for column in columns)
+        new_values = ', '.join(f'NEW.{column}' for column in columns)
+        insert = f"INSERT INTO {table}_fts (rowid, {', '.join(columns)}) VALUES (NEW.id, {new_values});"
+        delete = (f"INSERT INTO {table}_fts ({table}_fts, rowid, {', '.join(columns)}) "
+                  f"VALUES ('delete', OLD.id, {old_values});")
+        triggers = {
+            f'{table}_fts_insert': (f'AFTER INSERT ON {table}', insert),
+            f'{table}_fts_delete': (f'AFTER DELETE ON {table}', delete),
+            f'{table}_fts_update': (f"AFTER UPDATE OF {', '.join(columns)} ON {table}", delete + ' ' + insert),
+        }
+        for name, (event, body) in triggers.items():
+            conn.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END')
+        if not exists:
+            # Rank matches by BM25 with the class's column weights, and index
+            # any rows already in the table.
+            weights = ', '.join(str(float(weight)) for weight in self.search_columns.values())
+            conn.execute(f"INSERT INTO {table}_fts ({table}_fts, rank) VALUES ('rank', 'bm25({weights})')")
+            conn.execute(f"INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild')")
+
+    def create_aggregates(self, conn):
+        """ Summary tables for the class's aggregates, which map a table
+        name to (key columns, {measure: SQL expression over a row}). Each
+        holds one row per distinct key with every measure summed over the
+        rows that have it. The first measure should count rows: a key is
+        removed once its count falls to zero.
+
+        Triggers apply each inserted, deleted or updated row as a delta, so
+        the summaries never rescan the table, and updates that change none
+        of an aggregate's columns leave it alone. """
+        table, columns = self.table_name, set(self.columns)
+        for name, (keys, measures) in self.aggregates.items():
+            exists = conn.execute('SELECT 1 FROM sqlite_master WHERE name = ?', (name,)).fetchone()
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {name} ({', '.join(keys)}, "
+                         f"{', '.join(f'{measure} NOT NULL' for measure in measures)}, "
+                         f"PRIMARY KEY ({', '.join(keys)})) WITHOUT ROWID")
+
+            new_values = [f'NEW.{key}' for key in keys]
+            new_values += [qualify_columns(expression, columns, 'NEW') for expression in measures.values()]
+            add = self.aggregate_upsert(name, f"VALUES ({', '.join(new_values)})") + ';'
+            deltas = ', '.join(f"{measure} = {measure} - ({qualify_columns(expression, columns, 'OLD')})"
+                               for measure, expression in measures.items())
+            match = ' AND '.join(f'{key} = OLD.{key}' for key in keys)
+            remove = (f'UPDATE {name} SET {deltas} WHERE {match}; '
+                      f'DELETE FROM {name} WHERE {match} AND {next(iter(measures))} = 0;')
+            used = set(keys).union(*(SQL_STRING_OR_WORD.findall(expression) for expression in measures.values()))
+            watched = ', '.join(column for column in self.columns if column in used)
+            triggers = {
+                f'{name}_insert': (f'AFTER INSERT ON {table}', add),
+                f'{name}_delete': (f'AFTER DELETE ON {table}', remove),
+                f'{name}_update': (f'AFTER UPDATE OF {watched} ON {table}', f'{remove} {add}'),
+            }
+            for trigger, (event, body) in triggers.items():
+                conn.execute(f'CREATE TRIGGER IF NOT EXISTS {trigger} {event} BEGIN {body} END')
+            if not exists:
+                self.add_to_aggregate(conn, name)
+
+    def aggregate_upsert(self, name, rows):
+        """ INSERT of rows (a VALUES or SELECT clause) into the named
+        aggregate, adding to the measures of keys it already holds. """
+        keys, measures = self.aggregates[name]
+        return (f"INSERT INTO {name} ({', '.join(keys)}, {', '.join(measures)}) {rows} "
+                f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET "
+                f"{', '.join(f'{measure} = {measure} + excluded.{measure}' for measure in measures)}")
+
+    def add_to_aggregate(self, conn, name, after=0):
+        """ Fold the rows with IDs above after into the named aggregate in
+        one grouped pass. """
+        keys, measures = self.aggregates[name]
+        sums = ', '.join(f'SUM({expression})' for expression in measures.values())
+        conn.execute(self.aggregate_upsert(name, f"SELECT {', '.join(keys)}, {sums} FROM {self.table_name} "
+                                                 f"WHERE id > ? GROUP BY {', '.join(keys)}"), (after,))
+
+    def search(self, text, limit=20, prefix=True, candidates=None):
+        """ Rows matching every word of text in the search_columns, best
+        match first. With prefix, each word also matches longer words it
+        starts, so "kio" finds "Kiosk".
+
+        Every match is ranked unless candidates is given, in which case
+        only the first candidates matches are, which keeps words found in
+        a large share of the table fast to search at the cost of an
+        approximate order among them.
+
+        Returns:
+            list of records.
+        """
+        query = search_query(text, prefix)
+        if not query:
+            return []
+        order = 'ORDER BY rank ' if candidates is None else ''
+        return self.query_records(f'''
+            SELECT {self.table_name}.* FROM (
+                SELECT rowid, rank FROM {self.table_name}_fts WHERE {self.table_name}_fts MATCH ? {order}LIMIT ?
+            ) AS matches
+            INNER JOIN {self.table_name} ON {self.table_name}.id = matches.rowid
+            ORDER BY matches.rank
+            LIMIT ?
+        ''', (query, limit if candidates is None else candidates, limit))
+
+    def create_sync_tables(self):
+        with self.transaction() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS source_files (
+                    table_name TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    mtime REAL NOT NULL,
+                    size INTEGER NOT NULL,
+                    sha256 TEXT NOT NULL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS source_rows (
+                    table_name TEXT NOT NULL,
+                    row_key TEXT NOT NULL,
+                    row_hash TEXT NOT NULL,
+                    PRIMARY KEY (table_name, row_key)
+                ) WITHOUT ROWID
+            ''')
+
+    def query_within(self, sql, params, point, radius, units="mi"):
+        """ Rows of sql within radius of point, nearest first.
+
+        sql selects from customers_rtree with named parameters :min_lat,
+        :max_lat, :min_lon and :max_lon bounding the search box, and its
+        last two columns must be latitude and longitude. The R*Tree narrows
+        the search to the box; exact distances are then checked with
+        haversine.
+
+        Returns:
+            list of (distance, row) tuples.
+        """
+        results = []
+        for min_lat, max_lat, min_lon, max_lon in bounding_boxes(point, radius, units):
+            box = dict(params, min_lat=min_lat, max_lat=max_lat, min_lon=min_lon, max_lon=max_lon)
+            for row in self.query(sql, box):
+                distance = haversine(point, row[-2:], units)
+                if distance <= radius:
+                    results.append((distance, row))
+        results.sort(key=lambda result: result[0])
+        return results
+
+    def query_nearest(self, sql, params, point, k, units="mi", radius=5.0):
+        """ The k rows of sql nearest to point, found by searching
+        within a radius that grows until it holds k rows. """
+        R = 6372.8 if units == "km" else 3959.87433
+        while True:
+            results = self.query_within(sql, params, point, radius, units)
+            if len(results) >= k or radius >= pi * R:
+                return results[:k]
+            radius *= 4
+
+    def rows_page(self, after=None, limit=1000, select=None, where='', params=()):
+        """ One keyset page of rows in ID order.
+
+        Args:
+            after (str): token returned with the previous page, or None
+                for the first page.
+            limit (int): rows per page. (Default: 1000)
+            select (str): SELECT ... FROM clause whose first column is the
+                table's ID. (Default: every column of the table, returned
+                as the entity's record class)
+            where (str): extra filter with "?" placeholders for params.
+
+        Returns:
+            tuple: (list of rows, token for the next page or None)
+        """
+        key = f'{self.table_name}.id'
+        clauses = [where] if where else []
+        params = tuple(params)
+        if after is not None:
+            clauses.append(f'{key} > ?')
+            params += (json.loads(after),)
+        rows = self.query(f'{select or f"SELECT * FROM {self.table_name}"}'
+                          f'{" WHERE " + " AND ".join(clauses) if clauses else ""} ORDER BY {key} LIMIT ?',
+                          params + (limit,))
+        if select is None:
+            rows = self.record.from_rows(rows)
+        if len(rows) < limit:
+            return rows, None
+        return rows, json.dumps(rows[-1][0])
+
+    def iter_rows(self, after=None, page_size=1000, select=None, where='', params=()):
+        """ Yield every row of rows_page's query, one page at a time, so
+        memory stays at one page however large the table is. """
+        while True:
+            rows, after = self.rows_page(after, page_size, select, where, params)
+            yield from rows
+            if after is None:
+                return
+
+    def query_records(self, sql, params=(), record=None):
+        """ Rows of a SELECT * query as record objects. (Default record
+        class: the entity's) """
+        return (record or self.record).from_rows(self.connection().execute(sql, params))
+
+    def column_arrays(self, where='', params=(), page_size=10000):
+        """ The table, optionally filtered, in columnar form for analytics
+        over whole tables.
+
+        Returns:
+            dict: column name to values in ID order. Numeric columns are
+            array.array (readable by numpy.frombuffer without copying;
+            missing floats are NaN) and text columns are lists, with
+            categorical values stored once and shared.
+        """
+        record = self.record
+        columns = {field: array(code) if code else [] for field, code in zip(record.__slots__, record.typecodes)}
+        shared = {}
+        after = None
+        while True:
+            rows, after = self.rows_page(after, page_size, f'SELECT * FROM {self.table_name}', where, params)
+            for position, (field, code) in enumerate(zip(record.__slots__, record.typecodes)):
+                if code == 'd':
+                    columns[field].extend(nan if row[position] is None else row[position] for row in rows)
+                elif field in record.categorical:
+                    columns[field].extend(shared.setdefault(row[position], row[position]) for row in rows)
+                else:
+                    columns[field].extend(row[position] for row in rows)
+            if after is None:
+                return columns
+
+    def export(self, file_path, where='', params=(), page_size=1000):
+        """ Stream the table, optionally filtered, to file_path: JSON lines
+        for a ".jsonl" file, CSV with a header row otherwise, or CSV on
+        stdout for "-". Returns the number of rows written. """
+        columns = ('id',) + self.columns
+        rows = self.iter_rows(page_size=page_size, where=where, params=params,
+                              select=f'SELECT {", ".join(columns)} FROM {self.table_name}')
+        if file_path == '-':
+            return write_rows(sys.stdout, columns, rows)
+        with open(file_path, 'w', newline='') as file:
+            return write_rows(file, columns, rows, 'jsonl' if file_path.endswith('.jsonl') else 'csv')
+
+    def parse_chunks(self, file_path, chunk_size, workers):
+        """ Yield parse_lines results for file_path, about chunk_size lines
+        at a time, with line numbers counted from the top of the file. """
+        parse_line = self.source_format.parse
+        if workers <= 1:
+            first_line = 1
+            with open(file_path, 'r') as file:
+                while lines := list(islice(file, chunk_size)):
+                    yield parse_lines(parse_line, lines, first_line)
+                    first_line += len(lines)
+            return
+
+        from concurrent.futures import ProcessPoolExecutor
+
+        # Roughly chunk_size lines per task; at most two tasks per worker are
+        # in flight so memory stays bounded on very large files.
+        ranges = split_file(file_path, chunk_size * 64)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            first_line = 1
+
+            def next_result():
+                nonlocal first_line
+                rows, numbers, rejected, count = pending.popleft().result()
+                offset, first_line = first_line - 1, first_line + count
+                return (rows, [number + offset for number in numbers],
+                        [(number + offset, reason, line) for number, reason, line in rejected])
+
+            for start, end in ranges:
+                pending.append(executor.submit(parse_file_range, parse_line, file_path, start, end))
+                if len(pending) >= workers * 2:
+                    yield next_result()
+            while pending:
+                yield next_result()
+
+    def parsed_chunks(self, file_path, chunk_size, workers=1, cache_dir=None, digest=None):
+        """ parse_chunks, or with cache_dir, its results saved there with
+        marshal by a previous load of a file with the same SHA-256
+        (digest, when already known) and the same source_format, so
+        reloading an unchanged file skips parsing it. """
+        if cache_dir is None:
+            yield from self.parse_chunks(file_path, chunk_size, workers)
+            return
+
+        prefix = f'{self.table_name}-{self.source_format.version}-'
+        cache_path = os.path.join(cache_dir, f'{prefix}{digest or file_digest(file_path)}.marshal')
+        # Each chunk is stored as its length and then its marshal bytes, as
+        # marshal.load reading straight from a file is several times slower.
+        if os.path.exists(cache_path):
+            with open(cache_path, 'rb') as file:
+                while size := int.from_bytes(file.read(8), 'little'):
+                    yield marshal.loads(file.read(size))
+            return
+
+        os.makedirs(cache_dir, exist_ok=True)
+        partial_path = f'{cache_path}.partial'
+        try:
+            with open(partial_path, 'wb') as file:
+                for chunk in self.parse_chunks(file_path, chunk_size, workers):
+                    data = marshal.dumps(chunk)
+                    file.write(len(data).to_bytes(8, 'little'))
+                    file.write(data)
+                    yield chunk
+        except BaseException:
+            os.remove(partial_path)
+            raise
+        os.replace(partial_path, cache_path)
+        # Only the latest parse of each table is worth keeping.
+        for name in os.listdir(cache_dir):
+            stale = os.path.join(cache_dir, name)
+            if name.startswith(f'{self.table_name}-') and name.endswith('.marshal') and stale != cache_path:
+                os.remove(stale)
+
+    def validated_chunks(self, conn, file_path, rejected, chunk_size=10000, workers=1, cache_dir=None, digest=None):
+        """ Yield (rows, their line numbers) for the lines of file_path
+        that parse, whose references exist and whose natural_key no earlier
+        line has, adding (line number, reason, line or None) to rejected for
+        every other line.
+
+        Each column in references must name the ID of a row in its table.
+        A table that hasn't been created yet isn't checked, so a table can
+        still be loaded on its own.
+        """
+        references = [(self.columns.index(column), table) for column, table in self.references.items()
+                      if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                      (table,)).fetchone()]
+        row_key = itemgetter(*(self.columns.index(column) for column in self.natural_key))
+        first_lines = {}
+        for rows, numbers, bad_lines in self.parsed_chunks(file_path, chunk_size, workers, cache_dir, digest):
+            rejected.extend(bad_lines)
+            for position, table in references:
+                ids = list({row[position] for row in rows})
+                found = {row[0] for row in conn.execute(
+                    f'SELECT {table}.id FROM json_each(?) INNER JOIN {table} ON {table}.id = json_each.value',
+                    (json.dumps(ids),))}
+                if len(found) == len(ids):
+                    continue
+                column = self.columns[position]
+                rejected.extend((number, f"{column}: no row {row[position]} in {table}", None)
+                                for row, number in zip(rows, numbers) if row[position] not in found)
+                kept = [index for index, row in enumerate(rows) if row[position] in found]
+                rows, numbers = [rows[index] for index in kept], [numbers[index] for index in kept]
+            firsts = [first_lines.setdefault(row_key(row), number) for row, number in zip(rows, numbers)]
+            if firsts != numbers:
+                rejected.extend((number, f"{', '.join(self.natural_key)}: duplicate of line {first}", None)
+                                for number, first in zip(numbers, firsts) if first != number)
+                kept = [index for index, (number, first) in enumerate(zip(numbers, firsts)) if first == number]
+                rows, numbers = [rows[index] for index in kept], [numbers[index] for index in kept]
+            yield rows, numbers
+
+    def quarantine_path(self, file_path):
+        """ Where rejected lines of file_path are written: beside it, with
+        ".rejected.jsonl" in place of its extension. """
+        return f'{os.path.splitext(file_path)[0]}.rejected.jsonl'
+
+    def bulk_load(self, file_path, chunk_size=10000, workers=1, cache_dir=None):
+        """ Stream file_path into this entity's table.
+
+        Lines are parsed and validated in chunks (in worker processes when
+        workers > 1, or read back from cache_dir when this file was parsed
+        before) and inserted with executemany inside a single transaction.
+        The table's indexes are dropped for the load and rebuilt once at
+        the end. Rejected lines are written, with the reasons, to the
+        file's quarantine_path. With line_ids, each row's ID is its line
+        number after the table's highest ID before the load, so a rejected
+        line leaves a gap rather than shifting the IDs after it.
+
+        Returns:
+            IngestReport: row count, rejections and throughput of the load.
+        """
+        start = time.perf_counter()
+        columns = ('id',) + self.columns if self.line_ids else self.columns
+        sql = f'INSERT INTO {self.table_name} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})'
+        rows = 0
+        rejected = []
+
+        with self.transaction() as conn:
+            indexes = conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? "
+                                   "AND sql IS NOT NULL", (self.table_name,)).fetchall()
+            for name, _ in indexes:
+                conn.execute(f'DROP INDEX {name}')
+            # Index and summarize the new rows in one pass each rather than row by row.
+            last_id = conn.execute(f'SELECT MAX(id) FROM {self.table_name}').fetchone()[0] or 0
+            if self.search_columns:
+                conn.execute(f'DROP TRIGGER IF EXISTS {self.table_name}_fts_insert')
+            for name in self.aggregates:
+                conn.execute(f'DROP TRIGGER IF EXISTS {name}_insert')
+
+            for chunk, numbers in self.validated_chunks(conn, file_path, rejected, chunk_size, workers, cache_dir):
+                if self.line_ids:
+                    chunk = [(last_id + number,) + row for row, number in zip(chunk, numbers)]
+                conn.executemany(sql, chunk)
+                rows += len(chunk)
+
+            for _, index_sql in indexes:
+                conn.execute(index_sql)
+            if self.search_columns:
+                columns = ', '.join(self.search_columns)
+                conn.execute(f'INSERT INTO {self.table_name}_fts (rowid, {columns}) '
+                             f'SELECT id, {columns} FROM {self.table_name} WHERE id > ?', (last_id,))
+                self.create_search_index(conn)
+            for name in self.aggregates:
+                self.add_to_aggregate(conn, name, last_id)
+            self.create_aggregates(conn)
+            self.clear_lookup_caches()
+
+        write_quarantine(self.quarantine_path(file_path), file_path, rejected)
+        return IngestReport(self.table_name, rows, time.perf_counter() - start, len(rejected),
+                            self.quarantine_path(file_path))
+
+    def sync(self, file_path, chunk_size=10000, cache_dir=None):
+        """ Bring this entity's table in line with file_path, touching only
+        the rows that changed since the last sync.
+
+        The file is skipped outright when its mtime and size (or, failing
+        that, its SHA-256) match the last sync. Otherwise each line is
+        keyed by the class's natural_key and compared to the hash stored
+        for that key: new keys are inserted, changed rows are overwritten
+        and keys no longer in the file are deleted. Rows whose source line
+        is unchanged keep any edits made since, such as inventory
+        deductions. Lines that fail validation are written to the file's
+        quarantine_path, as in bulk_load, and leave their rows as they
+        were: a rejected line's key can't always be read, so while any line
+        is rejected no rows are deleted. With line_ids, a new row takes its
+        line number as its ID when no other row has it.
+
+        Returns:
+            SyncReport: what changed.
+        """
+        start = time.perf_counter()
+        stat = os.stat(file_path)
+        state = self.query_one('SELECT mtime, size, sha256 FROM source_files WHERE table_name = ?',
+                               (self.table_name,))
+        if state and state[0] == stat.st_mtime and state[1] == stat.st_size:
+            return SyncReport(self.table_name, time.perf_counter() - start, skipped=True)
+
+        digest = file_digest(file_path)
+        if state and state[2] == digest:
+            self.execute('UPDATE source_files SET path = ?, mtime = ? WHERE table_name = ?',
+                         (file_path, stat.st_mtime, self.table_name))
+            return SyncReport(self.table_name, time.perf_counter() - start, skipped=True)
+
+        key_positions = [self.columns.index(column) for column in self.natural_key]
+        key_clause = ' AND '.join(f'{column} = ?' for column in self.natural_key)
+        update_sql = (f'UPDATE {self.table_name} SET {", ".join(f"{column} = ?" for column in self.columns)} '
+                      f'WHERE {key_clause}')
+        insert_sql = (f'INSERT INTO {self.table_name} ({", ".join(self.columns)}) '
+                      f'VALUES ({", ".join("?" * len(self.columns))})')
+        insert_id_sql = (f'INSERT OR IGNORE INTO {self.table_name} (id, {", ".join(self.columns)}) '
+                         f'VALUES ({", ".join("?" * (len(self.columns) + 1))})')
+        report = SyncReport(self.table_name, 0)
+        rejected = []
+
+        with self.transaction() as conn:
+            conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{self.table_name}_natural_key '
+                         f'ON {self.table_name} ({", ".join(self.natural_key)})')
+            stored = dict(conn.execute('SELECT row_key, row_hash FROM source_rows WHERE table_name = ?',
+                                       (self.table_name,)))
+            for rows, numbers in self.validated_chunks(conn, file_path, rejected, chunk_size, cache_dir=cache_dir,
+                                                       digest=digest):
+                for row, number in zip(rows, numbers):
+                    key_values = tuple(row[position] for position in key_positions)
+                    row_key = '\x1f'.join(map(str, key_values))
+                    row_hash = row_digest(row)
+                    stored_hash = stored.pop(row_key, None)
+                    if stored_hash == row_hash:
+                        report.unchanged += 1
+                        continue
+
+                    if conn.execute(update_sql, row + key_values).rowcount:
+                        report.updated += 1
+                    else:
+                        if not (self.line_ids and conn.execute(insert_id_sql, (number,) + row).rowcount):
+                            conn.execute(insert_sql, row)
+                        report.inserted += 1
+                    conn.execute('INSERT OR REPLACE INTO source_rows (table_name, row_key, row_hash) '
+                                 'VALUES (?, ?, ?)', (self.table_name, row_key, row_hash))
+
+            # A key missing from the file may be a rejected line's, so
+            # nothing is deleted until the file is clean.
+            if rejected:
+                stored.clear()
+            for row_key in stored:
+                key_values = row_key.split('\x1f')
+                report.deleted += conn.execute(f'DELETE FROM {self.table_name} WHERE {key_clause}',
+                                               key_values).rowcount
+                conn.execute('DELETE FROM source_rows WHERE table_name = ? AND row_key = ?',
+                             (self.table_name, row_key))
+
+            conn.execute('INSERT OR REPLACE INTO source_files (table_name, path, mtime, size, sha256) '
+                         'VALUES (?, ?, ?, ?, ?)', (self.table_name, file_path, stat.st_mtime, stat.st_size, digest))
+            self.clear_lookup_caches()
+
+        write_quarantine(self.quarantine_path(file_path), file_path, rejected)
+        report.rejected = len(rejected)
+        report.seconds = time.perf_counter() - start
+        return report
+
+
+class Inventory(BaseEntity):
+    table_name = 'inventory'
+    natural_key = ('item_name', 'machine_type')
+    columns = ('item_name', 'item_description', 'price', 'quantity', 'machine_type')
+    source_format = INVENTORY_FORMAT
+    indexes = (
+        'CREATE INDEX IF NOT EXISTS idx_inventory_machine_type ON inventory (machine_type)',
+    )
+    lookup_caches = ('inventory_by_type',)
+    search_columns = {'item_name': 4.0, 'item_description': 1.0}
+    aggregates = {
+        'inventory_value': (('machine_type',), {'items': '1', 'quantity': 'quantity', 'value': 'price * quantity'}),
+    }
+    record = InventoryItem
+
+    def __init__(self, db_file='inventory.db', rebuild=True, **options):
+        super().__init__(db_file, **options)
+        if rebuild:
+            # Item IDs restart with the table, so thresholds keyed on them go too.
+            self.drop_table('low_stock')
+            self.drop_table('stock_thresholds')
+            self.drop_table('inventory')
         self.create_table()
-        self.service_history = []
-        self.distinct_machines = set()
 
     def create_table(self):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS machines (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                customer_id INTEGER NOT NULL,
-                manufacturer TEXT NOT NULL,
-                name TEXT NOT NULL,
+        with self.transaction() as conn:
+            conn.execute('''
+                    CREATE TABLE IF NOT EXISTS inventory (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        item_name TEXT NOT NULL,
+                        item_description TEXT,
+                        price REAL NOT NULL,
+                        quantity INTEGER NOT NULL,
+                        machine_type TEXT NOT NULL
+                    )
+                ''')
+            self.create_indexes(conn)
+            self.create_search_index(conn)
+            self.create_aggregates(conn)
+            self.create_stock_tables(conn)
+
+    def create_stock_tables(self, conn):
+        """ Per-item reorder points, and the items currently below theirs.
+
+        low_stock is kept current by triggers on both tables that each touch
+        only the changed item, so checking stock health never rescans the
+        inventory.
+        """
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS stock_thresholds (
+                item_id INTEGER PRIMARY KEY,
+                reorder_point INTEGER NOT NULL,
+                reorder_quantity INTEGER NOT NULL DEFAULT 0,
+                FOREIGN KEY (item_id) REFERENCES inventory(id)
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS low_stock (
+                item_id INTEGER PRIMARY KEY,
                 machine_type TEXT NOT NULL,
-                serial_number TEXT NOT NULL,
-                status TEXT NOT NULL,
-                FOREIGN KEY (customer_id) REFERENCES customers(id)
+                quantity INTEGER NOT NULL,
+                reorder_point INTEGER NOT NULL,
+                since TEXT NOT NULL
             )
         ''')
+        refresh = '''
+            INSERT INTO low_stock (item_id, machine_type, quantity, reorder_point, since)
+            SELECT inventory.id, inventory.machine_type, inventory.quantity, stock_thresholds.reorder_point,
+                   datetime('now')
+            FROM inventory INNER JOIN stock_thresholds ON stock_thresholds.item_id = inventory.id
+            WHERE inventory.id = {item} AND inventory.quantity < stock_thresholds.reorder_point
+            ON CONFLICT (item_id) DO UPDATE SET machine_type = excluded.machine_type, quantity = excluded.quantity,
+                reorder_point = excluded.reorder_point;
+            DELETE FROM low_stock WHERE item_id = {item} AND NOT EXISTS (
+                SELECT 1 FROM inventory INNER JOIN stock_thresholds ON stock_thresholds.item_id = inventory.id
+                WHERE inventory.id = {item} AND inventory.quantity < stock_thresholds.reorder_point);
+        '''
+        # No trigger on inventory inserts: IDs are never reused, so a new item
+        # has no threshold yet, and bulk loads stay trigger-free.
+        triggers = {
+            'inventory_low_stock_update': ('AFTER UPDATE OF quantity, machine_type ON inventory',
+                                           refresh.format(item='NEW.id')),
+            'inventory_low_stock_delete': ('AFTER DELETE ON inventory',
+                                           'DELETE FROM low_stock WHERE item_id = OLD.id; '
+                                           'DELETE FROM stock_thresholds WHERE item_id = OLD.id;'),
+            'stock_thresholds_low_stock_insert': ('AFTER INSERT ON stock_thresholds',
+                                                  refresh.format(item='NEW.item_id')),
+            'stock_thresholds_low_stock_update': ('AFTER UPDATE ON stock_thresholds',
+                                                  refresh.format(item='NEW.item_id')),
+            'stock_thresholds_low_stock_delete': ('AFTER DELETE ON stock_thresholds',
+                                                  'DELETE FROM low_stock WHERE item_id = OLD.item_id;'),
+        }
+        for name, (event, body) in triggers.items():
+            conn.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END')
+
+    def populate_inventory(self, file_path, chunk_size=10000, workers=1, cache_dir=None):
+        return self.bulk_load(file_path, chunk_size, workers, cache_dir)
 
-        conn.commit()
-        conn.close()
+    def display_inventory(self, items_to_display=None):
+        print("Here are all the items in the inventory: ")
+        if items_to_display:
+            for item in items_to_display:
+                print(f"ID: {item.id}, Name: {item.item_name}, Description: {item.item_description}, "
+                      f"Price: {item.price}, Quantity: {item.quantity}, Type: {item.machine_type}")
+        else:
+            empty = True
+            for item in self.iter_rows():
+                empty = False
+                print(f"ID: {item.id}, Name: {item.item_name}, Description: {item.item_description}, "
+                      f"Price: {item.price}, Quantity: {item.quantity}, Type: {item.machine_type}")
 
-    def populate_machines(self, file_path):
-        with open(file_path, 'r') as file:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-
-            for line in file:
-                values = list(map(str.strip, line.split(',')))
-
-                machine_data = {
-                    'manufacturer': values[0],
-                    'name': values[1],
-                    'machine_type': values[2],
-                    'serial_number': values[3],
-                    'status': values[4],
-                    'customer_id': values[5]
-                }
-
-                cursor.execute(
-                    'INSERT INTO machines (customer_id, manufacturer, name, machine_type, serial_number, status)'
-                    ' VALUES (?, ?, ?, ?, ?, ?)',
-                    (machine_data['customer_id'], machine_data['manufacturer'], machine_data['name'],
-                     machine_data['machine_type'], machine_data['serial_number'], machine_data['status']))
+            if empty:
+                print("Inventory is empty.")
 
-            conn.commit()
-            conn.close()
+    def get_items_by_type(self, machine_type):
+        # The cache holds immutable rows; each caller gets fresh records it may change.
+        rows = self.db.cache('inventory_by_type').get_or_load(
+            machine_type,
+            lambda: tuple(self.query('SELECT * FROM inventory WHERE machine_type = ?', (machine_type,))))
+        return self.record.from_rows(rows)
 
-    def generate_machine_issues(self):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
+    def check_quantity_available(self, item_id, quantity_needed):
+        available_quantity = self.query_one('SELECT quantity FROM inventory WHERE id = ?', (item_id,))[0]
 
-        cursor.execute('SELECT * FROM machines')
-        machines = cursor.fetchall()
+        return available_quantity >= quantity_needed
 
-        machines_to_update = random.sample(machines, random.randint(1, 8))
+    def deduct_inventory_quantity(self, item_id, quantity_needed):
+        try:
+            with self.transaction() as conn:
+                deducted = conn.execute('UPDATE inventory SET quantity = quantity - ? WHERE id = ? AND quantity >= ? '
+                                        'RETURNING machine_type',
+                                        (quantity_needed, item_id, quantity_needed)).fetchone()
+                if deducted:
+                    self.db.invalidate('inventory_by_type', deducted[0])
+            if deducted:
+                print(f"{quantity_needed} units deducted from inventory for item ID {item_id}")
+            else:
+                print(f"Insufficient quantity in the inventory for item ID {item_id}")
+            return bool(deducted)
+        except sqlite3.Error as e:
+            print(f"Error deducting inventory quantity: {e}")
 
-        for machine in machines_to_update:
-            machine_id = machine[0]
-            cursor.execute('UPDATE machines SET status = "Need Repair" WHERE id = ?', (machine_id,))
+    def restock(self, item_ids, quantity):
+        """ Top each of item_ids up to quantity units.
+
+        Returns:
+            int: the number of items that were below quantity.
+        """
+        restocked = 0
+        with self.transaction() as conn:
+            for item_id in item_ids:
+                row = conn.execute('UPDATE inventory SET quantity = ? WHERE id = ? AND quantity < ? '
+                                   'RETURNING machine_type', (quantity, item_id, quantity)).fetchone()
+                if row:
+                    restocked += 1
+                    self.db.invalidate('inventory_by_type', row[0])
+        return restocked
+
+    def set_reorder_point(self, item_id, reorder_point, reorder_quantity=0):
+        """ Mark the item as low stock whenever its quantity drops below
+        reorder_point, suggesting at least reorder_quantity units then. A
+        reorder_point of None removes the item's threshold.
+
+        Raises:
+            ValueError: there is no item with item_id.
+        """
+        with self.transaction() as conn:
+            if reorder_point is None:
+                conn.execute('DELETE FROM stock_thresholds WHERE item_id = ?', (item_id,))
+            elif not conn.execute('SELECT 1 FROM inventory WHERE id = ?', (item_id,)).fetchone():
+                raise ValueError(f"No item found with ID {item_id}.")
+            else:
+                conn.execute('INSERT INTO stock_thresholds (item_id, reorder_point, reorder_quantity) VALUES (?, ?, ?) '
+                             'ON CONFLICT (item_id) DO UPDATE SET reorder_point = excluded.reorder_point, '
+                             'reorder_quantity = excluded.reorder_quantity', (item_id, reorder_point, reorder_quantity))
+
+    def set_reorder_points(self, reorder_point, reorder_quantity=0, machine_type=None):
+        """ set_reorder_point for every item, or every item for machine_type.
+
+        Returns:
+            int: the number of items updated.
+        """
+        with self.transaction() as conn:
+            return conn.execute('''
+                INSERT INTO stock_thresholds (item_id, reorder_point, reorder_quantity)
+                SELECT id, ?, ? FROM inventory WHERE ? IS NULL OR machine_type = ?
+                ON CONFLICT (item_id) DO UPDATE SET reorder_point = excluded.reorder_point,
+                    reorder_quantity = excluded.reorder_quantity
+            ''', (reorder_point, reorder_quantity, machine_type, machine_type)).rowcount
+
+    def low_stock_items(self, machine_type=None):
+        """ Items below their reorder point, most recently low first.
+
+        Returns:
+            list of (item_id, item_name, machine_type, quantity, reorder_point, since) rows.
+        """
+        return self.query('''
+            SELECT low_stock.item_id, inventory.item_name, low_stock.machine_type, low_stock.quantity,
+                   low_stock.reorder_point, low_stock.since
+            FROM low_stock INNER JOIN inventory ON inventory.id = low_stock.item_id
+            WHERE ? IS NULL OR low_stock.machine_type = ?
+            ORDER BY low_stock.since DESC, low_stock.item_id
+        ''', (machine_type, machine_type))
+
+    def low_stock_item(self, item_id):
+        """ The item's (quantity, reorder_point) while it is below its
+        reorder point, otherwise None. """
+        return self.query_one('SELECT quantity, reorder_point FROM low_stock WHERE item_id = ?', (item_id,))
+
+    def reorder_suggestions(self, months=3, lead_days=14, cover_days=30, today=None):
+        """ What to order for each machine type, going by the parts used in
+        the service history over the last months calendar months, counting
+        the current one.
+
+        An item is suggested when it is below its reorder point or will run
+        out within lead_days at its recent rate of use. The order brings it
+        back up to its reorder point plus lead_days + cover_days of use, and
+        is never less than the item's reorder quantity.
+
+        Returns:
+            dict: machine type -> list of dicts with item_id, item_name,
+            quantity, reorder_point, daily_usage, days_left (None for unused
+            items) and order_quantity, the soonest to run out first.
+
+        Raises:
+            ValueError: months is less than 1.
+        """
+        if months < 1:
+            raise ValueError(f'months must be at least 1, not {months}')
+        today = today or datetime.now().date()
+        # Months since year 0, zero-based, of the first month in the window.
+        month = today.year * 12 + today.month - 1 - (months - 1)
+        start = datetime(month // 12, month % 12 + 1, 1).date()
+        days = (today - start).days + 1
+        usage = {}
+        if self.query_one("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'service_monthly_usage'"):
+            usage = dict(self.query('SELECT item_id, SUM(quantity) FROM service_monthly_usage WHERE month >= ? '
+                                    'GROUP BY item_id', (start.strftime('%Y-%m'),)))
+        # Only items in use or already low can need ordering.
+        candidates = sorted(set(usage).union(row[0] for row in self.query('SELECT item_id FROM low_stock')))
+
+        suggestions = defaultdict(list)
+        for chunk in (candidates[i:i + 500] for i in range(0, len(candidates), 500)):
+            rows = self.query(f'''
+                SELECT inventory.id, inventory.item_name, inventory.machine_type, inventory.quantity,
+                       COALESCE(stock_thresholds.reorder_point, 0), COALESCE(stock_thresholds.reorder_quantity, 0)
+                FROM inventory LEFT JOIN stock_thresholds ON stock_thresholds.item_id = inventory.id
+                WHERE inventory.id IN ({", ".join("?" * len(chunk))})
+            ''', chunk)
+            for item_id, item_name, machine_type, quantity, reorder_point, reorder_quantity in rows:
+                daily_usage = max(usage.get(item_id, 0), 0) / days
+                days_left = quantity / daily_usage if daily_usage else None
+                if quantity >= reorder_point and (days_left is None or days_left > lead_days):
+                    continue
+                target = reorder_point + ceil(daily_usage * (lead_days + cover_days))
+                suggestions[machine_type].append({
+                    'item_id': item_id, 'item_name': item_name, 'quantity': quantity,
+                    'reorder_point': reorder_point, 'daily_usage': daily_usage, 'days_left': days_left,
+                    'order_quantity': max(reorder_quantity, target - quantity),
+                })
+        for items in suggestions.values():
+            items.sort(key=lambda item: (item['days_left'] is None, item['days_left'] or 0, item['item_id']))
+        return dict(sorted(suggestions.items()))
+
+    def display_low_stock(self):
+        low_items = self.low_stock_items()
+        if not low_items:
+            print("No items are below their reorder point.")
+        for item_id, item_name, machine_type, quantity, reorder_point, since in low_items:
+            print(f"ID: {item_id}, Name: {item_name}, Type: {machine_type}, Quantity: {quantity}, "
+                  f"Reorder Point: {reorder_point}, Low Since: {since}")
+
+        print("\nSuggested orders:")
+        suggestions = self.reorder_suggestions()
+        if not suggestions:
+            print("Nothing needs ordering.")
+        for machine_type, items in suggestions.items():
+            print(f"{machine_type}:")
+            for item in items:
+                days_left = "not in use" if item['days_left'] is None else f"{item['days_left']:.0f} days left"
+                print(f"  ID: {item['item_id']}, Name: {item['item_name']}, Quantity: {item['quantity']} "
+                      f"({days_left}), Order: {item['order_quantity']}")
+
+    def inventory_value(self):
+        """ Stock on hand per machine type, read from the inventory_value
+        summary that triggers keep current.
+
+        Returns:
+            dict: machine type to {'items', 'quantity', 'value'}, where
+            value is the total of price * quantity.
+        """
+        return {machine_type: {'items': items, 'quantity': quantity, 'value': round(value, 2)}
+                for machine_type, items, quantity, value in self.query(
+                    'SELECT machine_type, items, quantity, value FROM inventory_value ORDER BY machine_type')}
+
+    def display_inventory_value(self):
+        totals = self.inventory_value()
+        if not totals:
+            print("Inventory is empty.")
+        for machine_type, total in totals.items():
+            print(f"{machine_type}: {total['items']} items, {total['quantity']} in stock, "
+                  f"Value: ${total['value']:,.2f}")
+        if totals:
+            print(f"Total Value: ${sum(total['value'] for total in totals.values()):,.2f}")
 
-        conn.commit()
-        conn.close()
 
-    def display_machines(self):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
+class Customer(BaseEntity):
+    table_name = 'customers'
+    natural_key = ('name',)
+    columns = ('name', 'address', 'phone_number', 'operating_hours', 'latitude', 'longitude')
+    source_format = CUSTOMER_FORMAT
+    # Machines files refer to customers by line number.
+    line_ids = True
+    lookup_caches = ('customer_coordinates',)
+    search_columns = {'name': 4.0, 'address': 1.0}
+    record = CustomerRecord
+
+    def __init__(self, db_file='inventory.db', rebuild=True, **options):
+        super().__init__(db_file, **options)
+        if rebuild:
+            self.drop_table('customers')
+            self.drop_table('customers_rtree')
+        self.create_table()
+
+    def create_table(self):
+        with self.transaction() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS customers (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    address TEXT NOT NULL,
+                    phone_number TEXT, 
+                    operating_hours TEXT,
+                    latitude REAL, 
+                    longitude REAL
+                )
+            ''')
+            self.create_indexes(conn)
+            self.create_search_index(conn)
+            self.create_spatial_index(conn)
+
+    def create_spatial_index(self, conn):
+        """ R*Tree over customer coordinates, kept current by triggers. """
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'customers_rtree'").fetchone()
+        conn.execute('CREATE VIRTUAL TABLE IF NOT EXISTS customers_rtree '
+                     'USING rtree(id, min_lat, max_lat, min_lon, max_lon)')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS customers_rtree_insert AFTER INSERT ON customers
+            WHEN NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL
+            BEGIN
+                INSERT INTO customers_rtree VALUES (NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+            END
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS customers_rtree_update AFTER UPDATE OF latitude, longitude ON customers
+            BEGIN
+                DELETE FROM customers_rtree WHERE id = OLD.id;
+                INSERT INTO customers_rtree
+                SELECT NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude
+                WHERE NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL;
+            END
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS customers_rtree_delete AFTER DELETE ON customers
+            BEGIN
+                DELETE FROM customers_rtree WHERE id = OLD.id;
+            END
+        ''')
+        if not exists:
+            conn.execute('INSERT INTO customers_rtree SELECT id, latitude, latitude, longitude, longitude '
+                         'FROM customers WHERE latitude IS NOT NULL AND longitude IS NOT NULL')
+
+    def populate_customers(self, file_path, chunk_size=10000, workers=1, cache_dir=None):
+        return self.bulk_load(file_path, chunk_size, workers, cache_dir)
+
+    def display_customers(self):
+        for customer in self.iter_rows():
+            print(
+                f"ID: {customer.id}, Name: {customer.name}, Address: {customer.address}, "
+                f"Phone Number: {customer.phone_number}, Operating Hours: {customer.operating_hours}, "
+                f"Latitude: {customer.latitude}, Longitude: {customer.longitude}")
+
+    def get_coordinates_by_id(self, customer_id):
+        return self.db.cache('customer_coordinates').get_or_load(
+            customer_id,
+            lambda: self.query_one('SELECT latitude, longitude FROM customers WHERE id = ?', (customer_id,)))
+
+    def get_coordinates_by_ids(self, customer_ids):
+        """ Return {customer_id: (latitude, longitude)} in a single query. """
+        customer_ids = list(customer_ids)
+        placeholders = ', '.join('?' * len(customer_ids))
+        rows = self.query(f'SELECT id, latitude, longitude FROM customers WHERE id IN ({placeholders})',
+                          customer_ids)
+        return {row[0]: (row[1], row[2]) for row in rows}
+
+    def customers_within(self, point, radius, units="mi"):
+        """ Customers within radius of point (lat, lon), nearest first.
+
+        Returns:
+            list of (distance, customer row) tuples.
+        """
+        return self.query_within(f'''
+            SELECT customers.* FROM customers_rtree
+            INNER JOIN customers ON customers.id = customers_rtree.id
+            WHERE {RTREE_BOX}
+        ''', {}, point, radius, units)
+
+    def nearest_customers(self, point, k, units="mi"):
+        return self.query_nearest(f'''
+            SELECT customers.* FROM customers_rtree
+            INNER JOIN customers ON customers.id = customers_rtree.id
+            WHERE {RTREE_BOX}
+        ''', {}, point, k, units)
+
+    def distance_between(self, customer1_id, customer2_id, units="mi"):
+        coordinates = self.get_coordinates_by_ids([customer1_id, customer2_id])
+        for customer_id in (customer1_id, customer2_id):
+            if customer_id not in coordinates:
+                raise ValueError(f"No customer found with ID {customer_id}")
+        return haversine(coordinates[customer1_id], coordinates[customer2_id], units)
+
+    def all_coordinates(self):
+        rows = self.query('SELECT id, latitude, longitude FROM customers ORDER BY id')
+        return [row[0] for row in rows], [(row[1], row[2]) for row in rows]
+
+    def distances_from(self, customer_ids, units="mi"):
+        """ Partial distance matrix: one row per customer in customer_ids,
+        one column per customer in the table, ordered by ID.
+
+        Returns:
+            tuple: (column customer IDs, matrix)
+        """
+        ids, coordinates = self.all_coordinates()
+        origins = self.get_coordinates_by_ids(customer_ids)
+        return ids, haversine_matrix([origins[customer_id] for customer_id in customer_ids], coordinates, units)
+
+    def distance_matrix(self, cache_dir=None, units="mi", block_rows=1024):
+        """ Distances between every pair of customers, ordered by ID.
+
+        With cache_dir set (and NumPy installed) the matrix is written there
+        as a .npy file named after a hash of the customer IDs and
+        coordinates, and later calls memory-map it instead of recomputing.
+        A change to any customer's coordinates produces a new hash, so the
+        stale file is replaced on the next call.
+
+        Returns:
+            tuple: (customer IDs, matrix)
+        """
+        ids, coordinates = self.all_coordinates()
+        if cache_dir is None or np is None:
+            return ids, haversine_matrix(coordinates, units=units)
+
+        fingerprint = hashlib.sha256(repr((units, ids, coordinates)).encode()).hexdigest()[:16]
+        cache_path = os.path.join(cache_dir, f'distances-{fingerprint}.npy')
+        if os.path.exists(cache_path):
+            return ids, np.load(cache_path, mmap_mode='r')
+
+        os.makedirs(cache_dir, exist_ok=True)
+        for name in os.listdir(cache_dir):
+            if name.startswith('distances-') and name.endswith('.npy'):
+                os.remove(os.path.join(cache_dir, name))
+
+        partial_path = cache_path + '.partial'
+        matrix = np.lib.format.open_memmap(partial_path, mode='w+', dtype='float64',
+                                           shape=(len(ids), len(ids)))
+        for start in range(0, len(ids), block_rows):
+            matrix[start:start + block_rows] = haversine_matrix(coordinates[start:start + block_rows],
+                                                                coordinates, units)
+        matrix.flush()
+        del matrix
+        os.replace(partial_path, cache_path)
+        return ids, np.load(cache_path, mmap_mode='r')
+
+
+
+class Machines(BaseEntity):
+    table_name = 'machines'
+    natural_key = ('serial_number',)
+    columns = ('customer_id', 'manufacturer', 'name', 'machine_type', 'serial_number', 'status')
+    source_format = MACHINE_FORMAT
+    references = {'customer_id': 'customers'}
+    indexes = (
+        'CREATE INDEX IF NOT EXISTS idx_machines_status ON machines (status)',
+        'CREATE INDEX IF NOT EXISTS idx_machines_customer_id ON machines (customer_id)',
+        'CREATE INDEX IF NOT EXISTS idx_machines_type_status ON machines (machine_type, status)',
+    )
+    search_columns = {'manufacturer': 2.0, 'name': 2.0, 'serial_number': 4.0}
+    aggregates = {
+        'machine_catalog': (('manufacturer', 'name'), {'machines': '1'}),
+        'fleet_by_type': (('machine_type',), {'machines': '1', 'need_repair': "status = 'Need Repair'"}),
+        'fleet_by_customer': (('customer_id',), {'machines': '1', 'need_repair': "status = 'Need Repair'"}),
+    }
+    record = MachineRecord
+
+    NEARBY_MACHINES_SQL = f'''
+        SELECT machines.*, customers.latitude, customers.longitude FROM customers_rtree
+        INNER JOIN customers ON customers.id = customers_rtree.id
+        INNER JOIN machines ON machines.customer_id = customers.id
+        WHERE {RTREE_BOX}
+        AND (:status IS NULL OR machines.status = :status)
+        AND (:machine_type IS NULL OR machines.machine_type = :machine_type)
+    '''
+
+    def __init__(self, db_file='inventory.db', rebuild=True, clear_history=False, **options):
+        super().__init__(db_file, **options)
+        if rebuild:
+            self.drop_table('machines')
+        # Service history outlives rebuilds of the machines table; it records
+        # each repair's machine_type so its reports don't depend on it.
+        if clear_history:
+            self.drop_table('service_history')
+            self.drop_table('service_monthly_usage')
+        self.create_table()
+        self.create_service_history_table()
+
+    def create_table(self):
+        with self.transaction() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS machines (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    customer_id INTEGER NOT NULL,
+                    manufacturer TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    machine_type TEXT NOT NULL,
+                    serial_number TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    FOREIGN KEY (customer_id) REFERENCES customers(id)
+                )
+            ''')
+            self.create_indexes(conn)
+            self.create_search_index(conn)
+            self.create_aggregates(conn)
+
+    def create_service_history_table(self):
+        with self.transaction() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS service_history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    machine_id INTEGER NOT NULL,
+                    item_id INTEGER NOT NULL,
+                    quantity_used INTEGER NOT NULL,
+                    repair_date TEXT NOT NULL,
+                    machine_type TEXT NOT NULL,
+                    FOREIGN KEY (machine_id) REFERENCES machines(id),
+                    FOREIGN KEY (item_id) REFERENCES inventory(id)
+                )
+            ''')
+            # Each index implicitly ends with the row id, which keyset pages use
+            # as a tie-breaker.
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_service_history_machine ON service_history (machine_id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_service_history_item ON service_history (item_id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_service_history_date ON service_history (repair_date)')
+
+            # Monthly parts usage, kept current by triggers so reports never
+            # rescan the history.
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS service_monthly_usage (
+                    month TEXT NOT NULL,
+                    machine_type TEXT NOT NULL,
+                    item_id INTEGER NOT NULL,
+                    repairs INTEGER NOT NULL,
+                    quantity INTEGER NOT NULL,
+                    PRIMARY KEY (month, machine_type, item_id)
+                ) WITHOUT ROWID
+            ''')
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS service_history_usage_insert AFTER INSERT ON service_history
+                BEGIN
+                    INSERT INTO service_monthly_usage (month, machine_type, item_id, repairs, quantity)
+                    VALUES (substr(NEW.repair_date, 1, 7), NEW.machine_type, NEW.item_id, 1, NEW.quantity_used)
+                    ON CONFLICT (month, machine_type, item_id)
+                    DO UPDATE SET repairs = repairs + 1, quantity = quantity + excluded.quantity;
+                END
+            ''')
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS service_history_usage_delete AFTER DELETE ON service_history
+                BEGIN
+                    UPDATE service_monthly_usage SET repairs = repairs - 1, quantity = quantity - OLD.quantity_used
+                    WHERE month = substr(OLD.repair_date, 1, 7) AND machine_type = OLD.machine_type
+                    AND item_id = OLD.item_id;
+                END
+            ''')
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS service_history_usage_update
+                AFTER UPDATE OF item_id, quantity_used, repair_date, machine_type ON service_history
+                BEGIN
+                    UPDATE service_monthly_usage SET repairs = repairs - 1, quantity = quantity - OLD.quantity_used
+                    WHERE month = substr(OLD.repair_date, 1, 7) AND machine_type = OLD.machine_type
+                    AND item_id = OLD.item_id;
+                    INSERT INTO service_monthly_usage (month, machine_type, item_id, repairs, quantity)
+                    VALUES (substr(NEW.repair_date, 1, 7), NEW.machine_type, NEW.item_id, 1, NEW.quantity_used)
+                    ON CONFLICT (month, machine_type, item_id)
+                    DO UPDATE SET repairs = repairs + 1, quantity = quantity + excluded.quantity;
+                END
+            ''')
+
+    def populate_machines(self, file_path, chunk_size=10000, workers=1, cache_dir=None):
+        return self.bulk_load(file_path, chunk_size, workers, cache_dir)
+
+    def generate_machine_issues(self, count=None, rng=random):
+        """ Mark count (by default 1 to 8) random working machines as
+        needing repair.
+
+        Returns:
+            list of the IDs marked.
+        """
+        count = rng.randint(1, 8) if count is None else count
+        with self.transaction():
+            machine_ids = [machine.id for machine in self.sample_machines(count, rng)]
+            self.mark_need_repair(machine_ids)
+        return machine_ids
+
+    def sample_machines(self, count, rng=random, status='Good', machine_type=None):
+        """ Up to count distinct random machines with status, and of
+        machine_type if given.
+
+        Each draw probes the index from a random ID instead of loading the
+        table, so a draw costs the same at any table size. Machines just
+        after a gap in the IDs are slightly more likely to be drawn.
+
+        Returns:
+            list of MachineRecord.
+        """
+        # Separate subqueries, as SQLite only reads a lone MIN or MAX off the index.
+        low, high = self.query_one('SELECT (SELECT MIN(id) FROM machines), (SELECT MAX(id) FROM machines)')
+        if low is None or count < 1:
+            return []
+        where = 'status = ? AND machine_type = ?' if machine_type else 'status = ?'
+        params = (status, machine_type) if machine_type else (status,)
+        probe = f'SELECT * FROM machines WHERE {where} AND id >= ? ORDER BY id LIMIT 1'
+
+        sampled = {}
+        for _ in range(count * 4 + 10):  # bounded retries for repeat draws
+            rows = self.query_records(probe, params + (rng.randint(low, high),)) or \
+                self.query_records(probe, params + (low,))
+            if not rows:
+                break
+            sampled.setdefault(rows[0].id, rows[0])
+            if len(sampled) == count:
+                break
+        return list(sampled.values())
+
+    def mark_need_repair(self, machine_ids):
+        """ Mark the working machines among machine_ids "Need Repair" in one
+        batched statement.
 
-        cursor.execute('''
-            SELECT machines.id, customers.name, machines.manufacturer, machines.name, machines.machine_type, 
+        Returns:
+            int: the number of machines marked.
+        """
+        with self.transaction() as conn:
+            return conn.executemany('UPDATE machines SET status = "Need Repair" WHERE id = ? AND status = "Good"',
+                                    [(machine_id,) for machine_id in machine_ids]).rowcount
+
+    def display_machines(self):
+        machines = self.iter_rows(select='''
+            SELECT machines.id, customers.name, machines.manufacturer, machines.name, machines.machine_type,
             machines.serial_number, machines.status
             FROM machines
             INNER JOIN customers ON machines.customer_id = customers.id
         ''')
 
-        machines = cursor.fetchall()
+        for _, customer_name, manufacturer, name, _, serial_number, status in machines:
+            print(f"{manufacturer} {name}, Serial Number: {serial_number},Customer: {customer_name}, Status: {status}")
 
-        for machine in machines:
-            print(
-                f"{machine[2]} {machine[3]}, Serial Number: {machine[5]},Customer: {machine[1]}, Status: {machine[6]}")
-
-        conn.close()
+    def catalog(self):
+        """ Every (manufacturer, name, machines installed) in the fleet,
+        sorted, from the machine_catalog summary. """
+        return self.query('SELECT manufacturer, name, machines FROM machine_catalog ORDER BY manufacturer, name')
 
     def display_distinct_machines(self):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
+        for manufacturer, name, _ in self.catalog():
+            print(f"{manufacturer} {name}")
+
+    def fleet_by_type(self):
+        """ Installed and broken machines per machine type.
+
+        Returns:
+            dict: machine type to {'machines', 'need_repair',
+            'broken_ratio'}.
+        """
+        return {machine_type: {'machines': machines, 'need_repair': need_repair,
+                               'broken_ratio': need_repair / machines}
+                for machine_type, machines, need_repair in self.query(
+                    'SELECT machine_type, machines, need_repair FROM fleet_by_type ORDER BY machine_type')}
+
+    def customer_fleet(self, customer_id):
+        """ Machines installed at a customer and how many need repair.
+
+        Returns:
+            dict: {'machines', 'need_repair'}, both 0 for a customer with
+            no machines.
+        """
+        row = self.query_one('SELECT machines, need_repair FROM fleet_by_customer WHERE customer_id = ?',
+                             (customer_id,))
+        machines, need_repair = row or (0, 0)
+        return {'machines': machines, 'need_repair': need_repair}
+
+    def display_fleet_summary(self):
+        fleet = self.fleet_by_type()
+        if not fleet:
+            print("There are no machines.")
+        for machine_type, counts in fleet.items():
+            print(f"{machine_type}: {counts['machines']} machines, {counts['need_repair']} in need of repair "
+                  f"({counts['broken_ratio']:.1%})")
+
+    def get_machines_by_status(self, status):
+        return self.query_records('SELECT * FROM machines WHERE status = ?', (status,))
+
+    def repair_stops(self):
+        """ Machines needing repair grouped into one stop per customer. """
+        rows = self.query('''
+            SELECT machines.customer_id, customers.name, customers.latitude, customers.longitude, machines.id
+            FROM machines
+            INNER JOIN customers ON machines.customer_id = customers.id
+            WHERE machines.status = "Need Repair"
+            ORDER BY machines.customer_id, machines.id
+        ''')
 
-        cursor.execute('''
-            SELECT DISTINCT manufacturer, name
+        stops = {}
+        for customer_id, name, latitude, longitude, machine_id in rows:
+            stop = stops.setdefault(customer_id, {
+                'customer_id': customer_id,
+                'name': name,
+                'coordinates': (latitude, longitude),
+                'machine_ids': []
+            })
+            stop['machine_ids'].append(machine_id)
+        return list(stops.values())
+
+    def plan_repair_route(self, start, time_limit=0.5):
+        """ Order the customers with machines needing repair into a short
+        route from start, a (lat, lon) tuple.
+
+        Returns:
+            tuple: (stops in visiting order, route length in miles)
+        """
+        if start is None:
+            raise ValueError("start should be a (lat, lon) tuple")
+        stops = self.repair_stops()
+        if not stops:
+            return [], 0.0
+        order, distance = plan_route([stop['coordinates'] for stop in stops], start, time_limit=time_limit)
+        return [stops[index] for index in order], distance
+
+    def dispatch(self, technicians, shift='8AM-5PM', service_minutes=30, speed=30.0, quantity=1, candidates=3,
+                 workers=1):
+        """ Share the machines needing repair among technicians and plan
+        each technician's day.
+
+        Machines are grouped into one stop per customer, and each is
+        reserved a part of its type from the inventory, oldest machine
+        first; machines left without a part stay unassigned. Every stop is
+        offered to the technician starting nearest to it, whose route is
+        built by cheapest feasible insertion so each visit falls within the
+        customer's operating hours and the shift. Stops that don't fit are
+        offered to the next nearest technicians, up to candidates in all.
+        When no technician can fit a stop in while other machines went
+        without parts, the day is planned again without that stop so its
+        parts go to them. With workers > 1, routes are built in a pool of
+        processes.
+
+        Args:
+            technicians (sequence of (float, float)): start locations
+                (lat, lon), one per technician.
+            shift (str): working hours, like "8AM-5PM". (Default: "8AM-5PM")
+            service_minutes (float): time on site per machine. (Default: 30)
+            speed (float): travel speed in miles per hour. (Default: 30.0)
+            quantity (int): parts used per repair. (Default: 1)
+            candidates (int): technicians each stop is offered to.
+                (Default: 3)
+            workers (int): processes building routes. (Default: 1)
+
+        Returns:
+            tuple: (routes, unassigned). routes holds one dict per
+            technician with its "start", "stops" in visiting order and
+            "distance" in miles. Each stop has the customer_id, name,
+            coordinates, arrival and finish in minutes after midnight, and
+            the "jobs" to pass to apply_repairs. unassigned lists a
+            {"machine_id", "reason"} dict per machine left out.
+        """
+        if not technicians:
+            raise ValueError("At least one technician is needed.")
+        shift_start, shift_end = parse_operating_hours(shift)
+        rows = self.query('''
+            SELECT machines.customer_id, customers.name, customers.latitude, customers.longitude,
+                   customers.operating_hours, machines.id, machines.machine_type
             FROM machines
+            INNER JOIN customers ON machines.customer_id = customers.id
+            WHERE machines.status = "Need Repair"
+            ORDER BY machines.customer_id, machines.id
         ''')
 
-        machines_set = set(cursor.fetchall())
+        windows = {}
+        for customer_id, _, _, _, hours, machine_id, _ in rows:
+            if customer_id not in windows:
+                try:
+                    open_at, close_at = parse_operating_hours(hours)
+                    windows[customer_id] = (max(open_at, shift_start), min(close_at, shift_end))
+                except ValueError as e:
+                    windows[customer_id] = str(e)
+        rows.sort(key=lambda row: row[5])
+
+        executor = None
+        if workers > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            executor = ProcessPoolExecutor(max_workers=workers)
+        # Machines no technician could fit in; they give up their parts.
+        unfit = set()
+        with executor or nullcontext():
+            while True:
+                stops, unassigned, short = self.reserve_parts(rows, windows, unfit, service_minutes, quantity)
+                assigned, schedules, distances, pending = self.assign_stops(
+                    stops, technicians, (shift_start, shift_end), service_minutes, speed, candidates, executor,
+                    workers)
+                if not (pending and short):
+                    break
+                unfit.update(job['machine_id'] for index in pending for job in stops[index]['jobs'])
+
+        unassigned.extend({'machine_id': machine_id, 'reason': "no technician can fit it in"} for machine_id in unfit)
+        for index in pending:
+            unassigned.extend({'machine_id': job['machine_id'], 'reason': "no technician can fit it in"}
+                              for job in stops[index]['jobs'])
+        routes = []
+        for technician, start in enumerate(technicians):
+            visits = [{'customer_id': stops[index]['customer_id'], 'name': stops[index]['name'],
+                       'coordinates': stops[index]['coordinates'], 'arrival': arrival, 'finish': finish,
+                       'jobs': stops[index]['jobs']}
+                      for index, (arrival, finish) in zip(assigned[technician], schedules[technician])]
+            routes.append({'start': tuple(start), 'stops': visits, 'distance': distances[technician]})
+        return routes, sorted(unassigned, key=lambda machine: machine['machine_id'])
+
+    def reserve_parts(self, rows, windows, unfit, service_minutes, quantity):
+        """ Group dispatch's machines, oldest first, into one stop per
+        customer, reserving each a part of its type from the most plentiful
+        in stock. Machines in unfit are left out.
+
+        Returns:
+            tuple: (stops, unassigned machines with the reason, whether
+            any machine went without a part)
+        """
+        parts = {}
+        for machine_type in {row[6] for row in rows}:
+            in_stock = self.query('SELECT id, quantity FROM inventory WHERE machine_type = ? AND quantity >= ?',
+                                  (machine_type, quantity))
+            parts[machine_type] = [(-stock, item_id) for item_id, stock in in_stock]
+            heapq.heapify(parts[machine_type])
+
+        stops, unassigned, short = {}, [], False
+        for customer_id, name, latitude, longitude, _, machine_id, machine_type in rows:
+            window = windows[customer_id]
+            if machine_id in unfit:
+                continue
+            if isinstance(window, str):
+                unassigned.append({'machine_id': machine_id, 'reason': window})
+                continue
+            if window[0] + service_minutes > window[1]:
+                unassigned.append({'machine_id': machine_id, 'reason': "closed during the shift"})
+                continue
+            stock = parts[machine_type]
+            if not stock:
+                unassigned.append({'machine_id': machine_id, 'reason': f"no {machine_type} parts in stock"})
+                short = True
+                continue
+            remaining, item_id = stock[0]
+            if -remaining - quantity >= quantity:
+                heapq.heapreplace(stock, (remaining + quantity, item_id))
+            else:
+                heapq.heappop(stock)
+            stop = stops.setdefault(customer_id, {'customer_id': customer_id, 'name': name,
+                                                  'coordinates': (latitude, longitude), 'window': window, 'jobs': []})
+            stop['jobs'].append({'machine_id': machine_id, 'item_id': item_id, 'quantity': quantity})
+        return list(stops.values()), unassigned, short
+
+    def assign_stops(self, stops, technicians, shift, service_minutes, speed, candidates, executor=None, workers=1):
+        """ Offer each of dispatch's stops to the nearest technicians in
+        turn and build their routes, in executor's processes if given.
+
+        Returns:
+            tuple: (stop indexes per technician in visiting order, their
+            (arrival, finish) times, route lengths, indexes of the stops no
+            technician could fit in)
+        """
+        plans = [(stop['coordinates'], *stop['window'], service_minutes * len(stop['jobs'])) for stop in stops]
+        candidates = min(candidates, len(technicians))
+        nearest = haversine_matrix([stop['coordinates'] for stop in stops], technicians) if stops else []
+        if np is not None and isinstance(nearest, np.ndarray):
+            nearest = np.argsort(nearest, axis=1, kind='stable')[:, :candidates].tolist()
+        else:
+            nearest = [heapq.nsmallest(candidates, range(len(technicians)), key=row.__getitem__) for row in nearest]
+
+        assigned = [[] for _ in technicians]
+        schedules = [[] for _ in technicians]
+        distances = [0.0] * len(technicians)
+        pending = list(range(len(stops)))
+        for rank in range(candidates):
+            offers = defaultdict(list)
+            for index in pending:
+                offers[nearest[index][rank]].append(index)
+            pending = []
+            chosen = sorted(offers)
+            offered = [assigned[technician] + offers[technician] for technician in chosen]
+            args = ([technicians[technician] for technician in chosen], [shift] * len(chosen),
+                    [[plans[index] for index in indexes] for indexes in offered],
+                    [len(assigned[technician]) for technician in chosen], [speed] * len(chosen))
+            if executor:
+                results = executor.map(schedule_route, *args, chunksize=max(1, len(chosen) // (workers * 4)))
+            else:
+                results = map(schedule_route, *args)
+            for technician, indexes, (order, times, skipped, distance) in zip(chosen, offered, results):
+                assigned[technician] = [indexes[i] for i in order]
+                schedules[technician] = times
+                distances[technician] = distance
+                pending.extend(indexes[i] for i in skipped)
+            if not pending:
+                break
+        return assigned, schedules, distances, pending
 
-        sorted_machines = sorted(machines_set, key=lambda machine: (machine[0], machine[1]))
+    def machines_within(self, point, radius, status=None, machine_type=None, units="mi"):
+        """ Machines at customers within radius of point (lat, lon), nearest
+        first, optionally limited to one status and/or machine type.
 
-        for machine in sorted_machines:
-            print(f"{machine[0]} {machine[1]}")
+        Returns:
+            list of (distance, machine row + (latitude, longitude)) tuples.
+        """
+        return self.query_within(self.NEARBY_MACHINES_SQL, {'status': status, 'machine_type': machine_type},
+                                 point, radius, units)
 
-        conn.close()
+    def nearest_machines(self, point, k, status=None, machine_type=None, units="mi"):
+        return self.query_nearest(self.NEARBY_MACHINES_SQL, {'status': status, 'machine_type': machine_type},
+                                  point, k, units)
 
     def display_machines_repair(self):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-
-        cursor.execute('SELECT * FROM machines WHERE status = "Need Repair"')
-        machines = cursor.fetchall()
-
-        for machine in machines:
+        for machine in self.iter_rows(where='status = ?', params=('Need Repair',)):
             print(
-                f"ID: {machine[0]}, Customer ID: {machine[1]}, Machine Name: {machine[2]}, Type: {machine[4]}, "
-                f"Serial Number: {machine[5]}, Status: {machine[6]}")
-
-        conn.close()
+                f"ID: {machine.id}, Customer ID: {machine.customer_id}, Manufacturer: {machine.manufacturer}, "
+                f"Machine Name: {machine.name}, Type: {machine.machine_type}, "
+                f"Serial Number: {machine.serial_number}, Status: {machine.status}")
 
     def repair_machine(self, machine_id, inventory):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-
         try:
-            cursor.execute('SELECT * FROM machines WHERE id = ?', (machine_id,))
-            machine = cursor.fetchone()
+            machines = self.query_records('SELECT * FROM machines WHERE id = ?', (machine_id,))
 
-            if machine:
-                inventory_type = machine[4]
+            if not machines:
+                print(f"No machine found with ID {machine_id}.")
+            elif machines[0].status != "Need Repair":
+                print(f"Machine with ID {machine_id} does not need repair.")
+            else:
+                inventory_type = machines[0].machine_type
                 items_for_repair = inventory.get_items_by_type(inventory_type)
 
                 print(f"Choose items from the inventory for the repair ({inventory_type}):")
@@ -381,62 +3089,596 @@ class Machines(BaseEntity):
                 item_id = int(input("Enter the ID of the item you need for the repair: "))
                 quantity_needed = int(input("Enter the quantity needed: "))
 
-                if inventory.check_quantity_available(item_id, quantity_needed):
-                    inventory.deduct_inventory_quantity(item_id, quantity_needed)
-
-                    cursor.execute('UPDATE machines SET status = "Good" WHERE id = ?', (machine_id,))
-                    conn.commit()
-
-                    service_info = {
-                        'machine_id': machine_id,
-                        'item_id': item_id,
-                        'quantity_used': quantity_needed,
-                        'repair_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    }
-                    self.service_history.append(service_info)
-
+                try:
+                    self.apply_repair(machine_id, item_id, quantity_needed)
+                except ValueError as e:
+                    print(f"{e} Repair cannot be completed.")
+                else:
                     print(f"Machine with ID {machine_id} has been repaired and set to 'Good' status.")
                     print(f"Inventory updated. {quantity_needed} units of item ID {item_id} deducted.")
-                else:
-                    print("Insufficient quantity in the inventory. Repair cannot be completed.")
-
-            else:
-                print(f"No machine found with ID {machine_id}.")
+                    low_stock = inventory.low_stock_item(item_id)
+                    if low_stock:
+                        print(f"Item ID {item_id} is low on stock: {low_stock[0]} left, "
+                              f"reorder point {low_stock[1]}.")
 
         except sqlite3.Error as e:
             print(f"Error repairing machine: {e}")
 
-        finally:
-            conn.close()
+    def apply_repair(self, machine_id, item_id, quantity_needed):
+        """ Repair a machine as one transaction: deduct the part, mark the
+        machine "Good" and record the service.
+
+        The write lock is taken up front and the stock deduction only
+        applies while enough stock remains, so concurrent repairers in
+        other threads or processes can neither oversell a part nor repair
+        the same machine twice.
+
+        Raises:
+            ValueError: the machine or item doesn't exist, the machine
+                doesn't need repair, or there isn't enough stock. Nothing
+                is changed in that case.
+        """
+        with self.transaction(immediate=True) as conn:
+            return self.repair_in_transaction(conn, machine_id, item_id, quantity_needed)
+
+    def apply_repairs(self, jobs, batch_size=1000):
+        """ Apply many repairs without prompting.
+
+        Jobs are applied in transactions of batch_size, each job inside its
+        own savepoint so a rejected job leaves the rest of its batch alone,
+        whether it was refused or failed in SQLite. Results for a batch are
+        yielded after the batch commits.
+
+        Args:
+            jobs (iterable of dict): jobs from read_repair_jobs, optionally with a
+                "repair_date" to record instead of the current time.
+            batch_size (int): jobs per transaction. (Default: 1000)
+
+        Yields:
+            dict: the job with a "status" of "repaired" or "rejected", and
+            an "error" message for rejected jobs.
+        """
+        jobs = iter(jobs)
+        while True:
+            batch = list(islice(jobs, batch_size))
+            if not batch:
+                return
+            with self.transaction(immediate=True) as conn:
+                for job in batch:
+                    if 'error' in job:
+                        job['status'] = 'rejected'
+                        continue
+                    conn.execute('SAVEPOINT repair_job')
+                    try:
+                        self.repair_in_transaction(conn, job['machine_id'], job['item_id'], job['quantity'],
+                                                   job.get('repair_date'))
+                    except (ValueError, OverflowError, sqlite3.Error) as e:
+                        # Errors such as a full disk roll back the whole transaction.
+                        if not conn.in_transaction:
+                            raise
+                        conn.execute('ROLLBACK TO repair_job')
+                        job['status'] = 'rejected'
+                        job['error'] = str(e)
+                    else:
+                        job['status'] = 'repaired'
+                    conn.execute('RELEASE repair_job')
+            yield from batch
+
+    def repair_in_transaction(self, conn, machine_id, item_id, quantity_needed, repair_date=None):
+        if quantity_needed < 1:
+            raise ValueError("Quantity needed must be at least 1.")
+
+        repaired = conn.execute('UPDATE machines SET status = "Good" WHERE id = ? AND status = "Need Repair"',
+                                (machine_id,)).rowcount
+        if not repaired:
+            if conn.execute('SELECT 1 FROM machines WHERE id = ?', (machine_id,)).fetchone() is None:
+                raise ValueError(f"No machine found with ID {machine_id}.")
+            raise ValueError(f"Machine with ID {machine_id} does not need repair.")
+
+        deducted = conn.execute('UPDATE inventory SET quantity = quantity - ? WHERE id = ? AND quantity >= ? '
+                                'RETURNING machine_type', (quantity_needed, item_id, quantity_needed)).fetchone()
+        if not deducted:
+            if conn.execute('SELECT 1 FROM inventory WHERE id = ?', (item_id,)).fetchone() is None:
+                raise ValueError(f"No inventory item found with ID {item_id}.")
+            raise ValueError("Insufficient quantity in the inventory.")
+        self.db.invalidate('inventory_by_type', deducted[0])
+
+        service_info = {
+            'machine_id': machine_id,
+            'item_id': item_id,
+            'quantity_used': quantity_needed,
+            'repair_date': repair_date or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+        conn.execute('INSERT INTO service_history (machine_id, item_id, quantity_used, repair_date, machine_type) '
+                     'SELECT ?, ?, ?, ?, machine_type FROM machines WHERE id = ?',
+                     (machine_id, item_id, quantity_needed, service_info['repair_date'], machine_id))
+        return service_info
 
     def display_service_history(self):
-        if len(self.service_history) == 0:
+        cursor = self.connection().execute(
+            'SELECT machine_id, item_id, quantity_used, repair_date FROM service_history ORDER BY id')
+        entry = cursor.fetchone()
+        if entry is None:
             print("There hasn't been any service repairs")
             time.sleep(2)
         else:
             print("Service History:")
-        for entry in self.service_history:
-            print(f"Machine ID: {entry['machine_id']}, Item ID: {entry['item_id']}, "
-                  f"Quantity Used: {entry['quantity_used']}, Repair Date: {entry['repair_date']}")
+        while entry is not None:
+            print(f"Machine ID: {entry[0]}, Item ID: {entry[1]}, "
+                  f"Quantity Used: {entry[2]}, Repair Date: {entry[3]}")
+            entry = cursor.fetchone()
+
+    def service_history_page(self, where, params, order, after, limit):
+        """ One keyset page of service history, newest first.
+
+        Returns:
+            tuple: (list of ServiceRecord, token for the next page or None)
+        """
+        if after is not None:
+            key = json.loads(after)
+            where += f' AND ({", ".join(order)}) < ({", ".join("?" * len(key))})'
+            params = tuple(params) + tuple(key)
+        rows = self.query_records(f'SELECT * FROM service_history WHERE {where} '
+                                  f'ORDER BY {", ".join(column + " DESC" for column in order)} LIMIT ?',
+                                  tuple(params) + (limit,), ServiceRecord)
+        if len(rows) < limit:
+            return rows, None
+        return rows, json.dumps([getattr(rows[-1], column) for column in order])
+
+    def service_history_by_machine(self, machine_id, after=None, limit=50):
+        return self.service_history_page('machine_id = ?', (machine_id,), ('id',), after, limit)
+
+    def service_history_by_item(self, item_id, after=None, limit=50):
+        return self.service_history_page('item_id = ?', (item_id,), ('id',), after, limit)
+
+    def service_history_between(self, start_date, end_date, after=None, limit=50):
+        """ Repairs dated start_date <= repair_date < end_date, where dates
+        are "YYYY-MM-DD[ HH:MM:SS]" strings. """
+        return self.service_history_page('repair_date >= ? AND repair_date < ?', (start_date, end_date),
+                                         ('repair_date', 'id'), after, limit)
+
+    def parts_consumed_per_month(self, start_month=None, end_month=None):
+        """ Parts used per machine type per month ("YYYY-MM"), optionally
+        limited to start_month <= month <= end_month.
+
+        Returns:
+            list of (month, machine_type, repairs, quantity) rows.
+        """
+        return self.query('''
+            SELECT month, machine_type, SUM(repairs), SUM(quantity)
+            FROM service_monthly_usage
+            WHERE month >= ? AND month <= ?
+            GROUP BY month, machine_type
+            HAVING SUM(repairs) > 0
+            ORDER BY month, machine_type
+        ''', (start_month or '', end_month or '9999-99'))
+
+
+# Chance per day that a working machine of each type breaks down.
+FAILURE_RATES = {'Coffee Machine': 0.004, 'Cooler': 0.001, 'Ice Maker': 0.003, 'Kiosk': 0.002,
+                 'Water Dispenser': 0.0015}
+
+
+class SimulationStep:
+    def __init__(self, step, clock, seconds, failed=0, repaired=0, rejected=0, restocked=0, waiting=0):
+        self.step = step
+        self.clock = clock
+        self.seconds = seconds
+        self.failed = failed
+        self.repaired = repaired
+        self.rejected = rejected
+        self.restocked = restocked
+        self.waiting = waiting
+
+    def __str__(self):
+        return (f"Step {self.step} ({self.clock:%Y-%m-%d %H:%M}): {self.failed} failed, {self.repaired} repaired, "
+                f"{self.rejected} rejected, {self.restocked} restocked, {self.waiting} waiting "
+                f"({self.seconds * 1000:.1f} ms)")
+
+
+class FailureSimulator:
+    """ Seeded, time-stepped machine failures and repairs for load testing.
+
+    Each step advances a simulated clock by step_days. Every working
+    machine of a type fails with that type's daily rate (FAILURE_RATES,
+    overridden by rates), and the failed machines are marked in one batched
+    update. Then up to repairs_per_step machines in need of repair are fixed
+    through Machines.apply_repairs with a random part for their type, dated
+    by the simulated clock, so the service history, rollups and stock
+    triggers grow as they would in use. With restock_to, the parts used in a
+    step are topped back up to that many units so repairs can go on
+    indefinitely.
+
+    Working machines are counted once per type up front and then tracked
+    from the simulator's own changes, and failures are drawn with
+    Machines.sample_machines, so no step reads the whole table. The same
+    seed over the same database gives the same run.
+    """
+
+    def __init__(self, machines, inventory=None, rates=None, default_rate=0.002, seed=0, step_days=1.0,
+                 repairs_per_step=0, quantity=1, restock_to=None, batch_size=1000, start=None):
+        self.machines = machines
+        self.inventory = inventory
+        self.rates = dict(FAILURE_RATES, **(rates or {}))
+        self.default_rate = default_rate
+        self.rng = random.Random(seed)
+        self.step_days = step_days
+        self.repairs_per_step = repairs_per_step
+        self.quantity = quantity
+        self.restock_to = restock_to
+        self.batch_size = batch_size
+        self.clock = start or datetime.now().replace(microsecond=0)
+        self.steps = 0
+        self.working = dict(machines.query('SELECT machine_type, COUNT(*) FROM machines WHERE status = ? '
+                                           'GROUP BY machine_type', ('Good',)))
+        self.total = machines.query_one('SELECT COUNT(*) FROM machines')[0]
+        if repairs_per_step and inventory is None:
+            self.inventory = Inventory(machines.db_file, rebuild=False)
+
+    def failure_count(self, working, probability):
+        """ How many of working machines fail, each with probability: a
+        binomial draw made by skipping geometric gaps between failures, so it
+        costs time in proportion to the failures rather than the fleet. """
+        if working <= 0 or probability <= 0:
+            return 0
+        if probability >= 1:
+            return working
+        failed, position, log_survive = 0, -1, log(1 - probability)
+        while True:
+            position += int(log(1 - self.rng.random()) / log_survive) + 1
+            if position >= working:
+                return failed
+            failed += 1
+
+    def step(self):
+        start = time.perf_counter()
+        self.steps += 1
+        self.clock += timedelta(days=self.step_days)
+        report = SimulationStep(self.steps, self.clock, 0)
+
+        with self.machines.transaction():
+            for machine_type in sorted(self.working):
+                rate = self.rates.get(machine_type, self.default_rate)
+                count = self.failure_count(self.working[machine_type], 1 - exp(-rate * self.step_days))
+                sampled = self.machines.sample_machines(count, self.rng, machine_type=machine_type)
+                failed = self.machines.mark_need_repair([machine.id for machine in sampled])
+                self.working[machine_type] -= failed
+                report.failed += failed
+
+        if self.repairs_per_step:
+            jobs = []
+            repair_date = self.clock.strftime("%Y-%m-%d %H:%M:%S")
+            for machine in self.machines.sample_machines(self.repairs_per_step, self.rng, status='Need Repair'):
+                parts = self.inventory.get_items_by_type(machine.machine_type)
+                if parts:
+                    jobs.append({'machine_id': machine.id, 'item_id': self.rng.choice(parts).id,
+                                 'quantity': self.quantity, 'repair_date': repair_date,
+                                 'machine_type': machine.machine_type})
+            for job in self.machines.apply_repairs(jobs, self.batch_size):
+                if job['status'] == 'repaired':
+                    report.repaired += 1
+                    self.working[job['machine_type']] = self.working.get(job['machine_type'], 0) + 1
+                else:
+                    report.rejected += 1
+            if self.restock_to is not None:
+                report.restocked = self.inventory.restock(sorted({job['item_id'] for job in jobs}), self.restock_to)
 
+        report.waiting = self.total - sum(self.working.values())
+        report.seconds = time.perf_counter() - start
+        return report
 
-if __name__ == "__main__":
+    def run(self, steps=None):
+        """ Yield a SimulationStep for each of the next steps steps, or
+        forever when steps is None. """
+        yield from islice(iter(self.step, None), steps)
 
-    inventory = Inventory()
-    customer = Customer()
-    machines = Machines()
 
-    inventory_path = 'inventoryList.txt'
-    inventory.populate_inventory(inventory_path)
+SOURCE_FILES = {'inventory': 'inventoryList.txt', 'customers': 'customerList.txt', 'machines': 'machinesList.txt'}
 
-    customer_path = 'customerList.txt'
-    customer.populate_customers(customer_path)
 
-    machines_path = 'machinesList.txt'
-    machines.populate_machines(machines_path)
-    machines.generate_machine_issues()
+def save_snapshot(conn, snapshot_path):
+    """ Copy the database behind conn to snapshot_path with the sqlite3
+    backup API, atomically replacing any older snapshot. """
+    partial_path = f'{snapshot_path}.partial'
+    target = sqlite3.connect(partial_path)
+    try:
+        conn.backup(target)
+        # A single self-contained file, so it can be copied and opened read-only.
+        target.execute('PRAGMA journal_mode = DELETE')
+    finally:
+        target.close()
+    os.replace(partial_path, snapshot_path)
 
-    printf("Welcome To the Service Technician Management System!")
+
+def snapshot_problems(snapshot_path, sources=SOURCE_FILES):
+    """ Reasons the snapshot at snapshot_path can't stand in for loading the
+    text files in sources ({table_name: path}); empty when it can.
+
+    A usable snapshot passes SQLite's quick_check, has every entity table
+    and was synced from text files with the same size and SHA-256 as the
+    current ones (compared by mtime first, as sync() does).
+    """
+    if not os.path.exists(snapshot_path):
+        return [f"{snapshot_path} does not exist"]
+    problems = []
+    conn = sqlite3.connect(f'file:{snapshot_path}?mode=ro', uri=True)
+    try:
+        if conn.execute('PRAGMA quick_check').fetchone()[0] != 'ok':
+            return [f"{snapshot_path} failed its integrity check"]
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        recorded = {}
+        if 'source_files' in tables:
+            recorded = {row[0]: row[1:] for row in conn.execute(
+                'SELECT table_name, mtime, size, sha256 FROM source_files')}
+    except sqlite3.DatabaseError as e:
+        return [f"{snapshot_path} is not a usable database: {e}"]
+    finally:
+        conn.close()
+
+    for table_name in ('inventory', 'customers', 'machines', 'service_history'):
+        if table_name not in tables:
+            problems.append(f"{snapshot_path} has no {table_name} table")
+    for table_name, file_path in sources.items():
+        stat = os.stat(file_path)
+        mtime, size, digest = recorded.get(table_name, (None, None, None))
+        if size != stat.st_size or (mtime != stat.st_mtime and digest != file_digest(file_path)):
+            problems.append(f"{file_path} has changed since {snapshot_path} was saved")
+    return problems
+
+
+def restore_snapshot(snapshot_path, db_file):
+    """ Copy the snapshot into db_file with the sqlite3 backup API. """
+    source = sqlite3.connect(f'file:{snapshot_path}?mode=ro', uri=True)
+    target = sqlite3.connect(db_file)
+    try:
+        source.backup(target)
+    finally:
+        source.close()
+        target.close()
+
+
+class Session:
+    """ The entities for one run of the program, each opened and synced
+    from its text file the first time an action uses it, so actions that
+    only need one table don't pay for loading the others.
+
+    Args:
+        db_file (str): database file. (Default: "inventory.db")
+        rebuild (bool): drop and reload each table instead of syncing it.
+        simulate_issues (bool): mark a few random machines as needing
+            repair the next time the machines table is used. (Default: False)
+        cache_dir (str): directory caching the parsed text files.
+            (Default: None)
+        **options: ConnectionManager options.
+    """
+
+    def __init__(self, db_file='inventory.db', rebuild=False, simulate_issues=False, cache_dir=None, **options):
+        self.db_file = db_file
+        self.rebuild = rebuild
+        self.simulate_issues = simulate_issues
+        self.cache_dir = cache_dir
+        self.options = options
+        self.entities = {}
+
+    def entity(self, cls):
+        entity = self.entities.get(cls.table_name)
+        if entity is None:
+            entity = cls(self.db_file, rebuild=self.rebuild, **self.options)
+            file_path = SOURCE_FILES[cls.table_name]
+            report = entity.sync(file_path, cache_dir=self.cache_dir)
+            if report.rejected:
+                print(f"Skipped {report.rejected} invalid lines of {file_path}; "
+                      f"see {entity.quarantine_path(file_path)}", file=sys.stderr)
+            self.entities[cls.table_name] = entity
+        return entity
+
+    @property
+    def inventory(self):
+        return self.entity(Inventory)
+
+    @property
+    def customer(self):
+        return self.entity(Customer)
+
+    @property
+    def machines(self):
+        # Machine listings join customers, so load those first.
+        self.entity(Customer)
+        machines = self.entity(Machines)
+        if self.simulate_issues:
+            self.simulate_issues = False
+            machines.generate_machine_issues()
+        return machines
+
+    @property
+    def db(self):
+        return ConnectionManager.for_database(self.db_file, **self.options)
+
+
+def run_batch_repairs(machines, lines, batch_size=1000, output=sys.stdout, report=sys.stderr):
+    """ Apply the repair jobs in lines, writing one JSON result per job to
+    output and a throughput summary to report. """
+    start = time.perf_counter()
+    counts = {'repaired': 0, 'rejected': 0}
+    for result in machines.apply_repairs(read_repair_jobs(lines), batch_size):
+        counts[result['status']] += 1
+        output.write(json.dumps(result) + '\n')
+    seconds = time.perf_counter() - start
+    total = counts['repaired'] + counts['rejected']
+    print(f"Processed {total} jobs ({counts['repaired']} repaired, {counts['rejected']} rejected) in {seconds:.2f}s "
+          f"({total / seconds if seconds else 0:,.0f} jobs/sec)", file=report)
+    return counts
+
+
+def run_menu_action(choice, session):
+    if choice == 1:
+        print("Here is a list of all machines in need of repair: ")
+        session.machines.display_machines_repair()
+        # Ask the user for the machine ID to repair
+        machine_id = int(input("Enter the ID of the machine to repair: "))
+        session.machines.repair_machine(machine_id, session.inventory)
+    elif choice == 2:
+        print("Here is a list of all machines at all locations: ")
+        session.customer.display_customers()
+        customer1_id = int(input("Choose the first customer ID you'd like to start from: "))
+        customer2_id = int(input("Choose the second customer ID you'd like to stop at: "))
+        distance = session.customer.distance_between(customer1_id, customer2_id)
+
+        print(f"The distance between the two customers is {distance:.2f} miles.")
+    elif choice == 3:
+        session.inventory.display_inventory()
+    elif choice == 4:
+        session.customer.display_customers()
+    elif choice == 5:
+        session.machines.display_machines()
+    elif choice == 6:
+        session.machines.display_service_history()
+    elif choice == 7:
+        session.machines.display_distinct_machines()
+    elif choice == 8:
+        session.customer.display_customers()
+        start_id = int(input("Choose the customer ID you'd like to start from: "))
+        route, distance = session.machines.plan_repair_route(session.customer.get_coordinates_by_id(start_id))
+
+        if not route:
+            print("There are no machines in need of repair.")
+        else:
+            for number, stop in enumerate(route, 1):
+                print(f"{number}. {stop['name']} (Customer ID: {stop['customer_id']}), "
+                      f"Machine IDs: {', '.join(map(str, stop['machine_ids']))}")
+            print(f"The total route distance is {distance:.2f} miles.")
+    elif choice == 9:
+        session.inventory.display_low_stock()
+    elif choice == 10:
+        session.customer.display_customers()
+        start_ids = input("Enter the customer IDs the technicians start from, separated by commas: ")
+        starts = [session.customer.get_coordinates_by_id(int(start_id)) for start_id in start_ids.split(',')]
+        if None in starts:
+            print("No customer found for one of those IDs.")
+            return
+        routes, unassigned = session.machines.dispatch(starts)
+
+        for number, route in enumerate(routes, 1):
+            print(f"Technician {number} ({route['distance']:.2f} miles):")
+            for stop in route['stops']:
+                print(f"  {format_clock_time(stop['arrival'])}-{format_clock_time(stop['finish'])} {stop['name']} "
+                      f"(Customer ID: {stop['customer_id']}), "
+                      f"Machine IDs: {', '.join(str(job['machine_id']) for job in stop['jobs'])}")
+        for machine in unassigned:
+            print(f"Machine ID {machine['machine_id']} is not scheduled: {machine['reason']}")
+    elif choice == 11:
+        text = input("Search parts, customers and machines for: ")
+        print("Parts:")
+        for item in session.inventory.search(text, limit=10):
+            print(f"  ID: {item.id}, Name: {item.item_name}, Description: {item.item_description}, "
+                  f"Quantity: {item.quantity}, Type: {item.machine_type}")
+        print("Customers:")
+        for customer in session.customer.search(text, limit=10):
+            print(f"  ID: {customer.id}, Name: {customer.name}, Address: {customer.address}, "
+                  f"Hours: {customer.operating_hours}")
+        print("Machines:")
+        for machine in session.machines.search(text, limit=10):
+            print(f"  ID: {machine.id}, Customer ID: {machine.customer_id}, {machine.manufacturer} {machine.name}, "
+                  f"Serial Number: {machine.serial_number}, Status: {machine.status}")
+    elif choice == 12:
+        print("Machines by type:")
+        session.machines.display_fleet_summary()
+        print("\nInventory by type:")
+        session.inventory.display_inventory_value()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Service Technician Management System")
+    parser.add_argument('--rebuild', action='store_true',
+                        help="drop and reload every table instead of syncing changes from the text files")
+    parser.add_argument('--batch', metavar='FILE',
+                        help="apply repair jobs (machine_id, item_id, quantity) from a JSON lines or CSV file, "
+                             "or '-' for stdin, then exit")
+    parser.add_argument('--batch-size', type=int, default=1000, help="repair jobs per transaction")
+    parser.add_argument('--export', nargs=2, metavar=('TABLE', 'FILE'),
+                        help="write the inventory, customers or machines table to FILE (JSON lines for a .jsonl "
+                             "file, CSV otherwise, '-' for CSV on stdout), then exit")
+    parser.add_argument('--stats', metavar='FILE',
+                        help="time every query and entity method and write the statistics to FILE on exit "
+                             "(Prometheus text for a .prom file, JSON otherwise)")
+    parser.add_argument('--slow-query-ms', type=float, metavar='MS',
+                        help="log queries slower than MS milliseconds with their query plan")
+    parser.add_argument('--profile', metavar='FILE',
+                        help="run the batch, or each menu action, under cProfile and save the stats to FILE")
+    parser.add_argument('--fast', action='store_true',
+                        help="start quickly for scripted use: no animated banner, and each table is loaded only "
+                             "when an action first needs it")
+    parser.add_argument('--snapshot', metavar='FILE',
+                        help="prebuilt database snapshot: restore it when the database is missing and it matches "
+                             "the text files, otherwise save a fresh one after loading every table")
+    parser.add_argument('--parse-cache', metavar='DIR',
+                        help="cache the parsed text files in DIR, so loading an unchanged file skips parsing it")
+    parser.add_argument('--in-memory', metavar='FILE',
+                        help="keep the database in memory, recovering it from FILE on start-up and saving it "
+                             "back to FILE in the background and on exit")
+    parser.add_argument('--snapshot-interval', type=float, default=30.0, metavar='SECONDS',
+                        help="with --in-memory, seconds between background saves of a changed database")
+    parser.add_argument('--snapshot-changes', type=int, default=10000, metavar='ROWS',
+                        help="with --in-memory, also save once this many rows have changed")
+    args = parser.parse_args()
+    if args.in_memory and args.snapshot:
+        parser.error("--in-memory and --snapshot can't be combined")
+
+    db_file = 'inventory.db'
+    options = {}
+    if args.in_memory:
+        db_file = ':memory:'
+        options = {'snapshot_path': args.in_memory, 'snapshot_interval': args.snapshot_interval,
+                   'snapshot_changes': args.snapshot_changes}
+    refresh_snapshot = False
+    if args.snapshot:
+        problems = ["--rebuild was given"] if args.rebuild else snapshot_problems(args.snapshot)
+        if problems:
+            refresh_snapshot = True
+            print(f"Refreshing snapshot: {'; '.join(problems)}", file=sys.stderr)
+        elif not os.path.exists(db_file):
+            restore_snapshot(args.snapshot, db_file)
+
+    instrument = bool(args.stats or args.slow_query_ms is not None)
+    if args.slow_query_ms is not None:
+        logging.basicConfig(format='%(levelname)s %(message)s')
+    session = Session(db_file, rebuild=args.rebuild, cache_dir=args.parse_cache, instrument=instrument,
+                      slow_query_ms=args.slow_query_ms, **options)
+    if not args.fast or refresh_snapshot:
+        for entity_class in (Inventory, Customer, Machines):
+            session.entity(entity_class)
+    if refresh_snapshot:
+        save_snapshot(session.db.connection(), args.snapshot)
+    if args.fast:
+        print(f"Ready in {(time.perf_counter() - STARTED) * 1000:.0f} ms", file=sys.stderr)
+
+    if args.export:
+        table, export_path = args.export
+        if table not in SOURCE_FILES:
+            parser.error(f"TABLE should be one of: {', '.join(SOURCE_FILES)}")
+        entity = session.entity({'inventory': Inventory, 'customers': Customer, 'machines': Machines}[table])
+        print(f"Exported {entity.export(export_path):,} rows", file=sys.stderr)
+        sys.exit()
+
+    if args.batch:
+        session.inventory  # repairs deduct stock, so load the inventory table too
+        machines = session.machines
+        jobs_file = sys.stdin if args.batch == '-' else open(args.batch, 'r')
+        if args.profile:
+            profile_call(run_batch_repairs, machines, jobs_file, args.batch_size, output=args.profile)
+        else:
+            run_batch_repairs(machines, jobs_file, args.batch_size)
+        jobs_file.close()
+        if args.stats:
+            session.db.instrumentation.write(args.stats)
+        sys.exit()
+
+    session.simulate_issues = True
+    if args.fast:
+        print("Welcome To the Service Technician Management System!")
+    else:
+        session.machines  # mark machines in need of repair up front, as before
+        printf("Welcome To the Service Technician Management System!")
     while True:
         try:
             print("\nPick an option below: ")
@@ -444,42 +3686,24 @@ if __name__ == "__main__":
                 "1. View Machines in Need of Repair\n2. Calculate Distance Between Two Customer Locations\n"
                 "3. View Inventory\n4. View Customers\n"
                 "5. View All machines and Their Locations\n6. View Service History\n7. View All Machines That Are Able"
-                " ""To Be Ordered\nType 'quit' to exit")
-            choice = input('Choice 1-7: ')
+                " ""To Be Ordered\n8. Plan a Route to All Machines in Need of Repair\n"
+                "9. View Low Stock and Suggested Orders\n10. Dispatch Technicians to Machines in Need of Repair\n"
+                "11. Search Parts, Customers and Machines\n12. View Fleet and Inventory Summary\nType 'quit' to exit")
+            choice = input('Choice 1-12: ')
             print()
 
             if choice.lower() == 'quit':
                 print("Thank you for using the Service Technician Management System. Goodbye!")
+                if args.stats:
+                    session.db.instrumentation.write(args.stats)
                 break
 
             choice = int(choice)
 
-            if choice == 1:
-                print("Here is a list of all machines in need of repair: ")
-                machines.display_machines_repair()
-                # Ask the user for the machine ID to repair
-                machine_id = int(input("Enter the ID of the machine to repair: "))
-                machines.repair_machine(machine_id, inventory)
-            elif choice == 2:
-                print("Here is a list of all machines at all locations: ")
-                customer.display_customers()
-                customer1_id = int(input("Choose the first customer ID you'd like to start from: "))
-                customer2_id = int(input("Choose the second customer ID you'd like to stop at: "))
-                customer1_coordinates = customer.get_coordinates_by_id(customer1_id)
-                customer2_coordinates = customer.get_coordinates_by_id(customer2_id)
-                distance = haversine(customer1_coordinates, customer2_coordinates)
-
-                print(f"The distance between the two customers is {distance:.2f} miles.")
-            elif choice == 3:
-                inventory.display_inventory()
-            elif choice == 4:
-                customer.display_customers()
-            elif choice == 5:
-                machines.display_machines()
-            elif choice == 6:
-                machines.display_service_history()
-            elif choice == 7:
-                machines.display_distinct_machines()
+            if args.profile:
+                profile_call(run_menu_action, choice, session, output=args.profile)
+            else:
+                run_menu_action(choice, session)
 
         except ValueError:
             print("Invalid input. Please enter a valid number or 'quit' to exit.")
@@ -0,0 +1,209 @@
+import argparse
+import asyncio
+import json
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+from Inventory_Management import Inventory, Customer, Machines, repair_job, sqlite_integer
+
+logger = logging.getLogger(__name__)
+
+REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    409: 'Conflict',
+    500: 'Internal Server Error',
+}
+
+
+class InventoryService:
+    """ Local HTTP/JSON front end for Inventory, Customer and Machines.
+
+    Routes:
+        GET /repairs                      machines in need of repair
+        POST /repairs                     {"machine_id", "item_id", "quantity"}
+        GET /distance?from=ID&to=ID       miles between two customers
+        GET /inventory?machine_type=TYPE  parts for a machine type
+        GET /reports/catalog              machine models installed, with counts
+        GET /reports/fleet                machines and repairs needed per type, or
+                                          at one customer with ?customer_id=ID
+        GET /reports/inventory            stock and its value per machine type
+
+    SQLite calls run on a bounded thread pool so the event loop never
+    blocks, at most max_concurrency requests are executing at once (the
+    rest wait their turn), and HTTP/1.1 connections are kept alive for
+    keep_alive seconds between requests. A client also has keep_alive
+    seconds to send a request's headers and again its body, which may be
+    at most max_body bytes.
+    """
+
+    def __init__(self, db_file='inventory.db', workers=8, max_concurrency=64, keep_alive=15.0, max_body=1048576):
+        self.inventory = Inventory(db_file=db_file, rebuild=False)
+        self.customer = Customer(db_file=db_file, rebuild=False)
+        self.machines = Machines(db_file=db_file, rebuild=False)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sqlite')
+        self.limit = asyncio.Semaphore(max_concurrency)
+        self.keep_alive = keep_alive
+        self.max_body = max_body
+        self.routes = {
+            ('GET', '/repairs'): self.list_repairs,
+            ('POST', '/repairs'): self.repair,
+            ('GET', '/distance'): self.distance,
+            ('GET', '/inventory'): self.inventory_by_type,
+            ('GET', '/reports/catalog'): self.catalog_report,
+            ('GET', '/reports/fleet'): self.fleet_report,
+            ('GET', '/reports/inventory'): self.inventory_report,
+        }
+
+    def list_repairs(self, query, body):
+        rows = self.machines.get_machines_by_status('Need Repair')
+        return 200, [machine.as_dict() for machine in rows]
+
+    def repair(self, query, body):
+        job = json.loads(body or b'{}')
+        if not isinstance(job, dict):
+            return 400, {'error': "Expected a JSON object"}
+        job = repair_job(job)
+        try:
+            return 200, self.machines.apply_repair(job['machine_id'], job['item_id'], job['quantity'])
+        except ValueError as e:
+            return 409, {'error': str(e)}
+
+    def distance(self, query, body):
+        customer1_id, customer2_id = sqlite_integer(query['from']), sqlite_integer(query['to'])
+        try:
+            miles = self.customer.distance_between(customer1_id, customer2_id)
+        except ValueError as e:
+            return 404, {'error': str(e)}
+        return 200, {'from': customer1_id, 'to': customer2_id, 'miles': miles}
+
+    def inventory_by_type(self, query, body):
+        items = self.inventory.get_items_by_type(query['machine_type'])
+        return 200, [item.as_dict() for item in items]
+
+    def catalog_report(self, query, body):
+        return 200, [{'manufacturer': manufacturer, 'name': name, 'machines': machines}
+                     for manufacturer, name, machines in self.machines.catalog()]
+
+    def fleet_report(self, query, body):
+        if 'customer_id' in query:
+            customer_id = sqlite_integer(query['customer_id'])
+            return 200, dict(self.machines.customer_fleet(customer_id), customer_id=customer_id)
+        return 200, self.machines.fleet_by_type()
+
+    def inventory_report(self, query, body):
+        return 200, self.inventory.inventory_value()
+
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        handler = self.routes.get((method, url.path))
+        if handler is None:
+            if any(path == url.path for _, path in self.routes):
+                return 405, {'error': f"{method} is not supported for {url.path}"}
+            return 404, {'error': f"No route for {url.path}"}
+
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        async with self.limit:
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self.executor, handler, query, body)
+            except KeyError as e:
+                return 400, {'error': f"Missing parameter {e}"}
+            except ValueError as e:
+                return 400, {'error': str(e)}
+            except sqlite3.Error as e:
+                return 500, {'error': str(e)}
+            except Exception:
+                # A bug in a handler still gets an answer rather than a dropped connection.
+                logger.exception("%s %s failed", method, target)
+                return 500, {'error': "Internal error"}
+
+    async def read_headers(self, reader):
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                return headers
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), self.keep_alive)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line:
+                    break
+
+                try:
+                    headers = await asyncio.wait_for(self.read_headers(reader), self.keep_alive)
+                    method, target, version = request_line.decode('latin-1').split()
+                    length = int(headers.get('content-length', 0))
+                except asyncio.TimeoutError:
+                    break
+                except ValueError:
+                    self.write_response(writer, 400, {'error': "Malformed request"}, False)
+                    break
+                if not 0 <= length <= self.max_body:
+                    self.write_response(writer, 400, {'error': f"Content-Length must be 0 to {self.max_body}"}, False)
+                    break
+                try:
+                    body = await asyncio.wait_for(reader.readexactly(length), self.keep_alive) if length else b''
+                except asyncio.TimeoutError:
+                    break
+
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection == 'keep-alive' or (version == 'HTTP/1.1' and connection != 'close')
+                status, payload = await self.dispatch(method.upper(), target, body)
+                self.write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def write_response(self, writer, status, payload, keep_alive):
+        data = json.dumps(payload).encode()
+        writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                     f"Content-Type: application/json\r\n"
+                     f"Content-Length: {len(data)}\r\n"
+                     f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + data)
+
+    async def start(self, host='127.0.0.1', port=8080):
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+async def serve(args):
+    service = InventoryService(args.db, args.workers, args.max_concurrency, args.keep_alive, args.max_body)
+    server = await service.start(args.host, args.port)
+    print(f"Serving {args.db} on http://{args.host}:{server.sockets[0].getsockname()[1]}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP/JSON service for the Service Technician Management System")
+    parser.add_argument('--db', default='inventory.db')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=8, help="threads running SQLite work")
+    parser.add_argument('--max-concurrency', type=int, default=64, help="requests executing at once")
+    parser.add_argument('--keep-alive', type=float, default=15.0, help="idle seconds before closing a connection")
+    parser.add_argument('--max-body', type=int, default=1048576, help="largest request body accepted, in bytes")
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
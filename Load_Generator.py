@@ -0,0 +1,82 @@
+import argparse
+import asyncio
+import json
+import time
+
+DEFAULT_PATHS = ['/inventory?machine_type=Kiosk', '/distance?from=1&to=2', '/repairs']
+
+
+async def fetch(reader, writer, method, path, body=None):
+    """ Send one request over a kept-alive connection and read the JSON
+    response.
+
+    Returns:
+        tuple: (status code, decoded payload)
+    """
+    data = json.dumps(body).encode() if body is not None else b''
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(data)}\r\n\r\n".encode()
+                 + data)
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def client(host, port, paths, offset, deadline, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        i = offset
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            status, _ = await fetch(reader, writer, 'GET', paths[i % len(paths)])
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(status)
+            i += 1
+    finally:
+        writer.close()
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def run_level(host, port, concurrency, duration, paths):
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*(client(host, port, paths, i, deadline, latencies, errors) for i in range(concurrency)))
+    latencies.sort()
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': len(errors),
+        'rps': len(latencies) / duration,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+async def main(args):
+    print(f"{'concurrency':>12}{'requests':>10}{'errors':>8}{'req/sec':>10}{'p50 (ms)':>10}{'p99 (ms)':>10}")
+    for concurrency in args.concurrency:
+        result = await run_level(args.host, args.port, concurrency, args.duration, args.paths)
+        print(f"{result['concurrency']:>12}{result['requests']:>10}{result['errors']:>8}{result['rps']:>10.0f}"
+              f"{result['p50_ms']:>10.2f}{result['p99_ms']:>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load generator for Inventory_Service.py")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--duration', type=float, default=5.0, help="seconds per concurrency level")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--paths', nargs='+', default=DEFAULT_PATHS, help="GET paths to cycle through")
+    asyncio.run(main(parser.parse_args()))